@@ -0,0 +1,158 @@
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from aganitha_chatbot_pipeline.filters import filter_sql
+
+_WORDS = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its of on or she that the their "
+    "them they this to was were what when where which who will with you your".split()
+)
+
+
+def terms(text: str) -> List[str]:
+    return [word for word in _WORDS.findall(text.lower()) if word not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index of chunk terms in SQLite, scored with Okapi BM25. It is written during
+       ingest next to the vector store, keyed by the same chunk ids: adding a chunk that is
+       already indexed replaces it and `delete` removes chunks. Document frequencies and the
+       corpus length are kept up to date on write, so a query only reads the postings of its
+       own terms. Searches read on a connection per thread and run alongside ingest. A
+       `read_only` index only searches, it opens an existing file without taking write locks"""
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, read_only: bool = False):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = self._connect()
+        if read_only:
+            return
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, "
+            "length INTEGER NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, id INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS chunks_source ON chunks (json_extract(metadata, '$.source'));"
+        )
+        self._conn.commit()
+
+    def add(self, chunk_ids: List[str], texts: List[str], metadatas: List[dict]) -> None:
+        # A chunk repeated in the batch is indexed once, as its last occurrence
+        chunks = {chunk_id: (text, metadata) for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas)}
+        with self._lock, self._conn:
+            self._remove(list(chunks))
+            postings, frequencies, length = [], Counter(), 0
+            for chunk_id, (text, metadata) in chunks.items():
+                counts = Counter(terms(text))
+                total = sum(counts.values())
+                row = self._conn.execute("INSERT INTO chunks (chunk_id, length, text, metadata) VALUES (?, ?, ?, ?)",
+                                         (chunk_id, total, text, json.dumps(metadata)))
+                postings.extend((term, row.lastrowid, tf) for term, tf in counts.items())
+                frequencies.update(counts.keys())
+                length += total
+            # In key order the inserts append to the postings tree instead of hitting random pages
+            self._conn.executemany("INSERT INTO postings (term, id, tf) VALUES (?, ?, ?)", sorted(postings))
+            self._conn.executemany("INSERT INTO terms (term, df) VALUES (?, ?) "
+                                   "ON CONFLICT (term) DO UPDATE SET df = df + excluded.df", frequencies.items())
+            self._count(len(chunks), length)
+
+    def delete(self, chunk_ids: List[str]) -> None:
+        with self._lock, self._conn:
+            self._remove(chunk_ids)
+
+    def update_metadata(self, updates: Dict[str, dict]) -> None:
+        """Merges fields into the metadata of indexed chunks, keyed by chunk id"""
+        with self._lock, self._conn:
+            for chunk_id, fields in updates.items():
+                row = self._conn.execute("SELECT metadata FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE chunks SET metadata = ? WHERE chunk_id = ?",
+                                       (json.dumps(dict(json.loads(row[0]), **fields)), chunk_id))
+
+    def search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """The k best chunks for the query terms among those matching the metadata filters"""
+        conn = self._reader()
+        counts = Counter(terms(query))
+        settings = dict(conn.execute("SELECT key, value FROM settings"))
+        total, length = settings.get("count", 0), settings.get("length", 0)
+        if not counts or not total:
+            return []
+        average = length / total
+        condition, params = filter_sql(filters, "c.metadata")
+        scores: Dict[int, float] = {}
+        for term, weight in counts.items():
+            row = conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+            if row is None:
+                continue
+            idf = math.log(1 + (total - row[0] + 0.5) / (row[0] + 0.5))
+            for i, tf, size in conn.execute(
+                    f"SELECT p.id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.id "
+                    f"WHERE p.term = ? AND {condition}", [term] + params):
+                norm = tf + self.k1 * (1 - self.b + self.b * size / average)
+                scores[i] = scores.get(i, 0.0) + weight * idf * tf * (self.k1 + 1) / norm
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        if not best:
+            return []
+        marks = ",".join("?" * len(best))
+        rows = {i: (text, json.loads(metadata)) for i, text, metadata in conn.execute(
+            f"SELECT id, text, metadata FROM chunks WHERE id IN ({marks})", [i for i, _ in best])}
+        return [(Document(page_content=rows[i][0], metadata=rows[i][1]), score) for i, score in best if i in rows]
+
+    def __len__(self) -> int:
+        row = self._reader().execute("SELECT value FROM settings WHERE key = 'count'").fetchone()
+        return row[0] if row else 0
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"{Path(self.path).absolute().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def _remove(self, chunk_ids: List[str]) -> None:
+        removed, length, frequencies = 0, 0, Counter()
+        for chunk_id in chunk_ids:
+            row = self._conn.execute("SELECT id, length, text FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            i, size, text = row
+            chunk_terms = set(terms(text))
+            self._conn.executemany("DELETE FROM postings WHERE term = ? AND id = ?", [(term, i) for term in chunk_terms])
+            self._conn.execute("DELETE FROM chunks WHERE id = ?", (i,))
+            frequencies.update(chunk_terms)
+            removed += 1
+            length += size
+        if removed:
+            self._conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?",
+                                   [(count, term) for term, count in frequencies.items()])
+            self._conn.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", [(term,) for term in frequencies])
+            self._count(-removed, -length)
+
+    def _count(self, chunks: int, length: int) -> None:
+        self._conn.executemany(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value",
+            [("count", chunks), ("length", length)])
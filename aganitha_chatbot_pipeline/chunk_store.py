@@ -0,0 +1,265 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from langchain.docstore.document import Document
+
+from aganitha_chatbot_pipeline.manifest import content_hash, source_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    # Optional, installed with the chunk-store extra
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("arrow", "parquet")
+# Chunk fields kept in columns of their own, the rest of the metadata is the source's
+CHUNK_FIELDS = ("chunk_id", "start_index", "end_index", "sources")
+# Written when the dataset is created, its id tells this dataset from one created again in its place
+DATASET_FILE = "dataset.json"
+
+
+class ChunkStore:
+    """Every indexed chunk in a columnar dataset under `path`, one partition directory per
+       source: chunk ids, texts, offsets, the source's metadata and optionally the embedding.
+       Metadata is dictionary-encoded, so a source's metadata is stored once however many
+       chunks it has.
+
+       The "arrow" format is Arrow IPC, read back by memory-mapping the files without copying
+       or decoding, "parquet" is compressed for shipping the dataset elsewhere. Chunks added
+       during a run go to pending files and `commit` compacts every touched partition into its
+       one file, so readers only ever see whole runs. Any vector store can be rebuilt from the
+       dataset, without extracting or, with vectors stored, embedding anything again.
+       `id` is assigned when the dataset is created, it changes if the directory is deleted"""
+
+    def __init__(self, path: str, format: str = "arrow"):
+        if pa is None:
+            raise ImportError("You must run `pip install pyarrow` to use the chunk store.")
+        if format not in FORMATS:
+            raise ValueError(f"chunk store format must be one of {FORMATS}, not {format!r}")
+        self.path = path
+        self.format = format
+        self.run = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self._pending: Dict[str, List[str]] = {}
+        self._updates: Dict[str, dict] = {}
+        os.makedirs(path, exist_ok=True)
+        self.id = self._dataset_id()
+        # Pending files of runs that failed before their commit
+        for stale in glob.glob(os.path.join(path, "*", "pending-*")):
+            os.remove(stale)
+
+    def add(self, docs: List[Document], vectors: Optional[Any] = None) -> None:
+        """Writes the chunks, and their vectors if given, to pending files of their sources"""
+        rows: Dict[str, List[int]] = {}
+        for position, doc in enumerate(docs):
+            rows.setdefault(source_key(doc.metadata), []).append(position)
+        for source, positions in rows.items():
+            table = _table([docs[position] for position in positions],
+                           [vectors[position] for position in positions] if vectors is not None else None, source)
+            directory = self._directory(source)
+            os.makedirs(directory, exist_ok=True)
+            pending = os.path.join(directory, f"pending-{self.run}-{len(self._pending.get(source, []))}.{self.format}")
+            self._write(table, pending)
+            self._pending.setdefault(source, []).append(pending)
+
+    def update_metadata(self, updates: Dict[str, dict]) -> None:
+        """Merges fields into the metadata of stored chunks, keyed by chunk id, on `commit`"""
+        for chunk_id, fields in updates.items():
+            self._updates.setdefault(chunk_id, {}).update(fields)
+
+    def commit(self, chunk_ids: Optional[Dict[str, Set[str]]] = None, removed: Iterable[str] = (),
+               retained: Set[str] = frozenset()) -> None:
+        """Compacts the partitions of this run. With `chunk_ids`, the chunks each re-processed
+           source holds after the run, a partition keeps its stored chunks among them and drops
+           the rest; without, the sources added to in this run are replaced by what was added.
+           Removed sources lose their partition. Chunks in `retained`, deduplicated chunks that
+           other sources still hold, stay wherever they are stored"""
+        removed = list(removed)
+        for source in removed:
+            if retained:
+                self._compact(source, set(retained), True)
+            else:
+                shutil.rmtree(self._directory(source), ignore_errors=True)
+        sources = set(self._pending) | set(chunk_ids or {})
+        for source in sources:
+            keep = chunk_ids.get(source, set()) | retained if chunk_ids is not None else None
+            self._compact(source, keep, chunk_ids is not None)
+        if self._updates:
+            # Provenance of chunks whose partition was not rewritten above
+            for file in self.files():
+                source = self._source_of(file)
+                if source in sources:
+                    continue
+                ids = set(self._read(file, ["chunk_id"]).column("chunk_id").to_pylist())
+                if not ids.isdisjoint(self._updates):
+                    self._compact(source, None, True)
+        self._pending.clear()
+        self._updates.clear()
+        logger.info(f"chunk store updated for {len(sources)} sources, {len(removed)} removed")
+
+    def files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "*", f"chunks.{self.format}")))
+
+    def read(self, columns: Optional[List[str]] = None) -> "pa.Table":
+        """Every stored chunk as one table, memory-mapped"""
+        tables = [self._read(file, columns) for file in self.files()]
+        if not tables:
+            return pa.table({"chunk_id": pa.array([], pa.string())})
+        return pa.concat_tables(tables, promote_options="default")
+
+    def iter_chunks(self, batch_size: int = 512) -> Iterator[Tuple[List[Document], Optional[List[Any]]]]:
+        """Stored chunks as Documents, the way the pipeline indexes them, in batches of about
+           `batch_size` with their vectors: None for a batch without any, None for a chunk
+           stored without one"""
+        docs: List[Document] = []
+        vectors: List[Any] = []
+        for file in self.files():
+            table = self._read(file)
+            for batch in table.to_batches():
+                docs.extend(documents(batch))
+                vectors.extend(_vectors(batch))
+                if len(docs) >= batch_size:
+                    yield docs, vectors if any(vector is not None for vector in vectors) else None
+                    docs, vectors = [], []
+        if docs:
+            yield docs, vectors if any(vector is not None for vector in vectors) else None
+
+    def stats(self) -> Dict[str, Any]:
+        files = self.files()
+        chunks = sum(self._rows(file) for file in files)
+        return {"sources": len(files), "chunks": chunks,
+                "bytes": sum(os.path.getsize(file) for file in files), "format": self.format}
+
+    def _compact(self, source: str, keep: Optional[Set[str]], merge: bool) -> None:
+        directory = self._directory(source)
+        committed = os.path.join(directory, f"chunks.{self.format}")
+        pending = self._pending.get(source, [])
+        tables = [self._read(file) for file in pending]
+        if merge and os.path.exists(committed):
+            tables.insert(0, self._read(committed))
+        if not tables:
+            return
+        table = pa.concat_tables(tables, promote_options="default").unify_dictionaries()
+        # Later rows win: a chunk added in this run replaces the stored one
+        ids = table.column("chunk_id").to_pylist()
+        seen: Set[str] = set()
+        mask = [False] * len(ids)
+        for position in range(len(ids) - 1, -1, -1):
+            chunk_id = ids[position]
+            if chunk_id not in seen and (keep is None or chunk_id in keep):
+                seen.add(chunk_id)
+                mask[position] = True
+        table = table.filter(pa.array(mask))
+        if self._updates and not seen.isdisjoint(self._updates):
+            table = _updated(table, self._updates, source)
+        if table.num_rows == 0:
+            # A changed source that no longer yields any chunk
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        partial = os.path.join(directory, f"pending-{self.run}-compact.{self.format}")
+        self._write(table.combine_chunks(), partial)
+        # Readers holding the previous file keep their mapping of it
+        os.replace(partial, committed)
+        for file in pending:
+            os.remove(file)
+
+    def _dataset_id(self) -> str:
+        marker = os.path.join(self.path, DATASET_FILE)
+        if os.path.exists(marker):
+            with open(marker) as f:
+                return json.load(f)["id"]
+        dataset_id = uuid.uuid4().hex
+        with open(marker + ".tmp", "w") as f:
+            json.dump({"id": dataset_id, "created_at": time.time()}, f)
+        os.replace(marker + ".tmp", marker)
+        return dataset_id
+
+    def _directory(self, source: str) -> str:
+        return os.path.join(self.path, f"source={content_hash(source)[:24]}")
+
+    def _source_of(self, file: str) -> str:
+        schema = pa.ipc.open_file(pa.memory_map(file)).schema if self.format == "arrow" else pq.read_schema(file)
+        return schema.metadata[b"source"].decode("utf-8")
+
+    def _read(self, file: str, columns: Optional[List[str]] = None) -> "pa.Table":
+        if self.format == "arrow":
+            table = pa.ipc.open_file(pa.memory_map(file)).read_all()
+            return table.select([column for column in columns if column in table.column_names]) if columns else table
+        return pq.read_table(file, columns=columns, memory_map=True)
+
+    def _rows(self, file: str) -> int:
+        if self.format == "arrow":
+            reader = pa.ipc.open_file(pa.memory_map(file))
+            return sum(reader.get_batch(number).num_rows for number in range(reader.num_record_batches))
+        return pq.ParquetFile(file).metadata.num_rows
+
+    def _write(self, table: "pa.Table", file: str) -> None:
+        if self.format == "arrow":
+            with pa.OSFile(file, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, file, compression="zstd")
+
+
+def documents(batch: "pa.RecordBatch") -> List[Document]:
+    """The chunks of a batch as Documents, metadata is decoded once per distinct value"""
+    column = batch.column("metadata")
+    shared = [json.loads(value) for value in column.dictionary.to_pylist()]
+    indices = column.indices.to_pylist()
+    sources = batch.column("sources").to_pylist()
+    docs = []
+    for position, (chunk_id, text, start, end) in enumerate(zip(
+            batch.column("chunk_id").to_pylist(), batch.column("text").to_pylist(),
+            batch.column("start_index").to_pylist(), batch.column("end_index").to_pylist())):
+        metadata = dict(shared[indices[position]], chunk_id=chunk_id, start_index=start, end_index=end)
+        if sources[position] is not None:
+            metadata["sources"] = sources[position]
+        docs.append(Document(page_content=text, metadata=metadata))
+    return docs
+
+
+def _vectors(batch: "pa.RecordBatch") -> List[Any]:
+    if "vector" not in batch.schema.names:
+        return [None] * batch.num_rows
+    column = batch.column("vector")
+    if column.null_count == 0:
+        # A view of the mapped file, nothing is copied
+        return list(column.flatten().to_numpy().reshape(batch.num_rows, column.type.list_size))
+    return column.to_pylist()
+
+
+def _table(docs: List[Document], vectors: Optional[List[Any]], source: str) -> "pa.Table":
+    shared = [json.dumps({key: value for key, value in doc.metadata.items() if key not in CHUNK_FIELDS},
+                         sort_keys=True) for doc in docs]
+    columns = {
+        "chunk_id": pa.array([doc.metadata["chunk_id"] for doc in docs], pa.string()),
+        "text": pa.array([doc.page_content for doc in docs], pa.string()),
+        "start_index": pa.array([doc.metadata.get("start_index") for doc in docs], pa.int64()),
+        "end_index": pa.array([doc.metadata.get("end_index") for doc in docs], pa.int64()),
+        "metadata": pa.array(shared, pa.string()).dictionary_encode(),
+        "sources": pa.array([doc.metadata.get("sources") for doc in docs], pa.list_(pa.string())),
+    }
+    present = [vector for vector in vectors or [] if vector is not None]
+    if present:
+        columns["vector"] = pa.array([[float(value) for value in vector] if vector is not None else None
+                                      for vector in vectors], pa.list_(pa.float32(), len(present[0])))
+    return pa.table(columns).replace_schema_metadata({"source": source})
+
+
+def _updated(table: "pa.Table", updates: Dict[str, dict], source: str) -> "pa.Table":
+    """The table with metadata updates applied, a chunk whose source metadata changes gets a
+       dictionary entry of its own"""
+    docs = [doc for batch in table.to_batches() for doc in documents(batch)]
+    for doc in docs:
+        doc.metadata.update(updates.get(doc.metadata["chunk_id"], {}))
+    vectors = [vector for batch in table.to_batches() for vector in _vectors(batch)]
+    return _table(docs, vectors, source)
@@ -0,0 +1,96 @@
+import re
+from typing import Callable, List, Optional, Tuple
+
+from aganitha_chatbot_pipeline.embedding_engine import token_counter
+
+# Boundaries from the coarsest to the finest: paragraphs, lines (sheet rows, list items),
+# sentences and words. A piece ends after the boundary that closes it
+BOUNDARIES = [
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"\n\s*"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+]
+
+# No tokenizer produces fewer tokens than this many characters per token on real text, longer
+# spans are split further without being counted
+_MAX_CHARS_PER_TOKEN = 8
+
+
+class Chunker:
+    """Splits text into chunks of at most `chunk_tokens` tokens that overlap by up to
+       `overlap_tokens`. Text is cut at the coarsest boundary that yields pieces within the limit,
+       paragraphs first, then lines, sentences and words, and the pieces are packed back together
+       in order. Chunks are (start, end) character spans into the text, nothing is split and
+       re-joined"""
+
+    def __init__(self, chunk_tokens: int = 256, overlap_tokens: int = 32, model: str = "text-embedding-ada-002",
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.model = model
+        self.count_tokens = count_tokens or token_counter(model)
+
+    def __repr__(self) -> str:
+        return f"Chunker({self.chunk_tokens}, {self.overlap_tokens}, {self.model})"
+
+    def split(self, text: str) -> List[Tuple[int, int]]:
+        """Character spans of the chunks, stripped of surrounding whitespace"""
+        units = self._units(text, 0, len(text), 0)
+        spans = []
+        for start, end in self._pack(units):
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if start < end:
+                spans.append((start, end))
+        return spans
+
+    def _units(self, text: str, start: int, end: int, level: int) -> List[Tuple[int, int, int]]:
+        """Pieces of text[start:end] within the token limit, as (start, end, tokens)"""
+        if end - start <= self.chunk_tokens * _MAX_CHARS_PER_TOKEN:
+            tokens = self.count_tokens(text[start:end])
+            if tokens <= self.chunk_tokens:
+                return [(start, end, tokens)]
+        if level == len(BOUNDARIES):
+            return self._hard_split(text, start, end)
+        cuts = [match.end() for match in BOUNDARIES[level].finditer(text, start, end) if start < match.end() < end]
+        if not cuts:
+            return self._units(text, start, end, level + 1)
+        units: List[Tuple[int, int, int]] = []
+        for piece_start, piece_end in zip([start] + cuts, cuts + [end]):
+            units.extend(self._units(text, piece_start, piece_end, level + 1))
+        return units
+
+    def _hard_split(self, text: str, start: int, end: int) -> List[Tuple[int, int, int]]:
+        """A run without any boundary, cut into equal character windows that fit the limit"""
+        tokens = max(1, self.count_tokens(text[start:end]))
+        width = max(1, (end - start) * self.chunk_tokens // tokens)
+        units = []
+        for piece_start in range(start, end, width):
+            piece_end = min(end, piece_start + width)
+            units.append((piece_start, piece_end, min(self.chunk_tokens, self.count_tokens(text[piece_start:piece_end]))))
+        return units
+
+    def _pack(self, units: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+        """Packs consecutive units up to the limit, each chunk starts with the trailing units of
+           the previous one that fit in the overlap"""
+        chunks = []
+        first = 0
+        while first < len(units):
+            last, tokens = first, 0
+            while last < len(units) and (last == first or tokens + units[last][2] <= self.chunk_tokens):
+                tokens += units[last][2]
+                last += 1
+            chunks.append((units[first][0], units[last - 1][1]))
+            if last == len(units):
+                break
+            next_first, overlap = last, 0
+            while next_first - 1 > first and overlap + units[next_first - 1][2] <= self.overlap_tokens:
+                next_first -= 1
+                overlap += units[next_first][2]
+            first = next_first
+        return chunks
@@ -0,0 +1,127 @@
+import os
+import re
+import sqlite3
+import tempfile
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aganitha_chatbot_pipeline.manifest import content_hash
+
+_WORDS = re.compile(r"\w+")
+# Largest prime below 2**32, signatures stay within uint32
+_PRIME = np.uint64(4294967291)
+# Page cache of the scratch database in KiB, and survivors recorded per transaction
+CACHE_KIB = 16 * 1024
+COMMIT_EVERY = 1024
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) splitting the signature so that the LSH curve crosses at about the threshold"""
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class Deduplicator:
+    """Finds chunks that repeat one seen earlier in the run. Exact duplicates match on the hash of
+       the lower-cased words, near duplicates on a MinHash of word shingles: signatures are split
+       into LSH bands, chunks sharing a band are candidates and a candidate whose estimated
+       Jaccard similarity reaches `threshold` is a duplicate.
+
+       Hashes, signatures and band buckets of the surviving chunks go to a SQLite file in
+       `directory` (the temporary directory by default) that `close` deletes, so memory stays
+       at SQLite's page cache however many chunks a run has.
+
+       The first chunk of a group survives, `sources` lists every source that produced it when
+       there is more than one"""
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 5, seed: int = 1,
+                 directory: Optional[str] = None):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        # a below 2**31 keeps a * hash + b within uint64
+        self._a = rng.randint(1, 2 ** 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+        handle, self.path = tempfile.mkstemp(prefix="dedup-", suffix=".sqlite", dir=directory)
+        os.close(handle)
+        self._conn = sqlite3.connect(self.path)
+        # Scratch data of this run only, nothing needs to survive a crash
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self._conn.execute("CREATE TABLE exact (hash TEXT PRIMARY KEY, chunk_id TEXT NOT NULL) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE signatures (chunk_id TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+                           "signature BLOB NOT NULL) WITHOUT ROWID")
+        # A bucket key is the band number followed by the band's rows of the signature
+        self._conn.execute("CREATE TABLE buckets (key BLOB NOT NULL, chunk_id TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX buckets_key ON buckets (key)")
+        self._uncommitted = 0
+        self.sources: Dict[str, List[str]] = {}
+        self.dropped = 0
+
+    def find(self, chunk_id: str, text: str, source: str) -> Optional[str]:
+        """Returns the id of the surviving chunk if the text duplicates one already seen,
+           otherwise records the chunk as a survivor and returns None"""
+        words = _WORDS.findall(text.lower())
+        exact = content_hash(" ".join(words))
+        row = self._conn.execute("SELECT chunk_id FROM exact WHERE hash = ?", (exact,)).fetchone()
+        survivor = row[0] if row else None
+        signature = None
+        keys: List[bytes] = []
+        if survivor is None:
+            signature = self.signature(words)
+            keys = self._bands(signature)
+            survivor = self._near(signature, keys)
+        if survivor is not None and survivor != chunk_id:
+            if survivor not in self.sources:
+                owner, = self._conn.execute("SELECT owner FROM signatures WHERE chunk_id = ?", (survivor,)).fetchone()
+                self.sources[survivor] = [owner]
+            if source not in self.sources[survivor]:
+                self.sources[survivor].append(source)
+            self.dropped += 1
+            return survivor
+        if survivor is None:
+            self._conn.execute("INSERT OR IGNORE INTO exact (hash, chunk_id) VALUES (?, ?)", (exact, chunk_id))
+            self._conn.execute("INSERT OR REPLACE INTO signatures (chunk_id, owner, signature) VALUES (?, ?, ?)",
+                               (chunk_id, source, signature.tobytes()))
+            self._conn.executemany("INSERT INTO buckets (key, chunk_id) VALUES (?, ?)",
+                                   [(key, chunk_id) for key in keys])
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                # Lets SQLite write its dirty pages out instead of holding them in memory
+                self._conn.commit()
+                self._uncommitted = 0
+        return None
+
+    def signature(self, words: List[str]) -> np.ndarray:
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                             count=len(shingles))
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def close(self) -> None:
+        self._conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return [band.to_bytes(2, "big") + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def _near(self, signature: np.ndarray, keys: List[bytes]) -> Optional[str]:
+        marks = ",".join("?" * len(keys))
+        rows = self._conn.execute(
+            f"SELECT chunk_id, signature FROM signatures WHERE chunk_id IN "
+            f"(SELECT chunk_id FROM buckets WHERE key IN ({marks}))", keys).fetchall()
+        best, best_similarity = None, self.threshold
+        for candidate, stored in rows:
+            similarity = float(np.mean(np.frombuffer(stored, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
@@ -0,0 +1,415 @@
+"""Ingestion spread over worker processes and nodes. The coordinator enumerates the changed
+sources against the manifest and queues one work item per file, page list entry or recording;
+workers anywhere claim items, do the downloading, parsing, crawling and transcription and store
+the documents in the queue. The coordinator streams finished documents through the pipeline, so
+chunking, embedding and the vector store, keyword index and manifest keep a single writer.
+
+A killed coordinator or worker loses nothing that was finished: leases of a dead worker run out
+and its items go to another, and a coordinator started again re-enqueues the same items, keeps
+the finished ones and ingests them without fetching them again.
+
+Like the queue file, the knowledge and video directories have to be on a filesystem every node
+mounts at the same path: knowledge and video items are paths the coordinator listed, and Drive
+recordings are downloaded into the video directory for the coordinator to list. The coordinator
+leaves a marker in each directory and a worker that cannot see it leaves those items to others."""
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import typer
+from langchain.docstore.document import Document
+
+from aganitha_chatbot_pipeline import metrics, plugins
+from aganitha_chatbot_pipeline.manifest import content_hash
+from aganitha_chatbot_pipeline.parsing import ParserPool, mime_type
+from aganitha_chatbot_pipeline.pdf_engine import PdfExtractor
+from aganitha_chatbot_pipeline.pipeline import Pipeline
+from aganitha_chatbot_pipeline.work_queue import WorkItem, WorkQueue
+
+logger = logging.getLogger(__name__)
+app = typer.Typer()
+
+SOURCE_TYPES = ("gdrive", "website", "knowledge_directory", "video")
+# Items written to the queue per transaction while a source is enumerated
+ENQUEUE_BATCH = 100
+# Written by the coordinator into every directory workers read from or download into
+SHARED_MARKER = ".aganitha-coordinator"
+
+
+def open_queue(pipeline: Pipeline) -> WorkQueue:
+    settings = pipeline.work_queue
+    return WorkQueue(settings.get("PATH", "work_queue.sqlite"), settings.get("LEASE_SECONDS", 600),
+                     settings.get("MAX_ATTEMPTS", 3), settings.get("RETRY_DELAY", 30))
+
+
+def share_directories(queue: WorkQueue, directories: Dict[str, List[str]]) -> None:
+    """Marks the directories that items of the given source types need with a token of this
+       coordinator run and publishes the tokens in the queue, for workers to check they see
+       the same directories"""
+    token = uuid.uuid4().hex
+    shared: Dict[str, Any] = {}
+    for directory, source_types in directories.items():
+        directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, SHARED_MARKER + ".tmp"), "w") as f:
+            f.write(token)
+        os.replace(os.path.join(directory, SHARED_MARKER + ".tmp"), os.path.join(directory, SHARED_MARKER))
+        shared[directory] = [token, sorted(set(shared.get(directory, [None, []])[1]) | set(source_types))]
+    queue.set("shared_directories", json.dumps(shared))
+
+
+class Coordinator:
+    """Runs the pipeline over documents produced by workers. `workers` starts that many worker
+       processes on this node. Workers on other nodes need the same config.yml and the queue,
+       knowledge and video directories shared at the same paths"""
+
+    def __init__(self, pipeline: Pipeline, queue: WorkQueue, workers: int = 0):
+        self.pipeline = pipeline
+        self.queue = queue
+        self.workers = workers
+        self.poll = pipeline.work_queue.get("POLL_SECONDS", 2)
+
+    def __call__(self) -> None:
+        stop = multiprocessing.get_context("spawn").Event()
+        processes = [multiprocessing.get_context("spawn").Process(
+            target=_work, args=(f"{socket.gethostname()}:local-{number}", stop), daemon=True)
+            for number in range(self.workers)]
+        for process in processes:
+            process.start()
+        try:
+            self.pipeline.run(self.documents)
+        finally:
+            stop.set()
+            for process in processes:
+                process.join(self.poll + 10)
+                if process.is_alive():
+                    process.terminate()
+        # Only now is every finished item in the vector store and the manifest
+        logger.info(f"{self.queue.drain()} work items ingested")
+
+    def documents(self) -> Iterator[Document]:
+        """Enqueues the changed sources and yields the documents of each item as it finishes.
+           Called by the pipeline once the manifest run has begun"""
+        pipeline = self.pipeline
+        source_types = pipeline._source_types()
+        directories: Dict[str, List[str]] = {}
+        if pipeline.knowledge_directory is not None:
+            directories[pipeline.knowledge_directory] = ["knowledge_directory"]
+        if pipeline.video_directory is not None:
+            # Drive items download recordings into it
+            directories.setdefault(pipeline.video_directory, []).extend(["video", "gdrive"])
+        share_directories(self.queue, directories)
+        keys: Set[str] = set()
+        if pipeline.folder_id is not None:
+            keys |= self._enqueue(self._gdrive_items())
+        if pipeline.web_input_file is not None:
+            keys |= self._enqueue(self._website_items())
+        if pipeline.knowledge_directory is not None:
+            keys |= self._enqueue(self._knowledge_items())
+        # Recordings are listed once the Drive downloads into the video directory are finished
+        video_waiting = pipeline.video_directory is not None
+        self.queue.prune(keys, [source_type for source_type in SOURCE_TYPES
+                                if source_type != "video" or not video_waiting])
+
+        applied = 0
+        last_counts = None
+        while True:
+            if video_waiting and not self._busy(["gdrive"]):
+                video_keys = self._enqueue(self._video_items())
+                self.queue.prune(video_keys, ["video"])
+                keys |= video_keys
+                video_waiting = False
+            idle = not video_waiting and not self._busy(source_types)
+            finished = self.queue.finished(applied)
+            for applied, item in finished:
+                metrics.count("work_items_ingested", source_type=item.source_type)
+                yield from self._apply(item)
+            if idle:
+                break
+            counts = self.queue.counts(source_types)
+            if counts != last_counts:
+                logger.info(f"work queue: {counts}")
+                last_counts = counts
+            if not finished:
+                time.sleep(self.poll)
+
+        dead = [item for item in self.queue.dead() if item.key in keys]
+        for item in dead:
+            logger.error(f"{item.key} failed {item.attempts} times and is left out of this run")
+        metrics.count("work_items_dead", len(dead))
+        if dead and pipeline.manifest is not None:
+            # Seen but not ingested: their chunks stay and they count as changed next run
+            pipeline.manifest.discard(item.source_id for item in dead if item.source_id and item.source_type != "website")
+            urls = [item.source_id for item in dead if item.source_id and item.source_type == "website"]
+            if urls:
+                plugins.extractors.load("website").keep_unreachable(
+                    pipeline.manifest, urls, pipeline.web.get("MAX_DEPTH", 0) > 0)
+
+    def _enqueue(self, items: Iterable[Tuple[str, str, Optional[str], Dict[str, Any], str]]) -> Set[str]:
+        keys: Set[str] = set()
+        batch = []
+        for item in items:
+            keys.add(item[0])
+            batch.append(item)
+            if len(batch) >= ENQUEUE_BATCH:
+                self.queue.enqueue(batch)
+                batch = []
+        self.queue.enqueue(batch)
+        return keys
+
+    def _busy(self, source_types: List[str]) -> bool:
+        counts = self.queue.counts(source_types)
+        return counts["pending"] + counts["leased"] > 0
+
+    def _apply(self, item: WorkItem) -> Iterator[Document]:
+        manifest = self.pipeline.manifest
+        for doc in self.queue.results(item):
+            # Pages are only known once fetched, so they are checked against the manifest here
+            if item.source_type == "website" and manifest is not None and manifest.is_unchanged(
+                    doc.metadata["source"], "website", content_hash(doc.page_content)):
+                continue
+            yield doc
+
+    def _gdrive_items(self) -> Iterator[Tuple[str, str, Optional[str], Dict[str, Any], str]]:
+        loader = self.pipeline.gdrive_loader(None, None, self.pipeline.manifest)
+        for item in loader.changed_items():
+            payload = {"item": item, "folder_id": self.pipeline.folder_id, "shared_dir": self.pipeline.video_directory}
+            yield (f'gdrive:{item["id"]}', "gdrive", loader.source_id(item), payload,
+                   item.get("md5Checksum") or item.get("modifiedTime", ""))
+
+    def _website_items(self) -> Iterator[Tuple[str, str, Optional[str], Dict[str, Any], str]]:
+        with open(self.pipeline.web_input_file, "r") as f:
+            urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        for url in urls:
+            yield f"website:{url}", "website", url, {"url": url}, ""
+
+    def _knowledge_items(self) -> Iterator[Tuple[str, str, Optional[str], Dict[str, Any], str]]:
+        directory = plugins.extractors.load("knowledge_directory")
+        for path in directory.list_files(self.pipeline.knowledge_directory, self.pipeline.manifest):
+            stat = os.stat(path)
+            yield (f"knowledge_directory:{path}", "knowledge_directory", path, {"path": path},
+                   f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    def _video_items(self) -> Iterator[Tuple[str, str, Optional[str], Dict[str, Any], str]]:
+        directory = self.pipeline.video_directory
+        VideoExtractor = plugins.extractors.load("video")
+        extractor = VideoExtractor(directory, self.pipeline.manifest, self.pipeline.transcription_service()).plan()
+        for source_id, path in extractor.changed_inputs().items():
+            yield (f"video:{source_id}", "video", source_id, {"path": path, "directory": directory},
+                   extractor._fingerprint(path))
+
+
+class Worker:
+    """Claims items from the queue and extracts them, holding the lease with a heartbeat while
+       an item is processed. Parser and Whisper pools are started on first use"""
+
+    def __init__(self, pipeline: Pipeline, queue: WorkQueue, worker_id: Optional[str] = None):
+        self.pipeline = pipeline
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll = pipeline.work_queue.get("POLL_SECONDS", 2)
+        self.processed = 0
+        self._parser: Optional[ParserPool] = None
+        self._pdf: Optional[PdfExtractor] = None
+        self._transcription: Optional[Any] = None
+        self._gdrive: Dict[Tuple[str, str], Any] = {}
+        # Shared directories by the coordinator token found in them, or missing from this node
+        self._shared: Dict[str, str] = {}
+        self._unshared: Dict[str, str] = {}
+        self._loaders: Dict[str, Callable[[WorkItem], List[Document]]] = {
+            "gdrive": self._load_gdrive, "website": self._load_website,
+            "knowledge_directory": self._load_knowledge, "video": self._load_video}
+
+    def run(self, exit_when_idle: bool = False, stop: Optional[Any] = None) -> int:
+        """Works until `stop` is set or, with `exit_when_idle`, until nothing it can claim is
+           pending or leased. The number of items completed"""
+        logger.info(f"worker {self.worker_id} started")
+        try:
+            while stop is None or not stop.is_set():
+                source_types = self.claimable()
+                item = self.queue.claim(self.worker_id, source_types)
+                if item is not None:
+                    self.process(item)
+                    continue
+                counts = self.queue.counts(source_types)
+                if exit_when_idle and counts["pending"] + counts["leased"] == 0:
+                    break
+                if stop is not None:
+                    stop.wait(self.poll)
+                else:
+                    time.sleep(self.poll)
+        finally:
+            self.close()
+        logger.info(f"worker {self.worker_id} completed {self.processed} items")
+        return self.processed
+
+    def claimable(self) -> Optional[List[str]]:
+        """Source types this worker can take, None for all. Items that need a directory this
+           node does not share with the coordinator are left to other workers"""
+        shared = json.loads(self.queue.get("shared_directories") or "{}")
+        excluded: Set[str] = set()
+        for directory, (token, source_types) in shared.items():
+            if self._shared.get(directory) == token:
+                continue
+            try:
+                with open(os.path.join(directory, SHARED_MARKER)) as f:
+                    found = f.read().strip()
+            except OSError:
+                found = None
+            if found == token:
+                self._shared[directory] = token
+                continue
+            if self._unshared.get(directory) != token:
+                logger.error(f"{directory} is not the coordinator's directory on this node, "
+                             f"{', '.join(source_types)} items are left to other workers")
+                self._unshared[directory] = token
+            excluded.update(source_types)
+        if not excluded:
+            return None
+        return [source_type for source_type in SOURCE_TYPES if source_type not in excluded]
+
+    def process(self, item: WorkItem) -> bool:
+        """Extracts one item and completes it, or records the failure. True if it completed"""
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(item, done), name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            with metrics.stage(f"work.{item.source_type}") as measure:
+                docs = self._loaders[item.source_type](item)
+                measure.add(len(docs), sum(len(doc.page_content) for doc in docs))
+        except Exception as e:
+            logger.exception(f"{item.key} failed on attempt {item.attempts}")
+            metrics.count("work_failures", source_type=item.source_type)
+            self.queue.fail(item, self.worker_id, f"{type(e).__name__}: {e}")
+            return False
+        finally:
+            done.set()
+            heartbeat.join()
+        if not self.queue.complete(item, self.worker_id, docs):
+            return False
+        metrics.count("work_items_completed", source_type=item.source_type)
+        self.processed += 1
+        return True
+
+    def close(self) -> None:
+        if self._parser is not None:
+            self._parser.close()
+        if self._pdf is not None and self._pdf.cache is not None:
+            self._pdf.cache.close()
+        if self._transcription is not None:
+            self._transcription.close()
+        report = self.pipeline.metrics.get("REPORT")
+        if report:
+            root, extension = os.path.splitext(report)
+            metrics.write_report(f"{root}.{self.worker_id.replace(os.sep, '_').replace(':', '_')}{extension}")
+
+    def _heartbeat(self, item: WorkItem, done: threading.Event) -> None:
+        while not done.wait(self.queue.lease_seconds / 3):
+            if not self.queue.renew(item, self.worker_id):
+                logger.warning(f"lost the lease on {item.key}")
+                return
+
+    def _load_gdrive(self, item: WorkItem) -> List[Document]:
+        payload = item.payload
+        key = (payload["folder_id"], payload["shared_dir"])
+        if key not in self._gdrive:
+            self._gdrive[key] = self.pipeline.gdrive_loader(self._parser_pool(), self._pdf_extractor(),
+                                                            folder_id=payload["folder_id"],
+                                                            shared_dir=payload["shared_dir"])
+        return list(self._gdrive[key].fetch_item(payload["item"]) or [])
+
+    def _load_website(self, item: WorkItem) -> List[Document]:
+        url = item.payload["url"]
+        crawler = self.pipeline.web_crawler()
+        pages = list(crawler.lazy_load([url]))
+        # Retried, and once dead the pages of the site keep their chunks. A page that is gone yields none
+        if crawler.failed:
+            raise RuntimeError(f"{len(crawler.failed)} pages from {url} could not be fetched")
+        return pages
+
+    def _load_knowledge(self, item: WorkItem) -> List[Document]:
+        path = item.payload["path"]
+        if mime_type(path) == "application/pdf":
+            return self._pdf_extractor().extract(path)
+        return self._parser_pool().parse(path)
+
+    def _load_video(self, item: WorkItem) -> List[Document]:
+        # One service for the worker's life, its Whisper processes load the model once
+        if self._transcription is None:
+            self._transcription = self.pipeline.transcription_service()
+        VideoExtractor = plugins.extractors.load("video")
+        extractor = VideoExtractor(item.payload["directory"], None, self._transcription)
+        return extractor.load_item(item.source_id, item.payload["path"])
+
+    def _parser_pool(self) -> ParserPool:
+        if self._parser is None:
+            self._parser = self.pipeline.parser_pool()
+        return self._parser
+
+    def _pdf_extractor(self) -> PdfExtractor:
+        if self._pdf is None:
+            self._pdf = self.pipeline.pdf_extractor(self._parser_pool())
+        return self._pdf
+
+
+def _work(worker_id: str, stop: Any) -> None:
+    """Entry point of a worker process started by the coordinator"""
+    pipeline = Pipeline()
+    Worker(pipeline, open_queue(pipeline), worker_id).run(stop=stop)
+
+
+@app.command()
+def coordinate(web_input_file: str = typer.Argument(None), video_directory: str = typer.Argument(None),
+               knowledge_directory: str = typer.Argument(None), folder_id: str = typer.Argument(None),
+               workers: int = typer.Option(0, help="Worker processes to start on this node")):
+    """Queues the changed sources and ingests what the workers extract from them"""
+    pipeline = Pipeline(web_input_file, video_directory, knowledge_directory, folder_id)
+    queue = open_queue(pipeline)
+    try:
+        Coordinator(pipeline, queue, workers)()
+    finally:
+        queue.close()
+
+
+@app.command()
+def work(worker_id: str = typer.Option(None, help="Defaults to host:pid"),
+         exit_when_idle: bool = typer.Option(False, help="Stop once nothing is pending or leased")):
+    """Extracts queued sources until stopped"""
+    pipeline = Pipeline()
+    queue = open_queue(pipeline)
+    try:
+        Worker(pipeline, queue, worker_id).run(exit_when_idle)
+    finally:
+        queue.close()
+
+
+@app.command()
+def status():
+    """Items by state and the latest dead letters"""
+    queue = open_queue(Pipeline())
+    typer.echo(" ".join(f"{state}={count}" for state, count in queue.counts().items()))
+    for letter in queue.dead_letters(20):
+        typer.echo(f'{letter["key"]} after {letter["attempts"]} attempts on {letter["worker"]}: {letter["error"]}')
+    queue.close()
+
+
+@app.command()
+def requeue(keys: List[str] = typer.Argument(None, help="Item keys, every dead item without any")):
+    """Gives dead items another set of attempts, they are ingested by the next coordinator run"""
+    queue = open_queue(Pipeline())
+    typer.echo(f"{queue.requeue(keys)} items requeued")
+    queue.close()
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
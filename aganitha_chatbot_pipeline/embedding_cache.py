@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Tuple
+
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def model_name(embeddings: Any) -> str:
+    """Best effort name of the model behind an embedding backend, used to namespace the cache"""
+    for attr in ("model", "model_name", "document_model_name"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    return type(embeddings).__name__
+
+
+class EmbeddingCache:
+    """SQLite store of float32 vectors keyed by (model name, sha256 of the text).
+       Entries carry a last-used stamp and the least recently used ones are evicted
+       once the store grows past `max_entries`"""
+
+    def __init__(self, path: str, max_entries: int = 1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, text_hashes: List[str], record_stats: bool = True) -> Dict[str, List[float]]:
+        """Returns the cached vectors among the hashes and refreshes their last-used stamp"""
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            # Stay well below SQLite's bound parameter limit
+            for start in range(0, len(text_hashes), 500):
+                batch = text_hashes[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                    (model, *batch),
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, text_hash) for text_hash in found],
+            )
+            self._conn.commit()
+            if record_stats:
+                self.hits += len(found)
+                self.misses += len(text_hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, items: List[Tuple[str, List[float]]]) -> None:
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, array("f", vector).tobytes(), now) for text_hash, vector in items],
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+            self._conn.commit()
+
+    def _evict(self, count: int) -> None:
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (count,)
+        )
+        self._size -= count
+        logger.info(f"evicted {count} embeddings from the cache")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": self._size}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding backend so that every distinct text is embedded once per model"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model_name(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        found = self.cache.get_many(self.model, list(dict.fromkeys(hashes)))
+
+        # Repeated texts inside the batch are only sent once
+        missing: Dict[str, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, computed)
+            found.update(computed)
+        return [found[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        found = self.cache.get_many(self.model, [text_hash])
+        if text_hash in found:
+            return found[text_hash]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(self.model, [(text_hash, vector)])
+        return vector
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from aganitha_chatbot_pipeline import metrics
+from aganitha_chatbot_pipeline.embedding_cache import EmbeddingCache, model_name
+
+logger = logging.getLogger(__name__)
+
+
+def token_counter(model: str) -> Callable[[str], int]:
+    """Counts tokens with tiktoken when it is installed, otherwise estimates four characters a token"""
+    try:
+        import tiktoken
+    except ImportError:
+        return lambda text: max(1, len(text) // 4)
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails on machines without access
+        logger.warning(f"tiktoken encoding unavailable ({e!r}), estimating token counts")
+        return lambda text: max(1, len(text) // 4)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return "RateLimit" in type(error).__name__ or getattr(error, "http_status", None) == 429
+
+
+class RateLimiter:
+    """Sliding one-minute budgets for requests and tokens. The budgets shrink when the provider
+       answers with a rate-limit error and grow back with every successful request"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.scale = 1.0
+        self._lock = threading.Lock()
+        self._events: deque = deque()
+        self._tokens = 0
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and self._events[0][0] <= now - 60:
+                    self._tokens -= self._events.popleft()[1]
+                # A batch larger than the whole budget still goes out, alone
+                fits = not self._events or (
+                    len(self._events) + 1 <= self.requests_per_minute * self.scale
+                    and self._tokens + tokens <= self.tokens_per_minute * self.scale
+                )
+                if fits:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self._events[0][0] + 60 - now
+            time.sleep(min(max(wait, 0.05), 5.0))
+
+    def throttle(self) -> None:
+        with self._lock:
+            self.scale = max(0.1, self.scale * 0.5)
+            logger.warning(f"rate limited, budgets scaled to {self.scale:.2f}")
+
+    def recover(self) -> None:
+        with self._lock:
+            self.scale = min(1.0, self.scale * 1.05)
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeds documents in batches packed up to `max_batch_tokens` tokens (and `max_batch_size`
+       texts), sends `concurrency` batches at once within the requests- and tokens-per-minute
+       budgets and retries failed batches with exponential backoff. Calls made at the same time
+       share the `concurrency` slots, so callers can overlap them freely. Every finished batch is
+       written to the checkpoint store, so a failed run resumes from the batches it completed.
+       The wrapped client should not retry on its own, its retries would multiply these"""
+
+    def __init__(self, embeddings: Embeddings, max_batch_tokens: int = 100_000, max_batch_size: int = 1000,
+                 concurrency: int = 4, requests_per_minute: int = 3000, tokens_per_minute: int = 1_000_000,
+                 max_retries: int = 6, checkpoint: Optional[EmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model = model_name(embeddings)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.checkpoint = checkpoint
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.count_tokens = token_counter(self.model)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.stage("embed", len(texts), sum(len(text) for text in texts)):
+            return self._embed_documents(texts)
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        done: Dict[str, List[float]] = {}
+        if self.checkpoint is not None:
+            done = self.checkpoint.get_many(self.model, list(dict.fromkeys(hashes)), record_stats=False)
+
+        todo: Dict[str, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in done:
+                todo.setdefault(text_hash, text)
+        batches = self._pack(list(todo.items()))
+        if done:
+            logger.info(f"resuming with {len(done)} texts from the checkpoint")
+
+        for vectors in self._batch_pool().map(self._embed_batch, batches):
+            done.update(vectors)
+        return [done[text_hash] for text_hash in hashes]
+
+    def _batch_pool(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding")
+            return self._pool
+
+    def embed_query(self, text: str) -> List[float]:
+        self.limiter.acquire(self.count_tokens(text))
+        return self.embeddings.embed_query(text)
+
+    def _pack(self, items: List[tuple]) -> List[List[tuple]]:
+        """Packs (hash, text) pairs into consecutive batches within the token and size limits"""
+        batches, batch, tokens = [], [], 0
+        for text_hash, text in items:
+            count = self.count_tokens(text)
+            if batch and (tokens + count > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append((batch, tokens))
+                batch, tokens = [], 0
+            batch.append((text_hash, text))
+            tokens += count
+        if batch:
+            batches.append((batch, tokens))
+        return batches
+
+    def _embed_batch(self, packed) -> Dict[str, List[float]]:
+        batch, tokens = packed
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            metrics.count("api_calls", service="embeddings")
+            try:
+                vectors = self.embeddings.embed_documents([text for _, text in batch])
+            except Exception as e:
+                if attempt == self.max_retries:
+                    metrics.count("api_failures", service="embeddings")
+                    raise
+                if _is_rate_limit(e):
+                    self.limiter.throttle()
+                    metrics.count("api_rate_limited", service="embeddings")
+                metrics.count("api_retries", service="embeddings")
+                delay = min(60.0, 2 ** attempt) + random.random()
+                logger.warning(f"embedding batch of {len(batch)} failed ({e!r}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.limiter.recover()
+            metrics.count("embedding_tokens", tokens, service="embeddings")
+            result = {text_hash: vector for (text_hash, _), vector in zip(batch, vectors)}
+            if self.checkpoint is not None:
+                self.checkpoint.put_many(self.model, list(result.items()))
+            return result
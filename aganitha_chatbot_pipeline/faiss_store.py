@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from aganitha_chatbot_pipeline.filters import filter_sql
+from aganitha_chatbot_pipeline.manifest import content_hash
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("FLAT", "IVF", "IVFPQ", "HNSW")
+# Maps flat code storage (FLAT, and the vectors of HNSW) from disk, in FAISS 1.10 and later
+IO_FLAG_MMAP_IFC = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def faiss_id(chunk_id: str) -> int:
+    """Stable non-negative int64 FAISS id of a chunk, taken from the chunk id's sha256 hex digest"""
+    return int(chunk_id[:16], 16) & 0x7FFF_FFFF_FFFF_FFFF
+
+
+class FaissStore(VectorStore):
+    """FAISS index saved in the native format under `directory` with the chunk texts and metadata
+       in a SQLite store next to it, so nothing is unpickled on load. A read-only store maps the
+       inverted lists of IVF and IVFPQ indexes from disk, sharing their pages between processes.
+       FLAT and HNSW vectors are only mapped with FAISS 1.10 or later (IO_FLAG_MMAP_IFC), with
+       older versions and for the HNSW graph every process loads them into memory.
+
+       Vectors are keyed by ids derived from the chunk ids, adding a chunk that is already stored
+       replaces it and `delete` removes chunks by id. FLAT is exact search, IVF and IVFPQ cluster
+       (and compress) the vectors for large corpora and are trained once TRAIN_SIZE vectors were
+       added or on save, HNSW is a graph that cannot drop vectors, removed chunks are dropped
+       from the metadata store and filtered out of results, and `save` rebuilds the graph from
+       the live vectors once removed ones pass `compact_ratio` of the index"""
+
+    def __init__(self, directory: str, embeddings: Embeddings, index_type: str = "FLAT", metric: str = "L2",
+                 nlist: int = 1024, pq_m: int = 16, hnsw_m: int = 32, nprobe: int = 16, train_size: int = 65536,
+                 compact_ratio: float = 0.2, read_only: bool = False):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"FAISS index type must be one of {INDEX_TYPES}, not {index_type!r}")
+        self.directory = directory
+        self.embeddings = embeddings
+        self.index_type = index_type
+        self.metric = faiss.METRIC_INNER_PRODUCT if metric == "IP" else faiss.METRIC_L2
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.hnsw_m = hnsw_m
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.compact_ratio = compact_ratio
+        self.read_only = read_only
+        self.index: Optional[faiss.Index] = None
+        # Sorted ids of an id-mapped index and their positions, to translate filters
+        self._positions: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._untrained: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._lock = threading.Lock()
+
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "metadata.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, "
+            "text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if not read_only:
+            # Filters on the source are the common case, they are answered from this index
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (json_extract(metadata, '$.source'))")
+        self._conn.commit()
+        if os.path.exists(self.index_path):
+            # The index file decides the type, the config only applies to new indexes
+            flags = faiss.IO_FLAG_MMAP | IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if read_only else 0
+            self.index = faiss.read_index(self.index_path, flags)
+            self.index_type = self._setting("index_type") or index_type
+            self._tune()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.faiss")
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  vectors: Optional[Any] = None, **kwargs: Any) -> List[str]:
+        """Adds the chunks with their `vectors`, embedding them when none are given"""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        chunk_ids = [metadata.get("chunk_id") or content_hash(text) for text, metadata in zip(texts, metadatas)]
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(texts)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.array([faiss_id(chunk_id) for chunk_id in chunk_ids], dtype=np.int64)
+        with self._lock:
+            if self.index is None:
+                self.index = self._new_index(vectors.shape[1])
+            self._remove(ids)
+            self._positions = None
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, chunk_id, text, metadata) VALUES (?, ?, ?, ?)",
+                [(int(i), chunk_id, text, json.dumps(metadata))
+                 for i, chunk_id, text, metadata in zip(ids, chunk_ids, texts, metadatas)],
+            )
+            if self.index.is_trained:
+                self.index.add_with_ids(vectors, ids)
+            else:
+                self._untrained.append((vectors, ids))
+                if sum(len(batch) for batch, _ in self._untrained) >= self.train_size:
+                    self._train()
+        return chunk_ids
+
+    def delete(self, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self._remove(np.array([faiss_id(chunk_id) for chunk_id in chunk_ids], dtype=np.int64))
+
+    def update_metadata(self, updates: Dict[str, dict]) -> None:
+        """Merges fields into the metadata of stored chunks, keyed by chunk id"""
+        with self._lock:
+            rows = self._rows([faiss_id(chunk_id) for chunk_id in updates])
+            self._conn.executemany("UPDATE chunks SET metadata = ? WHERE id = ?", [
+                (json.dumps(dict(rows[faiss_id(chunk_id)][1], **fields)), faiss_id(chunk_id))
+                for chunk_id, fields in updates.items() if faiss_id(chunk_id) in rows
+            ])
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """With metadata `filters` only matching chunks are searched: their ids are looked up in the
+           metadata store and handed to FAISS as an id selector"""
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        # HNSW keeps removed vectors, fetch enough extra to still fill k results. The count is
+        # read under the lock, writers update it on the same connection
+        with self._lock:
+            tombstones = int(self._setting("tombstones") or 0)
+        fetch = min(self.index.ntotal, k + tombstones)
+        query = np.array([embedding], dtype=np.float32)
+        if filters:
+            scores, ids = self._filtered_search(query, fetch, filters)
+        else:
+            scores, ids = self.index.search(query, fetch)
+        with self._lock:
+            rows = self._rows([int(i) for i in ids[0] if i >= 0])
+        results = []
+        for i, score in zip(ids[0], scores[0]):
+            # A replaced HNSW vector still matches under the same id as its replacement
+            if int(i) in rows:
+                text, metadata = rows.pop(int(i))
+                results.append((Document(page_content=text, metadata=metadata), float(score)))
+        return results[:k]
+
+    def _filtered_search(self, query: np.ndarray, k: int, filters: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        condition, params = filter_sql(filters)
+        with self._lock:
+            allowed = np.array([i for i, in self._conn.execute(f"SELECT id FROM chunks WHERE {condition}", params)],
+                               dtype=np.int64)
+            if not len(allowed):
+                return np.zeros((1, 0), dtype=np.float32), np.zeros((1, 0), dtype=np.int64)
+            index = faiss.downcast_index(self.index)
+            if not isinstance(index, faiss.IndexIDMap2):
+                search = faiss.SearchParametersIVF(sel=faiss.IDSelectorBatch(allowed), nprobe=self.nprobe)
+                return index.search(query, min(k, len(allowed)), params=search)
+            if self._positions is None:
+                ids = faiss.vector_to_array(index.id_map)
+                order = np.argsort(ids)
+                self._positions = (ids, ids[order], order)
+            ids, sorted_ids, order = self._positions
+        # The id map takes no search parameters, the selector goes to the inner index with the
+        # chunk ids translated to positions in it
+        found = np.minimum(np.searchsorted(sorted_ids, allowed), len(sorted_ids) - 1)
+        positions = order[found[sorted_ids[found] == allowed]]
+        if not len(positions):
+            return np.zeros((1, 0), dtype=np.float32), np.zeros((1, 0), dtype=np.int64)
+        inner = faiss.downcast_index(index.index)
+        selector = faiss.IDSelectorBatch(positions.astype(np.int64))
+        search = (faiss.SearchParametersHNSW(sel=selector) if isinstance(inner, faiss.IndexHNSW)
+                  else faiss.SearchParameters(sel=selector))
+        scores, found = inner.search(query, min(k, len(positions)), params=search)
+        return scores, np.where(found >= 0, ids[np.maximum(found, 0)], -1)
+
+    def save(self) -> None:
+        """Trains a pending IVF index on what it has, compacts an HNSW graph holding too many
+           removed vectors and writes the index atomically"""
+        if self.index is None or self.read_only:
+            return
+        with self._lock:
+            if self._untrained:
+                self._train()
+            if self.index_type == "HNSW" and int(self._setting("tombstones") or 0) > \
+                    self.compact_ratio * self.index.ntotal:
+                self._compact()
+            partial = self.index_path + ".part"
+            faiss.write_index(self.index, partial)
+            os.replace(partial, self.index_path)
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('index_type', ?)",
+                               (self.index_type,))
+            self._conn.commit()
+        logger.info(f"FAISS {self.index_type} index saved with {self.index.ntotal} vectors")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   directory: str = "faiss_index", **kwargs: Any) -> "FaissStore":
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        store.save()
+        return store
+
+    def _new_index(self, dimensions: int, nlist: Optional[int] = None) -> "faiss.Index":
+        nlist = nlist or self.nlist
+        if self.index_type == "IVF":
+            return faiss.index_factory(dimensions, f"IVF{nlist},Flat", self.metric)
+        if self.index_type == "IVFPQ":
+            return faiss.index_factory(dimensions, f"IVF{nlist},PQ{self.pq_m}", self.metric)
+        # Flat and HNSW number vectors sequentially, the id map keeps the chunk ids
+        spec = f"HNSW{self.hnsw_m}" if self.index_type == "HNSW" else "Flat"
+        return faiss.index_factory(dimensions, f"IDMap2,{spec}", self.metric)
+
+    def _train(self) -> None:
+        vectors = np.concatenate([batch for batch, _ in self._untrained])
+        ids = np.concatenate([batch_ids for _, batch_ids in self._untrained])
+        # FAISS wants about 39 training points per cluster, smaller corpora get fewer clusters
+        nlist = max(1, min(self.nlist, len(vectors) // 39))
+        if nlist != self.nlist:
+            logger.warning(f"{len(vectors)} vectors train {nlist} IVF lists instead of {self.nlist}")
+        self.index = self._new_index(vectors.shape[1], nlist)
+        if self.index_type == "IVFPQ" and len(vectors) < 256:
+            logger.warning(f"{len(vectors)} vectors are too few to train PQ codes, using IVF")
+            self.index_type = "IVF"
+            self.index = self._new_index(vectors.shape[1], nlist)
+        self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+        self._untrained = []
+        self._tune()
+
+    def _compact(self) -> None:
+        """Rebuilds the HNSW graph from the vectors of stored chunks, removed and replaced ones
+           are left behind"""
+        index = faiss.downcast_index(self.index)
+        ids = faiss.vector_to_array(index.id_map)
+        # The last vector added under an id is the current one
+        _, last = np.unique(ids[::-1], return_index=True)
+        positions = np.sort(len(ids) - 1 - last)
+        stored = np.array([i for i, in self._conn.execute("SELECT id FROM chunks")], dtype=np.int64)
+        positions = positions[np.isin(ids[positions], stored)]
+        vectors = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+        tombstones = index.ntotal - len(positions)
+        self.index = self._new_index(vectors.shape[1])
+        if len(positions):
+            self.index.add_with_ids(vectors[positions], ids[positions])
+        self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('tombstones', '0')")
+        self._positions = None
+        logger.info(f"HNSW index compacted, {tombstones} removed vectors dropped")
+
+    def _tune(self) -> None:
+        if self.index_type in ("IVF", "IVFPQ"):
+            faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+
+    def _remove(self, ids: np.ndarray) -> None:
+        """Drops stored chunks among the ids from the index and the metadata store"""
+        if not len(ids):
+            return
+        stored = list(self._rows([int(i) for i in ids]))
+        if not stored:
+            return
+        if self._untrained:
+            for position, (vectors, batch_ids) in enumerate(self._untrained):
+                keep = ~np.isin(batch_ids, stored)
+                self._untrained[position] = (vectors[keep], batch_ids[keep])
+        if self.index_type == "HNSW":
+            tombstones = int(self._setting("tombstones") or 0) + len(stored)
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('tombstones', ?)",
+                               (str(tombstones),))
+        elif self.index is not None and self.index.ntotal:
+            self.index.remove_ids(np.array(stored, dtype=np.int64))
+        self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in stored])
+        self._positions = None
+
+    def _rows(self, ids: List[int]) -> Dict[int, Tuple[str, dict]]:
+        rows: Dict[int, Tuple[str, dict]] = {}
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ",".join("?" * len(batch))
+            for i, text, metadata in self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({marks})", batch):
+                rows[i] = (text, json.loads(metadata))
+        return rows
+
+    def _setting(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
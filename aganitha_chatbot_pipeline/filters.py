@@ -0,0 +1,47 @@
+"""Metadata filters shared by the stores. A filter maps a metadata field to a value it must
+equal, or to a list of values it must be one of, e.g. {"source": [...], "page": 3}. Each store
+translates the filter into its own query language so that it is applied inside the search."""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_FIELD = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Fields Milvus stores as columns, every other field is read from the metadata JSON
+MILVUS_COLUMNS = ("chunk_id", "source")
+
+
+def _check(filters: Dict[str, Any]) -> None:
+    for field, value in filters.items():
+        if not _FIELD.match(field):
+            raise ValueError(f"invalid metadata filter field {field!r}")
+        values = value if isinstance(value, list) else [value]
+        if not values or any(not isinstance(item, (str, int, float, bool)) for item in values):
+            raise ValueError(f"metadata filter {field!r} needs a scalar or a non-empty list of scalars")
+
+
+def filter_sql(filters: Optional[Dict[str, Any]], column: str = "metadata") -> Tuple[str, List[Any]]:
+    """SQLite condition and parameters over a JSON metadata column, "1" without filters"""
+    if not filters:
+        return "1", []
+    _check(filters)
+    conditions, params = [], []
+    for field, value in filters.items():
+        values = value if isinstance(value, list) else [value]
+        conditions.append(f"json_extract({column}, '$.{field}') IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    return " AND ".join(conditions), params
+
+
+def milvus_expr(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Milvus boolean expression over the chunk columns and the metadata JSON field"""
+    if not filters:
+        return None
+    _check(filters)
+    conditions = []
+    for field, value in filters.items():
+        target = field if field in MILVUS_COLUMNS else f'metadata["{field}"]'
+        if isinstance(value, list):
+            conditions.append(f"{target} in {json.dumps(value)}")
+        else:
+            conditions.append(f"{target} == {json.dumps(value)}")
+    return " and ".join(conditions)
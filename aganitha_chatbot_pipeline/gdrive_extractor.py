@@ -8,9 +8,15 @@
 #   https://developers.google.com/drive/api/quickstart/python#authorize_credentials_for_a_desktop_application # noqa: E501
 # 4. For service accounts visit
 #   https://cloud.google.com/iam/docs/service-accounts-create
+import glob
+import hashlib
 import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from googleapiclient.errors import HttpError
 
 from pydantic import BaseModel, root_validator, validator
@@ -18,6 +24,12 @@ from pydantic import BaseModel, root_validator, validator
 from langchain.docstore.document import Document
 from langchain.document_loaders.base import BaseLoader
 
+from aganitha_chatbot_pipeline import google_clients, metrics
+from aganitha_chatbot_pipeline.google_clients import GoogleClients
+from aganitha_chatbot_pipeline.parsing import ParserPool, parse_file
+from aganitha_chatbot_pipeline.pdf_engine import PdfExtractor
+from aganitha_chatbot_pipeline.streaming import bounded_map
+
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 
 import logging
@@ -29,9 +41,21 @@ logger = logging.getLogger(__name__)
 class GDriveLoader(BaseLoader):
     """Loader that loads Google Docs from Google Drive."""
 
-    def __init__(self, folder_id, shared_dir):
+    def __init__(self, folder_id, shared_dir, manifest=None, workers: int = 1, num_retries: int = 5,
+                 download_dir: str = None, chunk_size: int = 32 * 1024 * 1024, parser: ParserPool = None,
+                 pdf: PdfExtractor = None):
         self.folder_id = folder_id
         self.shared_dir = shared_dir
+        self.manifest = manifest
+        self.download_dir = download_dir or os.path.join(tempfile.gettempdir(), "gdrive_downloads")
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        # Downloaded files are parsed on this pool's processes, or in the download thread without one
+        self.parser = parser
+        # PDFs are extracted page by page, pages seen in an earlier run come from its page cache
+        self.pdf = pdf or PdfExtractor(parser)
+        # googleapiclient retries 5xx, 429 and 403 rate-limit responses with exponential backoff
+        self.num_retries = num_retries
 
     # folder_id: Optional[str] = None
     service_account_key: Path = Path.home() / ".credentials" / "keys.json"
@@ -67,106 +91,75 @@ class GDriveLoader(BaseLoader):
             raise ValueError(f"credentials_path {v} does not exist")
         return v
 
-    def _load_credentials(self) -> Any:
-        """Load credentials."""
-        # Adapted from https://developers.google.com/drive/api/v3/quickstart/python
-        try:
-            from google.auth.transport.requests import Request
-            from google.oauth2 import service_account
-            from google.oauth2.credentials import Credentials
-            from google_auth_oauthlib.flow import InstalledAppFlow
-        except ImportError:
-            raise ImportError(
-                "You must run"
-                "`pip install --upgrade "
-                "google-api-python-client google-auth-httplib2 "
-                "google-auth-oauthlib`"
-                "to use the Google Drive loader."
-            )
-
-        creds = None
-        if self.service_account_key.exists():
-            return service_account.Credentials.from_service_account_file(
-                str(self.service_account_key), scopes=SCOPES
-            )
-
-        if self.token_path.exists():
-            creds = Credentials.from_authorized_user_file(str(self.token_path), SCOPES)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    str(self.credentials_path), SCOPES
-                )
-                creds = flow.run_local_server(port=0)
-            with open(self.token_path, "w") as token:
-                token.write(creds.to_json())
-
-        return creds
-
-    def _load_sheet_from_id(self, id: str) -> List[Document]:
-        """Load a sheet and all tabs from an ID."""
-
-        from googleapiclient.discovery import build
-
-        creds = self._load_credentials()
-        sheets_service = build("sheets", "v4", credentials=creds)
-        spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=id).execute()
-        sheets = spreadsheet.get("sheets", [])
-
-        documents = []
-        for sheet in sheets:
-            sheet_name = sheet["properties"]["title"]
-            result = (
-                sheets_service.spreadsheets()
-                    .values()
-                    .get(spreadsheetId=id, range=sheet_name)
-                    .execute()
-            )
-            values = result.get("values", [])
-
-            header = values[0]
-            for i, row in enumerate(values[1:], start=1):
-                metadata = {
-                    "source": (
-                        f"https://docs.google.com/spreadsheets/d/{id}/"
-                        f"edit?gid={sheet['properties']['sheetId']}"
-                    ),
-                    "id": id
-                }
+    def _clients(self) -> GoogleClients:
+        """Credentials and clients are cached for the whole process, shared by every loader"""
+        return google_clients.clients(self.service_account_key, self.token_path, self.credentials_path, SCOPES)
+
+    def _get_credentials(self) -> Any:
+        return self._clients().credentials()
+
+    def _service(self, name: str = "drive", version: str = "v3") -> Any:
+        """Returns the calling thread's client for the API, on its own authorized connection"""
+        return self._clients().service(name, version)
+
+    def _load_sheet_from_id(self, id: str) -> Iterator[Document]:
+        """Load a sheet and all tabs from an ID. Every tab is fetched in one batchGet request and
+        rows are turned into documents as they are consumed."""
+        service = self._service("sheets", "v4")
+        spreadsheet = service.spreadsheets().get(
+            spreadsheetId=id, fields="sheets.properties(sheetId,title)"
+        ).execute(num_retries=self.num_retries)
+        sheets = [sheet["properties"] for sheet in spreadsheet.get("sheets", [])]
+        if not sheets:
+            return iter(())
+
+        # A quoted range is the whole tab, quotes in the title are doubled
+        ranges = ["'{}'".format(sheet["title"].replace("'", "''")) for sheet in sheets]
+        result = (
+            service.spreadsheets()
+                .values()
+                .batchGet(spreadsheetId=id, ranges=ranges, majorDimension="ROWS",
+                          fields="valueRanges.values")
+                .execute(num_retries=self.num_retries)
+        )
+        return self._sheet_documents(id, sheets, result.get("valueRanges", []))
+
+    @staticmethod
+    def _sheet_documents(id: str, sheets: List[Dict[str, Any]], value_ranges: List[Dict[str, Any]]) -> Iterator[Document]:
+        """One document per row, each cell prefixed by its column header. Rows are released
+        once converted."""
+        for sheet, value_range in zip(sheets, value_ranges):
+            values = value_range.pop("values", [])
+            if not values:
+                continue
+            metadata = {
+                "source": f"https://docs.google.com/spreadsheets/d/{id}/edit?gid={sheet['sheetId']}",
+                "id": id
+            }
+            header = [title.strip() for title in values[0]]
+            for i in range(1, len(values)):
+                row, values[i] = values[i], None
                 content = []
                 for j, v in enumerate(row):
-                    title = header[j].strip() if len(header) > j else ""
-                    content.append(f"{title}: {v.strip()}")
-
-                page_content = "\n".join(content)
-                documents.append(Document(page_content=page_content, metadata=metadata))
-
-        return documents
+                    title = header[j] if len(header) > j else ""
+                    content.append(f"{title}: {str(v).strip()}")
+                yield Document(page_content="\n".join(content), metadata=dict(metadata))
 
     def _load_slide_from_id(self, id: str) -> List[Document]:
-        """Load a sheet and all tabs from an ID."""
-
-        from googleapiclient.discovery import build
-
-        creds = self._load_credentials()
-        slide_service = build('slides', 'v1', credentials=creds)
-        presentation = slide_service.presentations().get(
-            presentationId=id).execute()
-        slides = presentation.get('slides')
+        """Load a presentation from an ID, one document per slide."""
+        presentation = self._service("slides", "v1").presentations().get(
+            presentationId=id, fields="slides.pageElements.shape.text.textElements.textRun.content"
+        ).execute(num_retries=self.num_retries)
 
         documents = []
-        for num, slide in enumerate(slides):
+        for slide in presentation.get('slides', []):
             slide_text = []
-            slide_page = slide.get('pageElements')
-            for content in slide_page:
-                text_elements = content.get('shape').get('text').get('textElements')
+            for content in slide.get('pageElements', []):
+                # Images, tables and lines have no shape text
+                text_elements = content.get('shape', {}).get('text', {}).get('textElements', [])
                 for individual_text_elements in text_elements:
-                    if 'textRun' in individual_text_elements.keys():
-                        text = individual_text_elements.get('textRun').get('content')
-                        slide_text.append(text)
+                    if 'textRun' in individual_text_elements:
+                        slide_text.append(individual_text_elements['textRun'].get('content', ''))
             page_content = "\n".join(slide_text)
             metadata = {
                 "source": f"https://docs.google.com/document/d/{id}/edit",
@@ -177,31 +170,23 @@ class GDriveLoader(BaseLoader):
 
     def _load_document_from_id(self, id: str) -> Document:
         """Load a document from an ID."""
-        from io import BytesIO
-
-        from googleapiclient.discovery import build
-        from googleapiclient.errors import HttpError
         from googleapiclient.http import MediaIoBaseDownload
 
-        creds = self._load_credentials()
-        service = build("drive", "v3", credentials=creds)
+        service = self._service()
 
-        file = service.files().get(fileId=id, fields='name,permissions').execute()
+        file = service.files().get(fileId=id, fields='name,permissions').execute(num_retries=self.num_retries)
         request = service.files().export_media(fileId=id, mimeType="text/plain")
-        fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        try:
-            while done is False:
-                status, done = downloader.next_chunk()
-
-        except HttpError as e:
-            if e.resp.status == 404:
-                logger.error("File not found: {}".format(id))
-            else:
-                logger.error("An error occurred: {}".format(e))
-        text = fh.getvalue().decode("utf-8")
-        logger.info('file', file)
+        # Exports do not support ranges, but are still streamed to disk chunk by chunk
+        with tempfile.TemporaryFile(dir=self._download_dir()) as fh:
+            downloader = MediaIoBaseDownload(fh, request, chunksize=self.chunk_size)
+            done = False
+            with metrics.stage("download", 1) as measure:
+                while done is False:
+                    status, done = downloader.next_chunk(num_retries=self.num_retries)
+                measure.add(bytes=fh.tell())
+            fh.seek(0)
+            text = fh.read().decode("utf-8")
+        logger.info(f"exported {file.get('name')} ({id}) as text")
         metadata = {
             "source": f"https://docs.google.com/document/d/{id}/edit",
             "id": id
@@ -209,44 +194,103 @@ class GDriveLoader(BaseLoader):
         return Document(page_content=text, metadata=metadata)
 
     def _load_documents_from_folder(self) -> List[Document]:
-        """Load documents from a folder."""
-        from googleapiclient.discovery import build
-
-        creds = self._load_credentials()
-        service = build("drive", "v3", credentials=creds)
-
-        results = (
-            service.files()
-                .list(
-                q=f"'{self.folder_id}' in parents",
-                pageSize=1000,
-                fields="nextPageToken, files(id, name, mimeType)",
+        """Load documents from a folder and all of its subfolders."""
+        return list(self._lazy_load_documents_from_folder())
+
+    def _lazy_load_documents_from_folder(self) -> Iterator[Document]:
+        """Yields documents as the download threads finish them. Files are submitted while the
+           folder is still being crawled and never more than two per worker are in flight"""
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for docs in bounded_map(pool, self._load_item, self._changed_items(), 2 * self.workers):
+                for doc in docs:
+                    count += 1
+                    yield doc
+        logger.info(f"{count} documents loaded from folder {self.folder_id}")
+
+    def _changed_items(self) -> Iterator[Dict[str, Any]]:
+        for item in self._crawl_folder(self.folder_id):
+            if self._is_unchanged(item):
+                logger.info(f'{item["name"]} unchanged since last run, skipping')
+                continue
+            yield item
+
+    def _crawl_folder(self, folder_id: str):
+        """Yields every file below the folder, descending into nested folders"""
+        folders = [folder_id]
+        while folders:
+            for item in self._list_folder(folders.pop()):
+                if item["mimeType"] == "application/vnd.google-apps.folder":
+                    folders.append(item["id"])
+                else:
+                    yield item
+
+    def _list_folder(self, folder_id: str):
+        """Yields the children of a folder, following nextPageToken across pages"""
+        service = self._service()
+        page_token = None
+        while True:
+            results = (
+                service.files()
+                    .list(
+                    q=f"'{folder_id}' in parents and trashed = false",
+                    pageSize=1000,
+                    pageToken=page_token,
+                    fields="nextPageToken, files(id, name, mimeType, md5Checksum, modifiedTime)",
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
+                )
+                    .execute(num_retries=self.num_retries)
             )
-                .execute()
-        )
-        items = results.get("files", [])
-        returns = []
-        for item in items:
-            logger.info('item\n', item)
-            if item["mimeType"] == "application/vnd.google-apps.document":
-                returns.append(self._load_document_from_id(item["id"]))
-            elif item["mimeType"] == "application/vnd.google-apps.spreadsheet":
-                returns.extend(self._load_sheet_from_id(item["id"]))
-            elif item["mimeType"] == "application/vnd.google-apps.presentation":
-                returns.extend(self._load_slide_from_id(item["id"]))
-            elif item["mimeType"] == "application/pdf":
-                returns.extend(self._load_file_from_id(item["id"]))
-            elif item["mimeType"] == "application/vnd.google-apps.folder":
-                GDriveLoader(folder_id=item["id"], shared_dir=self.shared_dir).load()
-            # elif item["mimeType"] == "text/plain":
-            #     continue
-            else:
-                res = self._unstructured_data_loader(item["id"], item["name"], item["mimeType"])
-                if res:
-                    returns.extend(res)
-        logger.info(returns)
-        return returns
-
+            yield from results.get("files", [])
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return
+
+    def _load_item(self, item: Dict[str, Any]) -> Iterable[Document]:
+        """Loads one file by mime type. Errors are logged so one bad file does not stop the crawl,
+           and the file is left out of the manifest run so its chunks stay until it loads"""
+        try:
+            return self.fetch_item(item)
+        except Exception as error:
+            logger.error(f'An error occurred while loading {item["name"]}: {error}')
+            if self.manifest is not None:
+                self.manifest.discard([self.source_id(item)])
+            return []
+
+    def fetch_item(self, item: Dict[str, Any]) -> Iterable[Document]:
+        """Loads one file listed by the crawl by mime type, API and parsing errors are raised"""
+        if item["mimeType"] == "application/vnd.google-apps.document":
+            return [self._load_document_from_id(item["id"])]
+        elif item["mimeType"] == "application/vnd.google-apps.spreadsheet":
+            return self._load_sheet_from_id(item["id"])
+        elif item["mimeType"] == "application/vnd.google-apps.presentation":
+            return self._load_slide_from_id(item["id"])
+        elif item["mimeType"] == "application/pdf":
+            return self._load_file_from_id(item["id"], item.get("md5Checksum"))
+        else:
+            return self._unstructured_data_loader(item["id"], item["name"], item["mimeType"],
+                                                  item.get("md5Checksum") or item.get("modifiedTime")) or []
+
+    def changed_items(self) -> Iterator[Dict[str, Any]]:
+        """Files below the folder that are new or changed since the manifest was committed"""
+        return self._changed_items()
+
+    @staticmethod
+    def source_id(item: Dict[str, Any]) -> str:
+        """Manifest key of a listed file. The transcript of a video is tracked by the video
+           extractor under the bare id, the download under a prefixed one"""
+        if item["mimeType"] == "video/mp4":
+            return f'gdrive-video:{item["id"]}'
+        return item["id"]
+
+    def _is_unchanged(self, item: Dict[str, Any]) -> bool:
+        """Checks the file against the manifest using its md5Checksum, or modifiedTime for
+           native Google files which have no checksum"""
+        if self.manifest is None:
+            return False
+        fingerprint = item.get("md5Checksum") or item.get("modifiedTime", "")
+        return self.manifest.is_unchanged(self.source_id(item), "gdrive", fingerprint)
 
     def _load_documents_from_ids(self) -> List[Document]:
         """Load documents from a list of IDs."""
@@ -255,39 +299,66 @@ class GDriveLoader(BaseLoader):
 
         return [self._load_document_from_id(doc_id) for doc_id in self.document_ids]
 
-    def _load_file_from_id(self, id: str) -> List[Document]:
-        """Load a file from an ID."""
-        from io import BytesIO
-
-        from googleapiclient.discovery import build
-        from googleapiclient.http import MediaIoBaseDownload
-
-        creds = self._load_credentials()
-        service = build("drive", "v3", credentials=creds)
-
-        file = service.files().get(fileId=id).execute()
-        request = service.files().get_media(fileId=id)
-        fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        content = fh.getvalue()
-
-        from PyPDF2 import PdfReader
-
-        pdf_reader = PdfReader(BytesIO(content))
-
-        return [
-            Document(
-                page_content=page.extract_text(),
-                metadata={
-                    "source": f"https://drive.google.com/file/d/{id}/view",
-                    "id": id
-                },
-            )
-            for i, page in enumerate(pdf_reader.pages)
-        ]
+    def _load_file_from_id(self, id: str, md5: Optional[str] = None) -> List[Document]:
+        """Load a PDF from an ID, one document per page."""
+        path = self._download_media(id, os.path.join(self._download_dir(), f"{id}.pdf"), md5)
+        try:
+            return self.pdf.extract(path, md5, {"source": f"https://drive.google.com/file/d/{id}/view", "id": id})
+        finally:
+            os.remove(path)
+
+    def _download_dir(self) -> str:
+        os.makedirs(self.download_dir, exist_ok=True)
+        return self.download_dir
+
+    def _download_media(self, id: str, path: str, revision: Optional[str] = None) -> str:
+        """Streams a binary file to `path` in `chunk_size` ranges so it is never held in memory.
+           Bytes left by an interrupted run are kept in a partial file named after the file's
+           `revision` (md5Checksum or modifiedTime) and the download resumes after them only
+           while the revision is the same. The finished file is renamed into place"""
+        request = self._service().files().get_media(fileId=id)
+        tag = hashlib.sha256(revision.encode("utf-8")).hexdigest()[:16] if revision else "unknown"
+        partial = f"{path}.{tag}.part"
+        # Bytes of another revision would be spliced onto this one's, and without a revision
+        # the partial bytes cannot be trusted either
+        for stale in glob.glob(f"{glob.escape(path)}.*.part"):
+            if stale != partial or not revision:
+                os.remove(stale)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        with open(partial, "ab") as fh, metrics.stage("download", 1) as measure:
+            while True:
+                resp, content = self._ranged_get(request, offset)
+                if resp.status == 416:
+                    # The partial file already holds every byte
+                    break
+                measure.add(bytes=len(content))
+                if resp.status == 200:
+                    # The server ignored the range and sent the whole file
+                    fh.seek(0)
+                    fh.truncate()
+                    fh.write(content)
+                    break
+                fh.write(content)
+                offset += len(content)
+                total = resp.get("content-range", "*/*").rsplit("/", 1)[-1]
+                if (total.isdigit() and offset >= int(total)) or len(content) < self.chunk_size:
+                    break
+        os.replace(partial, path)
+        return path
+
+    def _ranged_get(self, request: Any, offset: int):
+        """Fetches one range of a media request, backing off on 5xx, 429 and 403 rate-limit responses"""
+        headers = {"range": f"bytes={offset}-{offset + self.chunk_size - 1}"}
+        for attempt in range(self.num_retries + 1):
+            resp, content = request.http.request(request.uri, method="GET", headers=headers)
+            rate_limited = resp.status == 429 or (resp.status == 403 and b"ateLimitExceeded" in content)
+            if resp.status < 500 and not rate_limited:
+                break
+            if attempt < self.num_retries:
+                time.sleep(random.random() + 2 ** attempt)
+        if resp.status >= 300 and resp.status != 416:
+            raise HttpError(resp, content, uri=request.uri)
+        return resp, content
 
     def _load_file_from_ids(self) -> List[Document]:
         """Load files from a list of IDs."""
@@ -298,7 +369,7 @@ class GDriveLoader(BaseLoader):
             docs.extend(self._load_file_from_id(file_id))
         return docs
     
-    def _unstructured_data_loader(self, id, name, type):
+    def _unstructured_data_loader(self, id, name, type, revision=None):
 
         """Load a file from an ID.
         # # Install package
@@ -318,72 +389,52 @@ class GDriveLoader(BaseLoader):
         # nltk.download('punkt')
 
         """
-        from io import BytesIO
-        from langchain.document_loaders import UnstructuredFileLoader
-        from googleapiclient.discovery import build
-        from googleapiclient.http import MediaIoBaseDownload
-
-        creds = self._load_credentials()
         try:
-            service = build("drive", "v3", credentials=creds)
-
-            # file = service.files().get(fileId=id).execute()
             # if type == 'application/vnd.google-apps.presentation':
-            #     print('if')
             #     request = service.files().export_media(fileId=id, mimeType='application/pdf')
-            # else:
-            request = service.files().get_media(fileId=id)
-
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-
-            # data = BytesIO(content)
-            logger.info(type)
+            logger.info(f"loading {name} of type {type}")
             if type != 'video/mp4':
                 try:
-                    done = False
-                    while done is False:
-                        status, done = downloader.next_chunk()
-                        logger.info(F'Download {int(status.progress() * 100)}.')
-                    content = fh.getvalue()
-
-                    unstructured_dir = os.path.join(os.path.dirname(self.shared_dir), 'unstructured_files')
+                    parent = os.path.dirname(self.shared_dir) if self.shared_dir else self._download_dir()
+                    unstructured_dir = os.path.join(parent, 'unstructured_files')
                     if not os.path.exists(unstructured_dir):
                         os.makedirs(unstructured_dir, exist_ok=True)
-                    with open(unstructured_dir + '/' + name, 'wb+') as f:
-                        f.write(content)
-                    # print(unstructured_dir+'/'+name)
-                    loader = UnstructuredFileLoader(unstructured_dir + '/' + name, content_type=type, mode="elements")
-                    docs = loader.load()
+                    # Prefixed with the id, files of the same name in different folders download concurrently
+                    path = self._download_media(id, os.path.join(unstructured_dir, id + '**' + name), revision)
+                    docs = self.parser.parse(path, type) if self.parser is not None else parse_file(path, type)
 
                     for doc in docs:
                         doc.metadata.clear()
-                        doc.metadata['source'] = unstructured_dir + '/' + name
+                        doc.metadata['source'] = path
                         doc.metadata['id'] = id
-                    logger.info(docs)
+                    logger.info(f"{name} parsed into {len(docs)} documents")
                     return docs
                 except Exception as e:
                     logger.error(f'error occurred while converting {name} of mime type {type} to document object')
                     logger.error(F' error details: {e}')
+                    # Raised to the caller, which keeps the file's chunks until it converts
+                    raise
             else:
-                logger.info(self.shared_dir)
+                logger.info(f"downloading video {name} to {self.shared_dir}")
                 if not os.path.exists(self.shared_dir):
                     os.makedirs(self.shared_dir, exist_ok=True)
 
-                if name not in os.listdir(self.shared_dir):
-                    done = False
-                    while done is False:
-                        status, done = downloader.next_chunk()
-                        logger.info(F'Download {int(status.progress() * 100)}.')
-                    content = fh.getvalue()
-                    with open(self.shared_dir + '/' + id + '**' + name, 'wb+') as f:
-                        f.write(content)
-                    return
-                else:
+                path = os.path.join(self.shared_dir, id + '**' + name)
+                # Without a manifest an existing download is trusted, with one the file is known to have changed
+                if self.manifest is None and os.path.exists(path):
                     logger.warning(f'file {name}  in {self.shared_dir} directory already exists skipping')
+                    return
+                self._download_media(id, path, revision)
+                return
         except HttpError as error:
             logger.error(F'An error occurred: {error}')
-            file = None
+            raise
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Load documents one by one, folders are streamed as they are crawled."""
+        if self.folder_id:
+            return self._lazy_load_documents_from_folder()
+        return iter(self.load())
 
     def load(self) -> List[Document]:
         """Load documents."""
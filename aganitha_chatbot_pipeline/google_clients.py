@@ -0,0 +1,157 @@
+"""Process-wide cache of Google credentials and API clients."""
+import datetime
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aganitha_chatbot_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+_clients: Dict[Tuple, "GoogleClients"] = {}
+_clients_lock = threading.Lock()
+_documents: Dict[Tuple[str, str], Optional[dict]] = {}
+_documents_lock = threading.Lock()
+
+
+def clients(service_account_key: Path, token_path: Path, credentials_path: Path, scopes: List[str],
+            refresh_margin: float = 300.0) -> "GoogleClients":
+    """The process's clients for these credential files, created on first use"""
+    key = (str(service_account_key), str(token_path), str(credentials_path), tuple(scopes))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = GoogleClients(service_account_key, token_path, credentials_path, scopes, refresh_margin)
+        return _clients[key]
+
+
+def discovery_document(name: str, version: str) -> Optional[dict]:
+    """Parsed discovery document bundled with googleapiclient, read once per process"""
+    import json
+
+    from googleapiclient.discovery_cache import get_static_doc
+
+    with _documents_lock:
+        if (name, version) not in _documents:
+            document = get_static_doc(name, version)
+            _documents[(name, version)] = json.loads(document) if document else None
+        return _documents[(name, version)]
+
+
+def _metered(http: Any) -> Any:
+    """Counts the requests sent on the connection. Responses googleapiclient retries, 5xx, 429
+       and 403 rate limits, are counted as retries"""
+    request = http.request
+
+    def metered_request(*args, **kwargs):
+        resp, content = request(*args, **kwargs)
+        metrics.count("api_calls", service="google")
+        if resp.status >= 500 or resp.status == 429 or (resp.status == 403 and b"ateLimitExceeded" in content):
+            metrics.count("api_retries", service="google")
+        return resp, content
+
+    http.request = metered_request
+    return http
+
+
+class GoogleClients:
+    """Credentials loaded once and shared by every thread, refreshed `refresh_margin` seconds
+       before they expire by the first thread that notices, behind a lock, so concurrent workers
+       never refresh together or send an expired token. httplib2 connections are not thread
+       safe, every thread gets its own authorized connection and API clients built on it"""
+
+    def __init__(self, service_account_key: Path, token_path: Path, credentials_path: Path, scopes: List[str],
+                 refresh_margin: float = 300.0):
+        self.service_account_key = Path(service_account_key)
+        self.token_path = Path(token_path)
+        self.credentials_path = Path(credentials_path)
+        self.scopes = list(scopes)
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def credentials(self) -> Any:
+        """The shared credentials, valid for at least `refresh_margin` more seconds"""
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load()
+            if self._expiring(self._credentials):
+                self._refresh(self._credentials)
+            return self._credentials
+
+    def http(self) -> Any:
+        """The calling thread's authorized connection"""
+        from google_auth_httplib2 import AuthorizedHttp
+        import httplib2
+
+        credentials = self.credentials()
+        http = getattr(self._local, "http", None)
+        if http is None or http.credentials is not credentials:
+            http = self._local.http = AuthorizedHttp(credentials, http=_metered(httplib2.Http()))
+            self._local.services = {}
+        return http
+
+    def service(self, name: str = "drive", version: str = "v3") -> Any:
+        """The calling thread's client for the API, built from the bundled discovery document"""
+        from googleapiclient.discovery import build, build_from_document
+
+        http = self.http()
+        services = self._local.services
+        if (name, version) not in services:
+            document = discovery_document(name, version)
+            if document is not None:
+                services[(name, version)] = build_from_document(document, http=http)
+            else:
+                services[(name, version)] = build(name, version, http=http, cache_discovery=False)
+        return services[(name, version)]
+
+    def _expiring(self, credentials: Any) -> bool:
+        if not credentials.token:
+            return True
+        # google-auth keeps expiry as naive UTC
+        expiry = getattr(credentials, "expiry", None)
+        return expiry is not None and expiry - self.refresh_margin <= datetime.datetime.utcnow()
+
+    def _refresh(self, credentials: Any) -> None:
+        from google.auth.transport.requests import Request
+
+        credentials.refresh(Request())
+        logger.info(f"Google credentials refreshed, valid until {credentials.expiry}")
+        if not self.service_account_key.exists():
+            with open(self.token_path, "w") as token:
+                token.write(credentials.to_json())
+
+    def _load(self) -> Any:
+        """Load credentials."""
+        # Adapted from https://developers.google.com/drive/api/v3/quickstart/python
+        try:
+            from google.oauth2 import service_account
+            from google.oauth2.credentials import Credentials
+            from google_auth_oauthlib.flow import InstalledAppFlow
+        except ImportError:
+            raise ImportError(
+                "You must run"
+                "`pip install --upgrade "
+                "google-api-python-client google-auth-httplib2 "
+                "google-auth-oauthlib`"
+                "to use the Google Drive loader."
+            )
+
+        if self.service_account_key.exists():
+            return service_account.Credentials.from_service_account_file(
+                str(self.service_account_key), scopes=self.scopes
+            )
+
+        creds = None
+        if self.token_path.exists():
+            creds = Credentials.from_authorized_user_file(str(self.token_path), self.scopes)
+        if creds and (creds.valid or creds.refresh_token):
+            # Refreshed by credentials() when it is about to expire
+            return creds
+
+        flow = InstalledAppFlow.from_client_secrets_file(str(self.credentials_path), self.scopes)
+        creds = flow.run_local_server(port=0)
+        with open(self.token_path, "w") as token:
+            token.write(creds.to_json())
+        return creds
@@ -1,12 +1,70 @@
-from langchain.document_loaders import DirectoryLoader
-from typing import List
+from aganitha_chatbot_pipeline.manifest import file_hash
+from aganitha_chatbot_pipeline.parsing import ParserPool, mime_type, parse_file
+from aganitha_chatbot_pipeline.pdf_engine import PdfExtractor
+from aganitha_chatbot_pipeline.streaming import bounded_map
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class KnowledgeDirectoryExtractor:
 
     @staticmethod
-    def directory_loader(knowledge_directory: str) -> List:
+    def directory_loader(knowledge_directory: str, manifest=None) -> List:
         """Loads all the files from the directory using Unstructured Loader class under the hood"""
-        loader: DirectoryLoader = DirectoryLoader(knowledge_directory + '/')
-        docs: List = loader.load()
+        return KnowledgeDirectoryExtractor.load_files(
+            KnowledgeDirectoryExtractor.list_files(knowledge_directory, manifest))
+
+    @staticmethod
+    def lazy_directory_loader(files: List[str], workers: int = 1, timeout: float = 300.0,
+                              parser: ParserPool = None, pdf: PdfExtractor = None, manifest=None) -> Iterator:
+        """Parses the files on a pool of worker processes, one file per task, and yields the
+           documents of each file as soon as it is parsed. A file that fails or takes longer than
+           `timeout` seconds is skipped and left out of the manifest run, so its chunks stay and
+           it is parsed again next run. PDFs are split into page ranges across the pool"""
+        own_parser = parser is None
+        parser = parser or ParserPool(workers, timeout)
+        pdf = pdf or PdfExtractor(parser)
+
+        def load(file: str) -> List:
+            try:
+                if mime_type(file) == "application/pdf":
+                    return pdf.extract(file)
+                return parser.parse(file)
+            except Exception as e:
+                logger.error(f"skipping {file}: {e}")
+                if manifest is not None:
+                    manifest.discard([file])
+                return []
+
+        try:
+            with ThreadPoolExecutor(max_workers=parser.workers) as threads:
+                for docs in bounded_map(threads, load, files, 2 * parser.workers):
+                    yield from docs
+        finally:
+            if own_parser:
+                parser.close()
+
+    @staticmethod
+    def list_files(knowledge_directory: str, manifest=None) -> List[str]:
+        """Walks the directory the way DirectoryLoader does. With a manifest only the files
+           whose content hash changed are kept"""
+        files = []
+        for path in sorted(Path(knowledge_directory).glob("**/[!.]*")):
+            if not path.is_file():
+                continue
+            if manifest is None or not manifest.is_unchanged(str(path), "knowledge_directory",
+                                                             file_hash(str(path))):
+                files.append(str(path))
+        return files
+
+    @staticmethod
+    def load_files(files: List[str]) -> List:
+        """Parses the files in this process, with the native parsers where the type has one"""
+        docs = []
+        for file in files:
+            docs.extend(parse_file(file))
         return docs
@@ -0,0 +1,100 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from aganitha_chatbot_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbeddings(Embeddings):
+    """Runs a sentence-embedding model from the Hugging Face hub on the CPU. Texts are sorted by
+       token length and packed into batches of at most `max_batch_tokens` padded tokens, so short
+       texts are not padded to the length of long ones, and the batches run on `workers` threads
+       that split the cores between them. With `quantize` the model's linear layers run in int8.
+       Vectors are mean-pooled over the tokens and, with `normalize`, scaled to unit length"""
+
+    def __init__(self, model: str = "sentence-transformers/all-MiniLM-L6-v2", workers: int = 1,
+                 max_batch_tokens: int = 8192, max_length: int = 256, quantize: bool = False,
+                 normalize: bool = True):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.model = model
+        self.workers = max(1, workers)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.normalize = normalize
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+        self._tokenizer = AutoTokenizer.from_pretrained(model)
+        self._tokenizer_lock = threading.Lock()
+        self._model = AutoModel.from_pretrained(model).eval()
+        if quantize:
+            self._model = torch.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info(f"local embedding model {model} loaded{' (int8)' if quantize else ''}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def embed_array(self, texts: List[str], dtype: str = "float32") -> np.ndarray:
+        """Embeds the texts into a contiguous (len(texts), dim) array. With dtype "int8" every
+           vector is scaled symmetrically into [-127, 127]"""
+        if not texts:
+            return np.zeros((0, self._model.config.hidden_size), dtype=dtype)
+        with metrics.stage("embed", len(texts), sum(len(text) for text in texts)):
+            return self._embed_array(texts, dtype)
+
+    def _embed_array(self, texts: List[str], dtype: str) -> np.ndarray:
+        with self._tokenizer_lock:
+            lengths = [len(ids) for ids in self._tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]]
+        batches = self._batches(sorted(range(len(texts)), key=lengths.__getitem__), lengths)
+
+        vectors = np.empty((len(texts), self._model.config.hidden_size), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for indices, batch_vectors in pool.map(lambda batch: (batch, self._embed_batch([texts[i] for i in batch])),
+                                                   batches):
+                vectors[indices] = batch_vectors
+        if dtype == "int8":
+            return self.quantize(vectors)
+        return np.ascontiguousarray(vectors, dtype=dtype)
+
+    @staticmethod
+    def quantize(vectors: np.ndarray) -> np.ndarray:
+        scale = np.abs(vectors).max(axis=1, keepdims=True)
+        scale[scale == 0] = 1.0
+        return np.ascontiguousarray(np.round(vectors / scale * 127), dtype=np.int8)
+
+    def _batches(self, order: List[int], lengths: List[int]) -> List[List[int]]:
+        """Packs indices, shortest first, while batch size times the longest length fits the budget"""
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for index in order:
+            if batch and (len(batch) + 1) * lengths[index] > self.max_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        with self._tokenizer_lock:
+            encoded = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                      return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self._model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            if self.normalize:
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+        return pooled.numpy()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data) -> str:
+    """Returns the sha256 hex digest of a str or bytes payload"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """`content_hash` of a file's bytes, read in blocks so that large files are not held in memory"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def source_key(metadata: Dict) -> str:
+    """Returns the key a document is tracked under in the manifest.
+       Drive and video documents carry the file id, everything else is keyed by its source"""
+    return str(metadata.get("id") or metadata.get("source"))
+
+
+class Manifest:
+    """Persistent record of every ingested source: its fingerprint (content hash, Drive
+       md5Checksum/modifiedTime or file stat) and the ids of the chunks it produced.
+
+       Extractors call `is_unchanged` for each input they enumerate, the pipeline records the
+       chunk ids of the sources it re-processed and `commit` writes everything in one go once
+       the vector store is up to date, so a failed run never marks a source as ingested."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "source_id TEXT PRIMARY KEY, source_type TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "chunk_ids TEXT NOT NULL DEFAULT '[]', updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._active_types: Set[str] = set()
+        self._seen: Set[str] = set()
+        self._pending: Dict[str, Tuple[str, str]] = {}
+        self._pending_chunks: Dict[str, List[str]] = {}
+        self._forgotten: Set[str] = set()
+
+    def begin(self, source_types: Iterable[str]) -> None:
+        """Starts a run. Only sources of these types are considered for removal"""
+        self._active_types = set(source_types)
+        self._seen.clear()
+        self._pending.clear()
+        self._pending_chunks.clear()
+        self._forgotten.clear()
+
+    def is_unchanged(self, source_id: str, source_type: str, fingerprint: str) -> bool:
+        """Marks the source as seen in this run and tells whether it matches the stored fingerprint"""
+        with self._lock:
+            self._seen.add(source_id)
+            row = self._conn.execute(
+                "SELECT fingerprint FROM sources WHERE source_id = ?", (source_id,)
+            ).fetchone()
+            if row is not None and row[0] == fingerprint:
+                return True
+            self._pending[source_id] = (source_type, fingerprint)
+            return False
+
+    def discard(self, source_ids: Iterable[str]) -> None:
+        """Leaves sources that could not be loaded out of this run: they are marked seen, so they
+           are not removed, but their fingerprints and chunks are kept as they were and they count
+           as changed next run"""
+        with self._lock:
+            for source_id in source_ids:
+                self._seen.add(source_id)
+                self._pending.pop(source_id, None)
+                self._pending_chunks.pop(source_id, None)
+
+    def changed_sources(self) -> List[str]:
+        """Sources found new or changed in this run"""
+        with self._lock:
+            return list(self._pending)
+
+    def chunk_ids(self, source_id: str) -> Set[str]:
+        """Chunk ids recorded for the source by the last successful run"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunk_ids FROM sources WHERE source_id = ?", (source_id,)
+            ).fetchone()
+        return set(json.loads(row[0])) if row else set()
+
+    def set_chunk_ids(self, source_id: str, chunk_ids: Iterable[str]) -> None:
+        """Stages the chunk ids the source produced in this run"""
+        with self._lock:
+            self._pending_chunks[source_id] = sorted(set(chunk_ids))
+
+    def referenced(self, chunk_ids: Set[str]) -> Set[str]:
+        """Chunk ids among these that some source still holds once this run is committed. With
+           deduplication a chunk is shared by every source that produced it"""
+        held: Set[str] = set()
+        with self._lock:
+            for pending in self._pending_chunks.values():
+                held |= chunk_ids.intersection(pending)
+            for source_id, raw in self._conn.execute("SELECT source_id, chunk_ids FROM sources"):
+                if source_id not in self._pending_chunks and source_id not in self._forgotten:
+                    held |= chunk_ids.intersection(json.loads(raw))
+        return held
+
+    def removed_sources(self) -> List[str]:
+        """Sources of the active types that were not enumerated by this run"""
+        if not self._active_types:
+            return []
+        marks = ",".join("?" * len(self._active_types))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source_id FROM sources WHERE source_type IN ({marks})",
+                tuple(self._active_types),
+            ).fetchall()
+        return [row[0] for row in rows if row[0] not in self._seen]
+
+    def forget(self, source_ids: Iterable[str]) -> None:
+        """Stages dropping removed sources from the manifest, done by `commit`"""
+        with self._lock:
+            self._forgotten.update(source_ids)
+
+    def bind(self, vector_store: str) -> None:
+        """Ties the manifest to the vector store (and chunking) it describes. Chunk ids recorded
+           for another store say nothing about this one, so switching stores forgets every source"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = 'vector_store'").fetchone()
+            if row is not None and row[0] == vector_store:
+                return
+            count = self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+            if count:
+                logger.warning(f"vector store is now {vector_store}, all {count} sources are ingested again")
+                self._conn.execute("DELETE FROM sources")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('vector_store', ?)", (vector_store,)
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value)
+            )
+            self._conn.commit()
+
+    def commit(self) -> None:
+        """Persists the fingerprints and chunk ids staged during the run and drops the removed sources"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM sources WHERE source_id = ?", [(source_id,) for source_id in self._forgotten]
+            )
+            for source_id, (source_type, fingerprint) in self._pending.items():
+                chunk_ids = self._pending_chunks.get(source_id, [])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (source_id, source_type, fingerprint, chunk_ids, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (source_id, source_type, fingerprint, json.dumps(chunk_ids), now),
+                )
+            self._conn.commit()
+            logger.info(f"manifest updated for {len(self._pending)} sources, {len(self._forgotten)} removed")
+            self._pending.clear()
+            self._pending_chunks.clear()
+            self._forgotten.clear()
+
+    def close(self) -> None:
+        self._conn.close()
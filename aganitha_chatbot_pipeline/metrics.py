@@ -0,0 +1,304 @@
+"""Process-wide run metrics: time, CPU, volume and peak memory per pipeline stage, counters of
+API calls and retries, optional profiles of one stage, a JSON run report and a Prometheus text
+endpoint. Stages are timed on the thread that runs them and may nest, e.g. embedding happens
+inside indexing; with several threads in one stage its busy time can exceed the run time."""
+import datetime
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "pipeline"
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def _peak_rss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage:
+    """Totals of one stage. `items` and `bytes` may be added while the stage runs, text is
+       counted in characters"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+        # Process peak RSS when the stage last finished, a stage that raised it shows it first
+        self.peak_rss = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        span = self.last_end - self.first_start if self.calls else 0.0
+        return {"calls": self.calls, "seconds": self.seconds, "cpu_seconds": self.cpu_seconds,
+                "span_seconds": span, "items": self.items, "bytes": self.bytes, "errors": self.errors,
+                "items_per_sec": self.items / self.seconds if self.seconds else 0.0,
+                "peak_rss_mb": self.peak_rss / (1024 * 1024)}
+
+
+class _Measure:
+    """Volume of one stage call, handed to the caller to add to while it runs"""
+
+    def __init__(self, items: int, bytes: int):
+        self.items = items
+        self.bytes = bytes
+
+    def add(self, items: int = 0, bytes: int = 0) -> None:
+        self.items += items
+        self.bytes += bytes
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self._start_cpu = time.process_time()
+        self._stages: Dict[str, Stage] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile_stage: Optional[str] = None
+        self._profiler = "cprofile"
+        self._profiles: List[Any] = []
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0, bytes: int = 0) -> Iterator[_Measure]:
+        """Times the block as one call of the stage, an exception leaving it counts as an error"""
+        measure = _Measure(items, bytes)
+        profiler = self._start_profile(name)
+        start, cpu = time.perf_counter(), time.thread_time()
+        failed = False
+        try:
+            yield measure
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, time.thread_time() - cpu,
+                        measure.items, measure.bytes, failed, start)
+            if profiler is not None:
+                profiler.disable() if self._profiler == "cprofile" else profiler.stop()
+                self._local.profiling = False
+
+    def iterate(self, name: str, items: Iterable[Any], size=None) -> Iterator[Any]:
+        """Yields the items, timing how long producing each one takes. The consumer's time in
+           between is not counted. `size` gives the bytes of an item"""
+        items = iter(items)
+        while True:
+            with self.stage(name) as measure:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                measure.add(1, size(item) if size is not None else 0)
+            yield item
+
+    def record(self, name: str, seconds: float, cpu_seconds: float = 0.0, items: int = 0, bytes: int = 0,
+               failed: bool = False, start: Optional[float] = None) -> None:
+        end = time.perf_counter()
+        peak = _peak_rss()
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = Stage()
+            stage.calls += 1
+            stage.seconds += seconds
+            stage.cpu_seconds += cpu_seconds
+            stage.items += items
+            stage.bytes += bytes
+            stage.errors += failed
+            stage.first_start = min(stage.first_start or end, start if start is not None else end - seconds)
+            stage.last_end = end
+            stage.peak_rss = peak
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Adds to a counter such as api_calls or api_retries, labelled e.g. by service"""
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def profile(self, stage: Optional[str], profiler: str = "cprofile") -> None:
+        """Profiles every call of the stage, on whichever thread it runs, until `save_profile`"""
+        if profiler not in PROFILERS:
+            raise ValueError(f"profiler must be one of {PROFILERS}, not {profiler!r}")
+        if stage and profiler == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                raise ImportError("You must run `pip install pyinstrument` to profile with pyinstrument.")
+        self._profile_stage = stage or None
+        self._profiler = profiler
+
+    def save_profile(self, path: str) -> Optional[str]:
+        """Writes the profile of the chosen stage, merged across threads: pstats data for
+           cProfile, an HTML page for pyinstrument. The path written, None without a profile"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        if self._profiler == "cprofile":
+            import pstats
+
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        else:
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+
+            sessions = [profile.last_session for profile in profiles if profile.last_session is not None]
+            session = sessions[0]
+            for other in sessions[1:]:
+                session = Session.combine(session, other)
+            with open(path, "w") as f:
+                f.write(HTMLRenderer().render(session))
+        logger.info(f"{self._profile_stage} profile written to {path}")
+        return path
+
+    def report(self) -> Dict[str, Any]:
+        """The run so far: process totals, every stage and every counter"""
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self._lock:
+            stages = {name: stage.as_dict() for name, stage in sorted(self._stages.items())}
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "wall_seconds": time.time() - self.started,
+            "cpu_seconds": time.process_time() - self._start_cpu,
+            # Parser and Whisper processes, counted once they have exited
+            "children_cpu_seconds": children.ru_utime + children.ru_stime,
+            "peak_rss_mb": _peak_rss() / (1024 * 1024),
+            "children_peak_rss_mb": children.ru_maxrss / 1024,
+            "stages": stages,
+            "counters": counters,
+        }
+
+    def write_report(self, path: str) -> None:
+        partial = f"{path}.partial"
+        with open(partial, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(partial, path)
+        logger.info(f"run report written to {path}")
+
+    def prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format"""
+        report = self.report()
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: List[Tuple[Dict[str, str], float]]) -> None:
+            lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+                lines.append(f"{PREFIX}_{name}{{{rendered}}} {value}" if rendered else f"{PREFIX}_{name} {value}")
+
+        metric("cpu_seconds_total", "counter", "CPU time of this process", [({}, report["cpu_seconds"])])
+        metric("peak_rss_bytes", "gauge", "Peak resident memory of this process",
+               [({}, report["peak_rss_mb"] * 1024 * 1024)])
+        stages = report["stages"]
+        for field, name, help in (("calls", "stage_calls_total", "Calls of each stage"),
+                                  ("seconds", "stage_seconds_total", "Wall time spent in each stage"),
+                                  ("cpu_seconds", "stage_cpu_seconds_total", "CPU time of the threads in each stage"),
+                                  ("items", "stage_items_total", "Items processed by each stage"),
+                                  ("bytes", "stage_bytes_total", "Bytes processed by each stage"),
+                                  ("errors", "stage_errors_total", "Stage calls that raised")):
+            metric(name, "counter", help, [({"stage": stage}, values[field]) for stage, values in stages.items()])
+        counters: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+        for counter in report["counters"]:
+            counters.setdefault(counter["name"], []).append((counter["labels"], counter["value"]))
+        for name, samples in counters.items():
+            metric(f"{name}_total", "counter", name.replace("_", " ").capitalize(), samples)
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+        self.started = time.time()
+        self._start_cpu = time.process_time()
+
+    def _start_profile(self, name: str) -> Any:
+        if name != self._profile_stage or getattr(self._local, "profiling", False):
+            return None
+        # One profiler per thread, started again for every call of the stage on it
+        profiler = getattr(self._local, "profiler", None)
+        if profiler is None:
+            if self._profiler == "cprofile":
+                import cProfile
+                profiler = cProfile.Profile()
+            else:
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode="disabled")
+            self._local.profiler = profiler
+            with self._lock:
+                self._profiles.append(profiler)
+        try:
+            profiler.enable() if self._profiler == "cprofile" else profiler.start()
+        except (RuntimeError, ValueError):
+            # Another profiler is already active on this thread
+            return None
+        self._local.profiling = True
+        return profiler
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves GET /metrics in the Prometheus text format, for long runs and the retrieval service"""
+
+    daemon_threads = True
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9100):
+        super().__init__((host, port), _Handler)
+        self.metrics = metrics
+
+    def start(self) -> "MetricsServer":
+        threading.Thread(target=self.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"metrics on http://{self.server_address[0]}:{self.server_address[1]}/metrics")
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MetricsServer
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        raw = self.server.metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+# The process's metrics, every module records into these
+metrics = Metrics()
+stage = metrics.stage
+iterate = metrics.iterate
+record = metrics.record
+count = metrics.count
+profile = metrics.profile
+save_profile = metrics.save_profile
+report = metrics.report
+write_report = metrics.write_report
+prometheus = metrics.prometheus
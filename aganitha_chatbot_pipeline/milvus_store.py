@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from aganitha_chatbot_pipeline.filters import milvus_expr
+from aganitha_chatbot_pipeline.manifest import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Search time parameter of every index type that has one
+SEARCH_PARAMS = {"IVF_FLAT": "nprobe", "IVF_SQ8": "nprobe", "IVF_PQ": "nprobe", "HNSW": "ef"}
+# Environment variables that take precedence over the keys of the MILVUS section, so that the
+# cluster and its credentials stay out of config.yml
+ENVIRONMENT = {"URI": "MILVUS_URI", "USER": "MILVUS_USER", "PASSWORD": "MILVUS_PASSWORD", "TOKEN": "MILVUS_TOKEN"}
+
+
+def setting(config: Dict[str, Any], key: str) -> Any:
+    """A key of the MILVUS section, from its environment variable when that is set"""
+    return os.environ.get(ENVIRONMENT[key], config.get(key))
+
+
+def connection_args(config: Dict[str, Any]) -> Dict[str, Any]:
+    """pymilvus connection arguments from the MILVUS section and the ENVIRONMENT variables. A
+       URI that is a file path opens a Milvus Lite database in that file"""
+    uri = setting(config, "URI")
+    if not uri:
+        raise ValueError("set MILVUS_URI, or MILVUS.URI in config.yml, to a Milvus server or a Milvus Lite file")
+    args: Dict[str, Any] = {"alias": config.get("ALIAS", "default"), "uri": uri}
+    token = setting(config, "TOKEN")
+    if token:
+        args["token"] = token
+    user = setting(config, "USER")
+    if user:
+        args["user"] = user
+        args["password"] = setting(config, "PASSWORD") or ""
+    if "SECURE" in config:
+        args["secure"] = config["SECURE"]
+    return args
+
+
+class MilvusStore(VectorStore):
+    """Milvus collection keyed by chunk id. The collection is created on first use with the
+       configured index, chunks are upserted so that re-ingesting a source replaces its rows,
+       and writes go out in parallel batches bounded by row count and byte size.
+
+       Milvus flushes segments by itself, `save` flushes explicitly with `flush` and, with
+       `compact`, merges segments and purges deleted rows after the run's deletes"""
+
+    def __init__(self, embeddings: Embeddings, connection: Dict[str, Any], collection_name: str,
+                 index_type: str = "HNSW", metric_type: str = "L2", nlist: int = 1024, m: int = 16,
+                 ef_construction: int = 200, nprobe: int = 16, ef: int = 64, batch_rows: int = 1000,
+                 batch_bytes: int = 32 * 1024 * 1024, workers: int = 4, flush: bool = True, compact: bool = False):
+        from pymilvus import connections
+
+        self.embeddings = embeddings
+        self.connection = connection
+        self.collection_name = collection_name
+        self.index_type = index_type
+        self.metric_type = metric_type
+        self.nlist = nlist
+        self.m = m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef = ef
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.workers = max(1, workers)
+        self.flush = flush
+        self.compact = compact
+        self.alias = connection.get("alias", "default")
+        connections.connect(**connection)
+        self.col = self._collection()
+        self._checked = False
+        self._deleted = 0
+
+    def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None,
+                  vectors: Optional[Any] = None, **kwargs: Any) -> List[str]:
+        """Upserts the chunks with their `vectors`, embedding them when none are given"""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        chunk_ids = [metadata.get("chunk_id") or content_hash(text) for text, metadata in zip(texts, metadatas)]
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(texts)
+        else:
+            # e.g. rows of a memory-mapped chunk store
+            vectors = [[float(value) for value in vector] for vector in vectors]
+        if self.col is None:
+            self.col = self._create_collection(len(vectors[0]))
+        self._check_collection(len(vectors[0]))
+        rows = [
+            {"chunk_id": chunk_id, "source": str(metadata.get("source", ""))[:2048], "text": text,
+             "metadata": metadata, "vector": vector}
+            for chunk_id, text, metadata, vector in zip(chunk_ids, texts, metadatas, vectors)
+        ]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _ in pool.map(self.col.upsert, self._batches(rows)):
+                pass
+        return chunk_ids
+
+    def delete(self, chunk_ids: List[str]) -> None:
+        if self.col is None or not chunk_ids:
+            return
+        for start in range(0, len(chunk_ids), self.batch_rows):
+            self.col.delete(f"chunk_id in {json.dumps(chunk_ids[start:start + self.batch_rows])}")
+        self._deleted += len(chunk_ids)
+
+    def update_metadata(self, updates: Dict[str, dict]) -> None:
+        """Merges fields into the metadata of stored chunks, keyed by chunk id. Rows are read
+           back with their vectors and upserted, nothing is embedded again"""
+        if self.col is None or not updates:
+            return
+        chunk_ids = list(updates)
+        for start in range(0, len(chunk_ids), self.batch_rows):
+            rows = self.col.query(f"chunk_id in {json.dumps(chunk_ids[start:start + self.batch_rows])}",
+                                  output_fields=["chunk_id", "source", "text", "metadata", "vector"])
+            for row in rows:
+                row["metadata"] = dict(row.get("metadata") or {}, **updates[row["chunk_id"]])
+            if rows:
+                self.col.upsert([{field: row[field] for field in ("chunk_id", "source", "text", "metadata", "vector")}
+                                 for row in rows])
+
+    def similarity_search(self, query: str, k: int = 4, expr: Optional[str] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, expr)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     expr: Optional[str] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k, expr)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, expr: Optional[str] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, expr)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, expr: Optional[str] = None,
+                                               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """`expr` is a Milvus boolean expression over chunk_id, source and metadata["..."], metadata
+           `filters` are translated into one and both are applied by Milvus during the search"""
+        if self.col is None:
+            return []
+        if filters:
+            expr = " and ".join(f"({condition})" for condition in (expr, milvus_expr(filters)) if condition)
+        params: Dict[str, Any] = {"metric_type": self.metric_type, "params": {}}
+        if self.index_type in SEARCH_PARAMS:
+            name = SEARCH_PARAMS[self.index_type]
+            params["params"][name] = self.ef if name == "ef" else self.nprobe
+        hits = self.col.search([embedding], "vector", params, limit=k, expr=expr,
+                               output_fields=["text", "metadata"])[0]
+        return [(Document(page_content=hit.entity.get("text"), metadata=hit.entity.get("metadata") or {}),
+                 hit.distance) for hit in hits]
+
+    def save(self) -> None:
+        if self.col is None:
+            return
+        if self.flush:
+            self.col.flush()
+        if self.compact and self._deleted:
+            self.col.compact()
+            self.col.wait_for_compaction_completed()
+            logger.info(f"MILVUS collection {self.collection_name} compacted after {self._deleted} deletes")
+        self._deleted = 0
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   connection: Optional[Dict[str, Any]] = None, collection_name: str = "aganitha_chatbot",
+                   **kwargs: Any) -> "MilvusStore":
+        store = cls(embedding, connection or {}, collection_name, **kwargs)
+        store.add_texts(texts, metadatas)
+        store.save()
+        return store
+
+    def _collection(self):
+        from pymilvus import Collection, utility
+
+        if not utility.has_collection(self.collection_name, using=self.alias):
+            return None
+        col = Collection(self.collection_name, using=self.alias)
+        col.load()
+        return col
+
+    def _check_collection(self, dimensions: int) -> None:
+        """Refuses to write into a collection built for other vectors, Milvus would reject the
+           batches one by one or, for a different metric, search them with the wrong distance"""
+        if self._checked:
+            return
+        field = next((field for field in self.col.schema.fields if field.name == "vector"), None)
+        dim = field.params.get("dim") if field is not None else None
+        if dim is not None and int(dim) != dimensions:
+            raise ValueError(f"MILVUS collection {self.collection_name} holds {dim}-dimensional vectors, "
+                             f"the embeddings have {dimensions}")
+        for index in self.col.indexes:
+            metric = index.params.get("metric_type")
+            if index.field_name == "vector" and metric and metric != self.metric_type:
+                raise ValueError(f"MILVUS collection {self.collection_name} is indexed for {metric}, "
+                                 f"METRIC_TYPE is {self.metric_type}")
+        self._checked = True
+
+    def _create_collection(self, dimensions: int):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
+
+        schema = CollectionSchema([
+            FieldSchema("chunk_id", DataType.VARCHAR, is_primary=True, auto_id=False, max_length=64),
+            FieldSchema("source", DataType.VARCHAR, max_length=2048),
+            FieldSchema("text", DataType.VARCHAR, max_length=65535),
+            FieldSchema("metadata", DataType.JSON),
+            FieldSchema("vector", DataType.FLOAT_VECTOR, dim=dimensions),
+        ], description="aganitha chatbot chunks")
+        col = Collection(self.collection_name, schema, using=self.alias)
+        col.create_index("vector", {"index_type": self.index_type, "metric_type": self.metric_type,
+                                    "params": self._index_params()})
+        col.load()
+        logger.info(f"MILVUS collection {self.collection_name} created with a {self.index_type} index")
+        return col
+
+    def _index_params(self) -> Dict[str, Any]:
+        if self.index_type == "HNSW":
+            return {"M": self.m, "efConstruction": self.ef_construction}
+        if self.index_type == "IVF_PQ":
+            return {"nlist": self.nlist, "m": self.m}
+        if self.index_type.startswith("IVF"):
+            return {"nlist": self.nlist}
+        return {}
+
+    def _batches(self, rows: List[dict]) -> Iterator[List[dict]]:
+        """Consecutive batches of at most batch_rows rows and, roughly, batch_bytes bytes"""
+        batch: List[dict] = []
+        size = 0
+        for row in rows:
+            row_size = len(row["text"].encode("utf-8")) + len(json.dumps(row["metadata"])) + 4 * len(row["vector"]) + 128
+            if batch and (len(batch) >= self.batch_rows or size + row_size > self.batch_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(row)
+            size += row_size
+        if batch:
+            yield batch
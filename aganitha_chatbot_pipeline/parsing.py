@@ -0,0 +1,180 @@
+import logging
+import mimetypes
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional
+from xml.etree import ElementTree
+
+from langchain.docstore.document import Document
+
+from aganitha_chatbot_pipeline import metrics
+from aganitha_chatbot_pipeline.pdf_engine import extract_pages
+
+logger = logging.getLogger(__name__)
+
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPTX = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+# text/* types that are markup rather than text, unstructured strips those
+_MARKUP = {"text/html", "text/xml"}
+_TEXT_APPLICATIONS = {"application/json", "application/x-yaml", "application/yaml", "application/x-sh"}
+_SLIDE_NUMBER = re.compile(r"slide(\d+)\.xml$")
+
+
+class ParseError(Exception):
+    """A file could not be parsed: it failed, timed out or crashed its worker twice"""
+
+
+def mime_type(path: str) -> Optional[str]:
+    return mimetypes.guess_type(path)[0]
+
+
+def parse_file(path: str, content_type: Optional[str] = None) -> List[Document]:
+    """Parses one file into documents. Plain text, PDF text layers, DOCX and PPTX are read
+       directly, everything else (and PDFs without a text layer) goes through unstructured"""
+    content_type = content_type or mime_type(path) or ""
+    parser = _parser(content_type)
+    if parser is not None:
+        docs = parser(path)
+        if any(doc.page_content.strip() for doc in docs):
+            return docs
+    return _parse_unstructured(path, content_type)
+
+
+def _parser(content_type: str) -> Optional[Callable[[str], List[Document]]]:
+    if content_type.startswith("text/") and content_type not in _MARKUP or content_type in _TEXT_APPLICATIONS:
+        return _parse_text
+    return {"application/pdf": _parse_pdf, DOCX: _parse_docx, PPTX: _parse_pptx}.get(content_type)
+
+
+def _parse_text(path: str) -> List[Document]:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return [Document(page_content=f.read(), metadata={"source": path})]
+
+
+def _parse_pdf(path: str) -> List[Document]:
+    return [Document(page_content=text, metadata={"source": path, "page": number})
+            for number, text in enumerate(extract_pages(path), start=1)]
+
+
+def _xml_paragraphs(xml, paragraph_tag: str) -> List[str]:
+    """Text of every paragraph element, streamed so large parts are never held as a tree"""
+    paragraphs: List[str] = []
+    parts: List[str] = []
+    for _, element in ElementTree.iterparse(xml, events=("end",)):
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "t":
+            parts.append(element.text or "")
+        elif tag == "tab":
+            parts.append("\t")
+        elif tag in ("br", "cr"):
+            parts.append("\n")
+        elif tag == paragraph_tag:
+            if "".join(parts).strip():
+                paragraphs.append("".join(parts))
+            parts = []
+            element.clear()
+    return paragraphs
+
+
+def _parse_docx(path: str) -> List[Document]:
+    with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        text = "\n\n".join(_xml_paragraphs(xml, "p"))
+    return [Document(page_content=text, metadata={"source": path})]
+
+
+def _parse_pptx(path: str) -> List[Document]:
+    slides = []
+    with zipfile.ZipFile(path) as archive:
+        names = [name for name in archive.namelist()
+                 if name.startswith("ppt/slides/slide") and _SLIDE_NUMBER.search(name)]
+        for name in sorted(names, key=lambda name: int(_SLIDE_NUMBER.search(name).group(1))):
+            with archive.open(name) as xml:
+                slides.append("\n".join(_xml_paragraphs(xml, "p")))
+    return [Document(page_content="\n\n".join(slides), metadata={"source": path})]
+
+
+def _parse_unstructured(path: str, content_type: str) -> List[Document]:
+    from langchain.document_loaders import UnstructuredFileLoader
+
+    if content_type:
+        return UnstructuredFileLoader(path, content_type=content_type).load()
+    return UnstructuredFileLoader(path).load()
+
+
+class ParserPool:
+    """Parses files on a pool of `workers` processes, callable from many threads at once.
+       A file still parsing after `timeout` seconds is given up on: the pool is killed and
+       started again, and the files that were in flight with it are parsed once more. Workers
+       are spawned since the pipeline calls in from its loader threads"""
+
+    def __init__(self, workers: Optional[int] = None, timeout: float = 300.0):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Files are only handed to the pool when a worker is free, so the timeout runs from the start
+        self._slots = threading.Semaphore(self.workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+
+    def parse(self, path: str, content_type: Optional[str] = None) -> List[Document]:
+        """Documents of the file, ParseError if it failed, timed out or crashed its worker twice"""
+        docs = self.call(parse_file, path, content_type, label=path)
+        if docs is None:
+            raise ParseError(f"parsing {path} failed or timed out")
+        return docs
+
+    def call(self, fn: Callable, *args, label: str = "") -> Any:
+        """Runs a picklable function on the pool, None if it failed, timed out or crashed its
+           worker twice"""
+        for attempt in range(2):
+            with self._slots:
+                pool, generation = self._current()
+                # Timed from the parsing thread, the CPU time is spent in the worker processes
+                with metrics.stage("parse", 1):
+                    try:
+                        return pool.submit(fn, *args).result(timeout=self.timeout)
+                    except FutureTimeout:
+                        logger.error(f"parsing {label} timed out after {self.timeout}s, restarting the parser pool")
+                        metrics.count("parse_timeouts")
+                        self._restart(generation)
+                        return None
+                    except BrokenProcessPool:
+                        # Killed by another file's timeout, or this file crashed the worker
+                        metrics.count("parse_retries")
+                        self._restart(generation)
+                    except Exception as e:
+                        logger.error(f"failed to parse {label}: {e!r}")
+                        metrics.count("parse_failures")
+                        return None
+        logger.error(f"parsing {label} crashed the parser pool, skipping it")
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _current(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+            return self._pool, self._generation
+
+    def _restart(self, generation: int) -> None:
+        with self._lock:
+            if generation != self._generation or self._pool is None:
+                return
+            # The executor cannot cancel a running call, its workers are killed instead
+            processes: Dict = getattr(self._pool, "_processes", None) or {}
+            for process in list(processes.values()):
+                process.kill()
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._generation += 1
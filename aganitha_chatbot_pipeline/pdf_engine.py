@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import mmap
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+
+def extract_pages(path: str, first: int = 0, last: Optional[int] = None) -> List[str]:
+    """Text layer of pages [first, last) read straight from a memory map of the file"""
+    from PyPDF2 import PdfReader
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pages = PdfReader(data).pages
+        return [pages[number].extract_text() or "" for number in range(first, len(pages) if last is None else last)]
+
+
+def page_count(path: str) -> int:
+    from PyPDF2 import PdfReader
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return len(PdfReader(data).pages)
+
+
+def file_md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class PageCache:
+    """SQLite store of page text keyed by (md5 of the file, page number)"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (md5 TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, "
+            "PRIMARY KEY (md5, page))"
+        )
+        self._conn.commit()
+
+    def get(self, md5: str) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT page, text FROM pages WHERE md5 = ?", (md5,)).fetchall())
+
+    def put_many(self, md5: str, pages: List[Tuple[int, str]]) -> None:
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO pages (md5, page, text) VALUES (?, ?, ?)",
+                                   [(md5, number, text) for number, text in pages])
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class PdfExtractor:
+    """Extracts PDFs page by page. Pages whose text is cached under the file's md5 are not
+       parsed again, the others are cut into runs of `pages_per_task` pages extracted in
+       parallel on the parser pool's processes (in this process without a pool). Every page
+       becomes a document with its 1-based number in the `page` metadata. PDFs without a text
+       layer go to the parser's unstructured fallback. ParseError if a page could not be
+       extracted, the pages that were are cached all the same"""
+
+    def __init__(self, parser=None, cache_path: Optional[str] = None, pages_per_task: int = 16):
+        self.parser = parser
+        self.cache = PageCache(cache_path) if cache_path else None
+        self.pages_per_task = max(1, pages_per_task)
+
+    def extract(self, path: str, md5: Optional[str] = None, metadata: Optional[dict] = None) -> List[Document]:
+        metadata = metadata or {"source": path}
+        md5 = md5 or file_md5(path)
+        texts = self.cache.get(md5) if self.cache is not None else {}
+        count = page_count(path)
+        missing = [number for number in range(1, count + 1) if number not in texts]
+        if missing:
+            extracted = self._extract(path, missing)
+            if self.cache is not None:
+                self.cache.put_many(md5, extracted)
+            texts.update(extracted)
+            if len(extracted) < len(missing):
+                from aganitha_chatbot_pipeline.parsing import ParseError
+
+                raise ParseError(f"{path}: {len(missing) - len(extracted)} of {count} pages could not be extracted")
+        logger.info(f"{path}: {count} pages, {count - len(missing)} from the page cache")
+
+        if not any(texts.get(number, "").strip() for number in range(1, count + 1)):
+            from aganitha_chatbot_pipeline.parsing import parse_file
+
+            docs = self.parser.parse(path, "application/pdf") if self.parser is not None else parse_file(path)
+            for doc in docs:
+                doc.metadata = dict(metadata, **{key: value for key, value in doc.metadata.items() if key == "page"})
+            return docs
+        return [Document(page_content=texts.get(number, ""), metadata=dict(metadata, page=number))
+                for number in range(1, count + 1)]
+
+    def _extract(self, path: str, pages: List[int]) -> List[Tuple[int, str]]:
+        """(page, text) of the pages, each run of consecutive pages extracted as one task"""
+        runs: List[Tuple[int, int]] = []
+        for number in pages:
+            if runs and runs[-1][1] == number - 1 and runs[-1][1] - runs[-1][0] + 1 < self.pages_per_task:
+                runs[-1] = (runs[-1][0], number)
+            else:
+                runs.append((number, number))
+        if self.parser is None:
+            results = [extract_pages(path, first - 1, last) for first, last in runs]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(runs), self.parser.workers)) as threads:
+                results = list(threads.map(
+                    lambda run: self.parser.call(extract_pages, path, run[0] - 1, run[1],
+                                                 label=f"{path} pages {run[0]}-{run[1]}"), runs))
+        extracted = []
+        for (first, last), texts in zip(runs, results):
+            # A run that failed is left out, so it is tried again next time rather than cached empty
+            if texts is not None:
+                extracted.extend(zip(range(first, last + 1), texts))
+        return extracted
@@ -1,17 +1,41 @@
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.docstore.document import Document
-from aganitha_chatbot_pipeline import video_extractor, website_extractor, knowlede_directory_extractor
+from aganitha_chatbot_pipeline import metrics, plugins
 from aganitha_chatbot_pipeline.yaml_parser import YamlParser
-from aganitha_chatbot_pipeline.gdrive_extractor import GDriveLoader
-from typing import List, Any
-import pickle
+from aganitha_chatbot_pipeline.chunker import Chunker
+from aganitha_chatbot_pipeline.parsing import ParserPool
+from aganitha_chatbot_pipeline.pdf_engine import PdfExtractor
+from aganitha_chatbot_pipeline.manifest import Manifest, content_hash, source_key
+from aganitha_chatbot_pipeline.bm25_index import BM25Index
+from aganitha_chatbot_pipeline.embedding_cache import CachedEmbeddings, EmbeddingCache
+from aganitha_chatbot_pipeline.embedding_engine import BatchedEmbeddings
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, Iterator, List, Any, Optional, Set, Tuple
+import os
 import logging
+import threading
 import warnings
 
+if TYPE_CHECKING:
+    # Extractors and their clients are plugins, imported once a run enables them
+    from aganitha_chatbot_pipeline.chunk_store import ChunkStore
+    from aganitha_chatbot_pipeline.dedup import Deduplicator
+    from aganitha_chatbot_pipeline.gdrive_extractor import GDriveLoader
+    from aganitha_chatbot_pipeline.transcription import TranscriptionService
+    from aganitha_chatbot_pipeline.web_crawler import WebCrawler
+
 
 warnings.filterwarnings("ignore")
 logging.basicConfig(level='INFO')
 
+class _SourceDone:
+    """Marks the end of one loader's stream, carrying the error that stopped it if any"""
+
+    def __init__(self, source: str, error: Optional[BaseException] = None):
+        self.source = source
+        self.error = error
+
 
 class Pipeline:
     def __init__(self, web_input_file: str = None, video_directory: str = None, knowledge_directory: str = None, folder_id: str = None):
@@ -19,90 +43,553 @@ class Pipeline:
         self.video_directory = video_directory
         self.knowledge_directory = knowledge_directory
         self.folder_id = folder_id
-        self.splitter = CharacterTextSplitter(separator=" ", chunk_size=1024, chunk_overlap=0)
-        self.source_docs = []
         self.source_chunks: List = []
         self.yaml_loader: object = YamlParser()
         self.yaml_loader()
+        self.chunker = Chunker(chunk_tokens=self.yaml_loader.chunking.get("CHUNK_TOKENS", 256),
+                               overlap_tokens=self.yaml_loader.chunking.get("OVERLAP_TOKENS", 32),
+                               model=self.yaml_loader.chunking.get("ENCODING_MODEL", "text-embedding-ada-002"))
         self.vectordb: str = self.yaml_loader.vectordb
         self.embed_model: str = self.yaml_loader.embed_model
+        self.manifest: Manifest = Manifest(self.yaml_loader.manifest_path) if self.yaml_loader.manifest_path else None
+        self.embedding_cache: dict = self.yaml_loader.embedding_cache
+        self.embedding_engine: dict = self.yaml_loader.embedding_engine
+        self.local_embedding: dict = self.yaml_loader.local_embedding
+        self.concurrency: dict = self.yaml_loader.concurrency
+        self.gdrive: dict = self.yaml_loader.gdrive
+        self.whisper: dict = self.yaml_loader.whisper
+        self.web: dict = self.yaml_loader.web
+        self.streaming: dict = self.yaml_loader.streaming
+        self.faiss: dict = self.yaml_loader.faiss
+        self.milvus: dict = self.yaml_loader.milvus
+        self.dedup: dict = self.yaml_loader.dedup
+        self.parsing: dict = self.yaml_loader.parsing
+        self.pdf: dict = self.yaml_loader.pdf
+        self.bm25: dict = self.yaml_loader.bm25
+        self.retrieval: dict = self.yaml_loader.retrieval
+        self.metrics: dict = self.yaml_loader.metrics
+        self.work_queue: dict = self.yaml_loader.work_queue
+        self.chunk_store: dict = self.yaml_loader.chunk_store
+        self.deduplicator: Optional["Deduplicator"] = None
+        self._written_sources: Dict[str, int] = {}
+        self.chunk_count: int = 0
         self.embeddings = None
+        # The embedding model itself, without the cache and batching wrappers of `embeddings`
+        self.embedding_backend = None
         self.search_index = None
         self.vector_db = None
+        self.keyword_index: Optional[BM25Index] = None
+        self.chunk_dataset: Optional["ChunkStore"] = None
+        # Chunk ids of the sources re-processed by this run and the sources it removed
+        self._chunk_sources: Dict[str, Set[str]] = {}
+        self._removed_sources: List[str] = []
+        self._retained_chunks: Set[str] = set()
+        # Batches embedding in the background while the next ones are chunked, oldest first
+        self._embedding: Deque[Tuple[List[Document], Future]] = deque()
+        self._embedder: Optional[ThreadPoolExecutor] = None
 
     def __call__(self):
+        self.run(self._extract)
+
+    def run(self, extract: Callable[[], Iterable[Document]]) -> None:
+        """Ingests the documents `extract` streams, it is called once the manifest run has begun"""
         logging.info("Pipeline called")
+        if self.vectordb not in plugins.vector_stores:
+            raise ValueError(f"unknown VECTORDB {self.vectordb!r}, expected one of {plugins.vector_stores.names()}")
+        if self.manifest is not None:
+            self.manifest.bind(f"{self._vector_store()} {self.chunker!r}")
+            # What a rebuild checks the chunk store against, empty while the store is off
+            self.manifest.set("chunk_store", self._chunk_binding() if self.open_chunk_store() is not None else "")
+            self.manifest.begin(self._source_types())
+
+        metrics.profile(self.metrics.get("PROFILE_STAGE"), self.metrics.get("PROFILER", "cprofile"))
+        server = None
+        if self.metrics.get("PORT"):
+            server = metrics.MetricsServer(metrics.metrics, self.metrics.get("HOST", "127.0.0.1"),
+                                           self.metrics["PORT"]).start()
+        self._select_embeddings(self.embed_model)
+        try:
+            self.create_chunks(extract())
+        finally:
+            if self.keyword_index is not None:
+                self.keyword_index.close()
+            self._write_report()
+            if server is not None:
+                server.shutdown()
+        return
+
+    def _write_report(self) -> None:
+        if self.metrics.get("REPORT"):
+            metrics.write_report(self.metrics["REPORT"])
+        if self.metrics.get("PROFILE_STAGE"):
+            metrics.save_profile(self.metrics.get("PROFILE_PATH", "profile.out"))
+
+    def _extract(self) -> Iterator[Document]:
+        """Streams documents from every configured source. Each loader runs on a thread of its own
+           (file parsing and Whisper run on process pools) and feeds a
+           queue bounded by STREAMING.IN_FLIGHT, so loaders block while chunking and embedding
+           catch up. Manifest checks stay in this process, the workers only get the inputs to parse"""
+        queue: Queue = Queue(maxsize=self.streaming.get("IN_FLIGHT", 256))
+        running: Set[str] = set()
+        # Drive files and the knowledge directory share one pool of parser processes
+        parser = self.parser_pool()
+        pdf = self.pdf_extractor(parser)
+
+        def produce(source: str, load: Callable[[], Iterable[Document]]) -> None:
+            count = 0
+            try:
+                for doc in metrics.iterate(f"extract.{source}", load(), lambda doc: len(doc.page_content)):
+                    queue.put(doc)
+                    count += 1
+                logging.info(f"{source} loaded {count} documents")
+                queue.put(_SourceDone(source))
+            except BaseException as e:
+                queue.put(_SourceDone(source, e))
+
+        def start(source: str, load: Callable[[], Iterable[Document]]) -> None:
+            running.add(source)
+            threading.Thread(target=produce, args=(source, load), name=f"{source}-loader", daemon=True).start()
 
         # Calling the gdrive pipeline
         if self.folder_id is not None:
-            gdrive = GDriveLoader(folder_id=self.folder_id, shared_dir=self.video_directory)
-            gdrive_docs = gdrive.load()
+            start("gdrive", self.gdrive_loader(parser, pdf, self.manifest).lazy_load)
 
         # Calling the website pipeline
         if self.web_input_file is not None:
-            website_docs = website_extractor.WebsiteExtractor.website_loader(self.web_input_file)
+            crawler = self.web_crawler()
+            start("website", lambda: plugins.extractors.load("website").lazy_website_loader(
+                self.web_input_file, self.manifest, crawler))
 
         # Calling the knowledge_directory pipeline
         if self.knowledge_directory is not None:
-            knowledge_directory_docs = knowlede_directory_extractor.KnowledgeDirectoryExtractor.\
-                directory_loader(self.knowledge_directory)
-        
+            directory = plugins.extractors.load("knowledge_directory")
+            start("knowledge_directory", lambda: directory.lazy_directory_loader(
+                directory.list_files(self.knowledge_directory, self.manifest), parser=parser, pdf=pdf,
+                manifest=self.manifest))
+
         # Calling the video_extractor pipeline. It depends on the gdrive pipeline
-        if self.video_directory is not None:
-            video_knowledge = video_extractor.VideoExtractor(self.video_directory)
-            video_docs = video_knowledge()
+        video_waiting = self.video_directory is not None
+        transcription = None
+        try:
+            while running or video_waiting:
+                if video_waiting and "gdrive" not in running:
+                    VideoExtractor = plugins.extractors.load("video")
+                    transcription = self.transcription_service()
+                    start("video", VideoExtractor(self.video_directory, self.manifest,
+                                                  transcription, self.concurrency.get("VIDEO", 1)))
+                    video_waiting = False
+                    continue
+                item = queue.get()
+                if isinstance(item, _SourceDone):
+                    running.discard(item.source)
+                    if item.error is not None:
+                        raise item.error
+                    continue
+                yield item
+        finally:
+            parser.close()
+            if pdf.cache is not None:
+                pdf.cache.close()
+            if transcription is not None:
+                transcription.close()
 
-        self.source_docs = gdrive_docs + website_docs + video_docs + knowledge_directory_docs
-        self.create_chunks(self.source_docs)
-        return
+    def parser_pool(self) -> ParserPool:
+        return ParserPool(self.parsing.get("WORKERS"), self.parsing.get("TIMEOUT", 300.0))
+
+    def pdf_extractor(self, parser: ParserPool) -> PdfExtractor:
+        return PdfExtractor(parser, self.pdf.get("CACHE_PATH"), self.pdf.get("PAGES_PER_TASK", 16))
+
+    def gdrive_loader(self, parser: ParserPool, pdf: PdfExtractor, manifest: Optional[Manifest] = None,
+                      folder_id: Optional[str] = None, shared_dir: Optional[str] = None) -> "GDriveLoader":
+        GDriveLoader = plugins.extractors.load("gdrive")
+        return GDriveLoader(folder_id=folder_id or self.folder_id, shared_dir=shared_dir or self.video_directory,
+                            manifest=manifest, workers=self.concurrency.get("GDRIVE", 1),
+                            download_dir=self.gdrive.get("DOWNLOAD_DIR"),
+                            chunk_size=self.gdrive.get("CHUNK_SIZE", 32 * 1024 * 1024), parser=parser, pdf=pdf)
+
+    def web_crawler(self) -> "WebCrawler":
+        from aganitha_chatbot_pipeline.web_crawler import WebCrawler
+        return WebCrawler(concurrency=self.concurrency.get("WEBSITE", 1), per_host=self.web.get("PER_HOST", 2),
+                          delay=self.web.get("DELAY", 0.0), max_depth=self.web.get("MAX_DEPTH", 0),
+                          cache_path=self.web.get("CACHE_PATH"))
+
+    def transcription_service(self) -> "TranscriptionService":
+        from aganitha_chatbot_pipeline.transcription import TranscriptionService
+        return TranscriptionService(model_size=self.whisper.get("MODEL", "small"),
+                                    workers=self.whisper.get("WORKERS", 1),
+                                    segment_seconds=self.whisper.get("SEGMENT_SECONDS", 600),
+                                    cache_dir=self.whisper.get("CACHE_DIR"))
+
+    def _source_types(self) -> List[str]:
+        """Source types enumerated by this run, sources of other types are never treated as removed"""
+        inputs = {"gdrive": self.folder_id, "website": self.web_input_file,
+                  "knowledge_directory": self.knowledge_directory, "video": self.video_directory}
+        return [source_type for source_type, value in inputs.items() if value is not None]
+
+    def _vector_store(self) -> str:
+        # The keyword index is part of the store, turning it on ingests every source into it
+        keyword = f" BM25:{os.path.abspath(self.bm25['PATH'])}" if self.bm25.get("PATH") else ""
+        # So is the chunk store, it holds the chunks of every source the manifest lists. A store
+        # turned on or created again in its place is filled by ingesting every source
+        if self.open_chunk_store() is not None:
+            keyword += f" CHUNKS:{os.path.abspath(self.chunk_dataset.path)}#{self.chunk_dataset.id}"
+        return f"{self._vector_index()}{keyword}"
+
+    def _chunk_binding(self) -> str:
+        return f"{self.chunk_dataset.id} {self.chunker!r}"
 
-    def create_chunks(self, docs) -> None:
+    def _vector_index(self) -> str:
+        if self.vectordb == "FAISS":
+            return f"FAISS:{os.path.abspath(self.faiss.get('DIRECTORY', 'faiss_index'))}"
+        from aganitha_chatbot_pipeline.milvus_store import setting
+        return f"{self.vectordb}:{setting(self.milvus, 'URI')}/{self.milvus.get('COLLECTION', 'aganitha_chatbot')}"
+
+    def create_chunks(self, docs: Iterable[Document]) -> None:
+        """Chunks documents as they arrive and embeds and upserts every STREAMING.BATCH_SIZE chunks.
+           Up to STREAMING.EMBED_AHEAD batches are embedded in the background while chunking goes
+           on, they are written to the stores in order from this thread. With a manifest, chunks
+           the vector store already holds are skipped and the chunks of changed or removed sources
+           that were not produced again are deleted at the end.
+           With DEDUP enabled, chunks duplicating one seen earlier are dropped before embedding
+           and their source shares the surviving chunk instead"""
         logging.info("chunks are being created")
+        batch_size = self.streaming.get("BATCH_SIZE", 512)
+        if self.dedup.get("ENABLED"):
+            from aganitha_chatbot_pipeline.dedup import Deduplicator
+            self.deduplicator = Deduplicator(threshold=self.dedup.get("THRESHOLD", 0.9),
+                                             num_perm=self.dedup.get("NUM_PERM", 128),
+                                             shingle_size=self.dedup.get("SHINGLE_SIZE", 5),
+                                             directory=self.dedup.get("DIRECTORY") or None)
+        current: Dict[str, Set[str]] = {}
+        stored: Dict[str, Set[str]] = {}
+        try:
+            self._chunk(docs, current, stored, batch_size)
+            self._submit(0)
+        finally:
+            if self._embedder is not None:
+                self._embedder.shutdown(wait=False, cancel_futures=True)
+                self._embedder = None
+            self._embedding.clear()
+            if self.deduplicator is not None:
+                # Only the sources of shared chunks are needed from here on
+                self.deduplicator.close()
+
+        if self.deduplicator is not None:
+            self._record_provenance()
+        if self.manifest is not None:
+            stale_ids = self._stale_chunks(current, stored)
+            if stale_ids:
+                with metrics.stage("delete", len(stale_ids)):
+                    self._delete_chunks(self.vectordb, sorted(stale_ids))
+        with metrics.stage("save"):
+            self._save_index(self.vectordb)
+        if self.chunk_dataset is not None:
+            with metrics.stage("chunk_store"):
+                self.chunk_dataset.commit(self._chunk_sources if self.manifest is not None else None,
+                                          self._removed_sources, self._retained_chunks)
+        if isinstance(self.embeddings, CachedEmbeddings):
+            logging.info(f"embedding cache {self.embeddings.cache.stats()}")
+        if self.manifest is not None:
+            self.manifest.commit()
+
+    def _chunk(self, docs: Iterable[Document], current: Dict[str, Set[str]], stored: Dict[str, Set[str]],
+               batch_size: int) -> None:
         for doc in docs:
-            for chunk in self.splitter.split_text(doc.page_content):
-                self.source_chunks.append(Document(page_content=chunk, metadata=doc.metadata))
+            key = source_key(doc.metadata)
+            if self.manifest is not None and key not in stored:
+                stored[key] = self.manifest.chunk_ids(key)
+                current[key] = set()
+            with metrics.stage("chunk", bytes=len(doc.page_content)) as measure:
+                spans = self.chunker.split(doc.page_content)
+                measure.add(len(spans))
+            for start, end in spans:
+                chunk = doc.page_content[start:end]
+                chunk_id = content_hash(f"{key}\0{chunk}")
+                if self.manifest is not None and chunk_id in current[key]:
+                    continue
+                if self.deduplicator is not None:
+                    with metrics.stage("dedup", 1, len(chunk)):
+                        survivor = self.deduplicator.find(chunk_id, chunk, key)
+                    if survivor is not None:
+                        if self.manifest is not None:
+                            current[key].add(survivor)
+                        continue
+                if self.manifest is not None:
+                    current[key].add(chunk_id)
+                    if chunk_id in stored[key]:
+                        continue
+                self.source_chunks.append(Document(page_content=chunk, metadata=dict(
+                    doc.metadata, chunk_id=chunk_id, start_index=start, end_index=end)))
+                if len(self.source_chunks) >= batch_size:
+                    self._submit(self.streaming.get("EMBED_AHEAD", 2))
 
-        print(self.embed_model)
-        self._select_embeddings(self.embed_model)
-        print(self.vectordb)
-        self._select_index(self.vectordb)
+    def _submit(self, ahead: int) -> None:
+        """Starts embedding the pending batch and writes the oldest batches until at most `ahead`
+           are still embedding. With no batches ahead, everything is written"""
+        if ahead > 0 and self.source_chunks and self.embeddings is not None:
+            if self._embedder is None:
+                self._embedder = ThreadPoolExecutor(max_workers=ahead, thread_name_prefix="embed-ahead")
+            docs, self.source_chunks = self.source_chunks, []
+            self._embedding.append((docs, self._embedder.submit(
+                self.embeddings.embed_documents, [doc.page_content for doc in docs])))
+        while len(self._embedding) > ahead:
+            docs, future = self._embedding.popleft()
+            pending, self.source_chunks = self.source_chunks, docs
+            self._flush(future.result())
+            self.source_chunks = pending
+        if ahead == 0:
+            self._flush()
+
+    def _flush(self, vectors: Optional[Any] = None, archive: bool = True) -> None:
+        """Embeds and upserts the pending batch of chunks, with `vectors` if they are known, and
+           writes it to the chunk store unless `archive` is off"""
+        if not self.source_chunks:
+            return
+        if self.deduplicator is not None:
+            for doc in self.source_chunks:
+                sources = self.deduplicator.sources.get(doc.metadata["chunk_id"], [])
+                if len(sources) > 1:
+                    doc.metadata["sources"] = list(sources)
+                    self._written_sources[doc.metadata["chunk_id"]] = len(sources)
+        size = sum(len(doc.page_content) for doc in self.source_chunks)
+        archive = archive and self.open_chunk_store() is not None
+        # Includes embedding the chunks, which is also the embed stage
+        with metrics.stage("index", len(self.source_chunks), size):
+            if vectors is None and archive and self.chunk_store.get("VECTORS", True):
+                vectors = self.embeddings.embed_documents([doc.page_content for doc in self.source_chunks])
+            self._select_index(self.vectordb, vectors)
+        if archive:
+            with metrics.stage("chunk_store", len(self.source_chunks), size):
+                self.chunk_dataset.add(self.source_chunks, vectors)
+        if self.open_keyword_index() is not None:
+            with metrics.stage("keyword_index", len(self.source_chunks), size):
+                self.keyword_index.add([doc.metadata["chunk_id"] for doc in self.source_chunks],
+                                       [doc.page_content for doc in self.source_chunks],
+                                       [doc.metadata for doc in self.source_chunks])
+        self.chunk_count += len(self.source_chunks)
+        logging.info(f"{self.chunk_count} chunks indexed")
+        self.source_chunks = []
 
-    def _select_index(self, vectordb: str) -> Any:
+    def _record_provenance(self) -> None:
+        """Lists every source in the metadata of surviving chunks whose duplicates turned up
+           after they were written"""
+        updates = {chunk_id: {"sources": list(sources)} for chunk_id, sources in self.deduplicator.sources.items()
+                   if len(sources) > 1 and self._written_sources.get(chunk_id) != len(sources)}
+        if updates:
+            if self.vectordb == "FAISS":
+                self.faiss_index([])
+                self.search_index.update_metadata(updates)
+            if self.vectordb == "MILVUS":
+                self.milvus_index([])
+                self.vector_db.update_metadata(updates)
+            if self.open_keyword_index() is not None:
+                self.keyword_index.update_metadata(updates)
+            if self.open_chunk_store() is not None:
+                self.chunk_dataset.update_metadata(updates)
+        logging.info(f"{self.deduplicator.dropped} duplicate chunks dropped, "
+                     f"{len(self.deduplicator.sources)} chunks shared between sources")
+
+    def _stale_chunks(self, current: Dict[str, Set[str]], stored: Dict[str, Set[str]]) -> Set[str]:
+        """Records the chunk ids of every re-processed source and collects the ids of chunks
+           that belong to changed or removed sources but were not produced again"""
+        stale_ids: Set[str] = set()
+        # A changed source that yields no chunks any more still has its old chunks removed
+        for source_id in set(current) | set(self.manifest.changed_sources()):
+            chunk_ids = current.get(source_id, set())
+            previous = stored[source_id] if source_id in stored else self.manifest.chunk_ids(source_id)
+            stale_ids |= previous - chunk_ids
+            self.manifest.set_chunk_ids(source_id, chunk_ids)
+            self._chunk_sources[source_id] = chunk_ids
+
+        removed = self.manifest.removed_sources()
+        for source_id in removed:
+            stale_ids |= self.manifest.chunk_ids(source_id)
+        self.manifest.forget(removed)
+        self._removed_sources = removed
+        if self.deduplicator is not None:
+            self._retained_chunks = self.manifest.referenced(stale_ids)
+            stale_ids -= self._retained_chunks
+        logging.info(f"{len(stale_ids)} stale chunks, {len(removed)} removed sources")
+        return stale_ids
+
+    def _select_index(self, vectordb: str, vectors: Optional[Any] = None) -> Any:
         if vectordb == "FAISS":
-            return self.faiss_index(self.source_chunks)
+            return self.faiss_index(self.source_chunks, vectors=vectors)
 
         if vectordb == "MILVUS":
-            print("MILVUS called")
-            return self.milvus_index(self.source_chunks)
+            return self.milvus_index(self.source_chunks, vectors=vectors)
+
+    def _delete_chunks(self, vectordb: str, chunk_ids: List[str]) -> None:
+        if vectordb == "FAISS":
+            self.faiss_index([])
+            self.search_index.delete(chunk_ids)
+            logging.info(f"{len(chunk_ids)} stale chunks deleted from FAISS")
 
-    def _select_embeddings(self, embed_model: str) -> Any:
+        if vectordb == "MILVUS":
+            self.milvus_index([])
+            self.vector_db.delete(chunk_ids)
+            logging.info(f"{len(chunk_ids)} stale chunks deleted from MILVUS")
+
+        if self.open_keyword_index() is not None:
+            self.keyword_index.delete(chunk_ids)
+
+    def _select_embeddings(self, embed_model: str, wrappers: bool = True) -> Any:
+        """Sets `embeddings`, wrapped in the configured cache and batching engine unless
+           `wrappers` is False, which serving queries uses"""
+        backend = plugins.embeddings.load(embed_model)
         if embed_model == "OPENAI":
-            from langchain.embeddings.openai import OpenAIEmbeddings
-            self.embeddings: OpenAIEmbeddings = OpenAIEmbeddings()
+            if self.embedding_engine.get("API_BASE"):
+                # e.g. the stub embedding server, which speaks the same API
+                import openai
+                openai.api_base = self.embedding_engine["API_BASE"]
+                os.environ.setdefault("OPENAI_API_KEY", "stub")
+            # The engine retries failed batches itself, retries of the client would multiply them
+            self.embeddings = backend(max_retries=0) if self.embedding_engine and wrappers else backend()
+
+        if embed_model == "LOCAL":
+            self.embeddings = backend(
+                model=self.local_embedding.get("MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+                workers=self.local_embedding.get("WORKERS", 1),
+                max_batch_tokens=self.local_embedding.get("MAX_BATCH_TOKENS", 8192),
+                max_length=self.local_embedding.get("MAX_LENGTH", 256),
+                quantize=self.local_embedding.get("QUANTIZE", False),
+                normalize=self.local_embedding.get("NORMALIZE", True),
+            )
 
         # if embed_model == "BioMedGPT":
         #     self.embeddings: BioMed = BioMedEmbedding
 
-    def faiss_index(self, docs) -> None:
-        quit()
-        from langchain.vectorstores import FAISS
-        search_index = FAISS.from_documents(docs, self.embeddings)
-        with open("search_index.pickle", "wb") as f:
-            pickle.dump(search_index, f)
-        logging.info("FAISS search_index created")
-        return
+        self.embedding_backend = self.embeddings
+        if self.embeddings is None or not wrappers:
+            return
+        cache = None
+        if self.embedding_cache.get("PATH"):
+            cache = EmbeddingCache(self.embedding_cache["PATH"], self.embedding_cache.get("MAX_ENTRIES", 1_000_000))
+        # Batching and rate limits are for remote APIs, the local model batches on its own
+        if self.embedding_engine and embed_model != "LOCAL":
+            # Without a cache of its own the engine checkpoints finished batches to a separate store
+            checkpoint = cache
+            if checkpoint is None and self.embedding_engine.get("CHECKPOINT"):
+                checkpoint = EmbeddingCache(self.embedding_engine["CHECKPOINT"])
+            self.embeddings = BatchedEmbeddings(
+                self.embeddings,
+                max_batch_tokens=self.embedding_engine.get("MAX_BATCH_TOKENS", 100_000),
+                max_batch_size=self.embedding_engine.get("MAX_BATCH_SIZE", 1000),
+                concurrency=self.embedding_engine.get("CONCURRENCY", 4),
+                requests_per_minute=self.embedding_engine.get("REQUESTS_PER_MINUTE", 3000),
+                tokens_per_minute=self.embedding_engine.get("TOKENS_PER_MINUTE", 1_000_000),
+                max_retries=self.embedding_engine.get("MAX_RETRIES", 6),
+                checkpoint=checkpoint,
+            )
+        if cache is not None:
+            self.embeddings = CachedEmbeddings(self.embeddings, cache)
 
-    def milvus_index(self, docs) -> None:
-        from langchain.vectorstores import Milvus
-        vector_db = Milvus.from_documents(docs,
-                                          self.embeddings,
-                                          connection_args={"alias": "default", 
-                                          "uri": "https://in01-84cae738bde3a79.aws-us-west-2.vectordb.zillizcloud.com:19541",
-                                          "secure": True, "user": "db_admin", "password": "guNagaNa1"},
-                                          )
-        logging.info("MILVUS index created")
-    
+    def _save_index(self, vectordb: str) -> None:
+        if vectordb == "FAISS" and self.search_index is not None:
+            self.search_index.save()
+            logging.info("FAISS search_index created")
+        if vectordb == "MILVUS" and self.vector_db is not None:
+            self.vector_db.save()
 
+    def open_index(self, read_only: bool = False) -> Any:
+        """The configured vector store with its query embeddings, for serving searches. Read-only
+           it embeds with the bare backend, queries do not go through the ingest embedding cache"""
+        if self.embeddings is None:
+            self._select_embeddings(self.embed_model, wrappers=not read_only)
+        if self.vectordb == "FAISS":
+            self.faiss_index([], read_only=read_only)
+            return self.search_index
+        if self.vectordb == "MILVUS":
+            self.milvus_index([])
+            return self.vector_db
 
+    def open_keyword_index(self, read_only: bool = False) -> Optional[BM25Index]:
+        """The BM25 index, read-only for serving searches. None without BM25.PATH or, read-only,
+           when the pipeline has not built it yet"""
+        if self.keyword_index is None and self.bm25.get("PATH"):
+            if read_only and not os.path.exists(self.bm25["PATH"]):
+                logging.warning(f"BM25 index {self.bm25['PATH']} does not exist, searches are vector only")
+                return None
+            self.keyword_index = BM25Index(self.bm25["PATH"], k1=self.bm25.get("K1", 1.2), b=self.bm25.get("B", 0.75),
+                                           read_only=read_only)
+        return self.keyword_index
 
+    def open_chunk_store(self) -> Optional["ChunkStore"]:
+        if self.chunk_dataset is None and self.chunk_store.get("PATH"):
+            from aganitha_chatbot_pipeline.chunk_store import ChunkStore
+            self.chunk_dataset = ChunkStore(self.chunk_store["PATH"], self.chunk_store.get("FORMAT", "arrow"))
+        return self.chunk_dataset
+
+    def rebuild_index(self) -> int:
+        """Loads every chunk of the chunk store into the configured vector store and keyword
+           index, nothing is extracted again and only chunks stored without a vector are
+           embedded. Pointed at a new FAISS.DIRECTORY or MILVUS.COLLECTION it builds an index
+           of another type next to the current one. Refused unless the store was kept with the
+           manifest's index and chunking since it was created. The number of chunks loaded"""
+        if self.open_chunk_store() is None:
+            raise ValueError("CHUNK_STORE.PATH is not set, there is nothing to rebuild from")
+        previous = self.manifest.get("vector_store") if self.manifest is not None else None
+        if previous is not None and self.manifest.get("chunk_store") != self._chunk_binding():
+            # Sources ingested without this store, or with other chunking, are missing from it
+            raise ValueError("the chunk store does not hold every chunk the manifest lists, run the pipeline "
+                             "with this CHUNK_STORE and chunking once before rebuilding from it")
+        self._select_embeddings(self.embed_model)
+        for docs, vectors in self.chunk_dataset.iter_chunks(self.streaming.get("BATCH_SIZE", 512)):
+            missing = [position for position, vector in enumerate(vectors or [None] * len(docs)) if vector is None]
+            if missing:
+                embedded = self.embeddings.embed_documents([docs[position].page_content for position in missing])
+                vectors = list(vectors or [None] * len(docs))
+                for position, vector in zip(missing, embedded):
+                    vectors[position] = vector
+            self.source_chunks = docs
+            self._flush(vectors, archive=False)
+        with metrics.stage("save"):
+            self._save_index(self.vectordb)
+        if self.keyword_index is not None:
+            self.keyword_index.close()
+        # The new index holds what the old one did, the manifest moves over to it instead of
+        # forgetting every source on the next run
+        if previous is not None:
+            self.manifest.set("vector_store", f"{self._vector_store()} {self.chunker!r}")
+        logging.info(f"{self.chunk_count} chunks loaded into {self._vector_index()}")
+        return self.chunk_count
+
+    def faiss_index(self, docs, read_only: bool = False, vectors: Optional[Any] = None) -> None:
+        if self.search_index is None:
+            FaissStore = plugins.vector_stores.load("FAISS")
+            # Chunks are keyed by their ids, so every run updates the index in place
+            self.search_index = FaissStore(self.faiss.get("DIRECTORY", "faiss_index"), self.embeddings,
+                                           index_type=self.faiss.get("INDEX_TYPE", "FLAT"),
+                                           metric=self.faiss.get("METRIC", "L2"),
+                                           nlist=self.faiss.get("NLIST", 1024),
+                                           pq_m=self.faiss.get("PQ_M", 16),
+                                           hnsw_m=self.faiss.get("HNSW_M", 32),
+                                           nprobe=self.faiss.get("NPROBE", 16),
+                                           train_size=self.faiss.get("TRAIN_SIZE", 65536),
+                                           compact_ratio=self.faiss.get("COMPACT_RATIO", 0.2),
+                                           read_only=read_only)
+        if docs:
+            self.search_index.add_documents(docs, vectors=vectors)
+        return
 
+    def milvus_index(self, docs, vectors: Optional[Any] = None) -> None:
+        if self.vector_db is None:
+            from aganitha_chatbot_pipeline.milvus_store import connection_args
+            MilvusStore = plugins.vector_stores.load("MILVUS")
+            self.vector_db = MilvusStore(self.embeddings, connection_args(self.milvus),
+                                         self.milvus.get("COLLECTION", "aganitha_chatbot"),
+                                         index_type=self.milvus.get("INDEX_TYPE", "HNSW"),
+                                         metric_type=self.milvus.get("METRIC_TYPE", "L2"),
+                                         nlist=self.milvus.get("NLIST", 1024),
+                                         m=self.milvus.get("M", 16),
+                                         ef_construction=self.milvus.get("EF_CONSTRUCTION", 200),
+                                         nprobe=self.milvus.get("NPROBE", 16),
+                                         ef=self.milvus.get("EF", 64),
+                                         batch_rows=self.milvus.get("BATCH_ROWS", 1000),
+                                         batch_bytes=self.milvus.get("BATCH_BYTES", 32 * 1024 * 1024),
+                                         workers=self.milvus.get("WORKERS", 4),
+                                         flush=self.milvus.get("FLUSH", True),
+                                         compact=self.milvus.get("COMPACT", False))
+        if docs:
+            self.vector_db.add_documents(docs, vectors=vectors)
+            logging.info("MILVUS index created")
@@ -0,0 +1,56 @@
+"""Extractors, embedding backends and vector stores, registered by name with the path of the
+class that implements them and imported the first time a run asks for one. A run over the
+knowledge directory never imports the Drive client, the crawler or ffmpeg, a FAISS run never
+imports pymilvus."""
+import importlib
+import threading
+from typing import Any, Dict, List
+
+
+class Registry:
+    """Names mapped to "module:attribute" paths, imported on first use"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._targets: Dict[str, str] = {}
+        self._loaded: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, target: str) -> None:
+        with self._lock:
+            self._targets[name] = target
+            self._loaded.pop(name, None)
+
+    def names(self) -> List[str]:
+        return sorted(self._targets)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._targets
+
+    def load(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._loaded:
+                if name not in self._targets:
+                    raise ValueError(f"unknown {self.kind} {name!r}, expected one of {self.names()}")
+                module, _, attribute = self._targets[name].partition(":")
+                self._loaded[name] = getattr(importlib.import_module(module), attribute)
+            return self._loaded[name]
+
+
+# Keyed like the CLI arguments and manifest source types
+extractors = Registry("extractor")
+extractors.register("gdrive", "aganitha_chatbot_pipeline.gdrive_extractor:GDriveLoader")
+extractors.register("website", "aganitha_chatbot_pipeline.website_extractor:WebsiteExtractor")
+extractors.register("knowledge_directory",
+                    "aganitha_chatbot_pipeline.knowlede_directory_extractor:KnowledgeDirectoryExtractor")
+extractors.register("video", "aganitha_chatbot_pipeline.video_extractor:VideoExtractor")
+
+# Keyed like EMBEDDING in config.yml
+embeddings = Registry("embedding backend")
+embeddings.register("OPENAI", "langchain.embeddings.openai:OpenAIEmbeddings")
+embeddings.register("LOCAL", "aganitha_chatbot_pipeline.local_embeddings:LocalEmbeddings")
+
+# Keyed like VECTORDB in config.yml
+vector_stores = Registry("vector store")
+vector_stores.register("FAISS", "aganitha_chatbot_pipeline.faiss_store:FaissStore")
+vector_stores.register("MILVUS", "aganitha_chatbot_pipeline.milvus_store:MilvusStore")
@@ -0,0 +1,20 @@
+import typer
+
+app = typer.Typer()
+
+
+@app.command()
+def rebuild_index():
+    """ The vector store and keyword index configured in config.yml are built from the chunk store"""
+    from aganitha_chatbot_pipeline.pipeline import Pipeline
+    pipeline = Pipeline()
+    count = pipeline.rebuild_index()
+    typer.echo(f"{count} chunks indexed from {pipeline.chunk_store['PATH']}")
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    app()
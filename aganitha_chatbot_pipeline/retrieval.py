@@ -0,0 +1,174 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from aganitha_chatbot_pipeline import metrics
+from aganitha_chatbot_pipeline.bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+MODES = ("hybrid", "vector", "keyword")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return _SPACES.sub(" ", query).strip()
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[Document, float]]], k: int,
+                           rrf_k: int = 60) -> List[Tuple[Document, float]]:
+    """Merges ranked lists by summing 1 / (rrf_k + rank) for every list a chunk appears in.
+       Chunks are matched on their chunk id, or their text when they have none"""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = doc.metadata.get("chunk_id") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [(docs[key], score) for key, score in best]
+
+
+class QueryCache:
+    """LRU map of normalized query text to its embedding"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(query)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(query)
+            self.hits += 1
+            return vector
+
+    def put(self, query: str, vector: List[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[query] = vector
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class QueryBatcher:
+    """Collects queries submitted from concurrent requests and embeds them together: a batch
+       goes out once `max_batch` queries are waiting or `max_wait` seconds after its first one
+       arrived, at most `concurrency` batches at a time. Identical queries in a batch are
+       embedded once"""
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], max_batch: int = 64,
+                 max_wait: float = 0.005, concurrency: int = 4):
+        self.embed = embed
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.batches = 0
+        self._queue: Queue = Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="query-embedding")
+        threading.Thread(target=self._collect, name="query-batcher", daemon=True).start()
+
+    def submit(self, query: str) -> Future:
+        future: Future = Future()
+        self._queue.put((query, future))
+        return future
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except Empty:
+                    break
+            self.batches += 1
+            self._pool.submit(self._embed, batch)
+
+    def _embed(self, batch: List[Tuple[str, Future]]) -> None:
+        queries = list(dict.fromkeys(query for query, _ in batch))
+        try:
+            vectors = dict(zip(queries, self.embed(queries)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for query, future in batch:
+            future.set_result(vectors[query])
+
+
+class Retriever:
+    """Answers queries from the vector store the pipeline builds and, when one was built, its
+       BM25 index. Query embeddings are kept in an LRU cache, misses from concurrent requests
+       are embedded in batches. `embeddings` should be the bare backend, the LRU is the only
+       query cache and queries stay out of the ingest embedding cache. Hybrid search runs the keyword search while the query is being
+       embedded, takes `candidates` results from each side and fuses them by reciprocal rank.
+       Metadata filters are applied inside each search rather than to its results"""
+
+    def __init__(self, store: Any, embeddings: Embeddings, keyword_index: Optional[BM25Index] = None,
+                 cache_size: int = 10000, max_batch: int = 64, batch_wait: float = 0.005,
+                 embedding_concurrency: int = 4, candidates: int = 50, rrf_k: int = 60):
+        self.store = store
+        self.embeddings = embeddings
+        self.keyword_index = keyword_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.cache = QueryCache(cache_size)
+        self.batcher = QueryBatcher(embeddings.embed_documents, max_batch, batch_wait, embedding_concurrency)
+        self._keyword_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="keyword-search")
+
+    def embed_query(self, query: str) -> List[float]:
+        query = normalize_query(query)
+        vector = self.cache.get(query)
+        if vector is None:
+            with metrics.stage("query_embedding", 1, len(query)):
+                vector = self.batcher.submit(query).result()
+            self.cache.put(query, vector)
+        return vector
+
+    def search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None,
+               mode: str = "hybrid") -> List[Tuple[Document, float]]:
+        """The k best chunks with their scores: distances for "vector", BM25 scores for
+           "keyword" and fused reciprocal-rank scores for "hybrid", where higher is better"""
+        if mode not in MODES:
+            raise ValueError(f"search mode must be one of {MODES}, not {mode!r}")
+        if self.keyword_index is None and mode != "vector":
+            if mode == "keyword":
+                raise ValueError("keyword search needs the BM25 index, set BM25.PATH and run the pipeline")
+            mode = "vector"
+        with metrics.stage(f"search.{mode}", 1):
+            if mode == "keyword":
+                return self.keyword_index.search(query, k, filters)
+            if mode == "vector":
+                return self._vector_search(query, k, filters)
+
+            keyword = self._keyword_pool.submit(self.keyword_index.search, query, self.candidates, filters)
+            vector = self._vector_search(query, self.candidates, filters)
+            return reciprocal_rank_fusion([vector, keyword.result()], k, self.rrf_k)
+
+    def _vector_search(self, query: str, k: int, filters: Optional[Dict[str, Any]]) -> List[Tuple[Document, float]]:
+        embedding = self.embed_query(query)
+        if filters:
+            return self.store.similarity_search_by_vector_with_score(embedding, k, filters=filters)
+        return self.store.similarity_search_by_vector_with_score(embedding, k)
@@ -0,0 +1,120 @@
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import typer
+
+from aganitha_chatbot_pipeline import metrics
+from aganitha_chatbot_pipeline.pipeline import Pipeline
+from aganitha_chatbot_pipeline.retrieval import MODES, Retriever
+
+logger = logging.getLogger(__name__)
+app = typer.Typer()
+
+
+class RetrievalServer(ThreadingHTTPServer):
+    """Serves searches over the indexes the pipeline built.
+
+       POST /search {"query": "...", "k": 4, "filters": {"source": [...]}, "mode": "hybrid"}
+       answers {"results": [{"text", "metadata", "score"}], "took_ms"}, GET /health reports
+       the query cache and GET /metrics serves the Prometheus metrics. Every request runs on a
+       thread of its own"""
+
+    daemon_threads = True
+    # Bursts of concurrent clients queue up instead of having their connections reset
+    request_queue_size = 128
+
+    def __init__(self, retriever: Retriever, host: str = "127.0.0.1", port: int = 8100, mode: str = "hybrid"):
+        super().__init__((host, port), _Handler)
+        self.retriever = retriever
+        self.mode = mode
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: RetrievalServer
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/metrics":
+            raw = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+            return
+        if self.path.rstrip("/") != "/health":
+            return self._reply(404, {"error": "not found"})
+        self._reply(200, {"status": "ok", "query_cache": self.server.retriever.cache.stats(),
+                          "keyword_index": self.server.retriever.keyword_index is not None})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/search":
+            return self._reply(404, {"error": "not found"})
+        start = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            query = body["query"]
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("query must be a non-empty string")
+            results = self.server.retriever.search(query, int(body.get("k", 4)), body.get("filters"),
+                                                   body.get("mode", self.server.mode))
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("search failed")
+            return self._reply(500, {"error": str(e)})
+        self._reply(200, {
+            "results": [{"text": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+                        for doc, score in results],
+            "took_ms": (time.perf_counter() - start) * 1000,
+        })
+
+    def _reply(self, status: int, payload: dict) -> None:
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+def create_server(host: Optional[str] = None, port: Optional[int] = None) -> RetrievalServer:
+    """A server over the stores configured in config.yml, opened read-only"""
+    pipeline = Pipeline()
+    settings = pipeline.retrieval
+    mode = settings.get("MODE", "hybrid")
+    if mode not in MODES:
+        raise ValueError(f"RETRIEVAL.MODE must be one of {MODES}, not {mode!r}")
+    store = pipeline.open_index(read_only=True)
+    if store is None:
+        raise ValueError(f"no vector store for VECTORDB {pipeline.vectordb!r}")
+    retriever = Retriever(store, pipeline.embedding_backend, pipeline.open_keyword_index(read_only=True),
+                          cache_size=settings.get("QUERY_CACHE_SIZE", 10000),
+                          max_batch=settings.get("MAX_BATCH", 64),
+                          batch_wait=settings.get("BATCH_WAIT_MS", 5) / 1000,
+                          candidates=settings.get("CANDIDATES", 50),
+                          rrf_k=settings.get("RRF_K", 60))
+    return RetrievalServer(retriever, host or settings.get("HOST", "127.0.0.1"),
+                           port if port is not None else settings.get("PORT", 8100), mode)
+
+
+@app.command()
+def serve(host: str = typer.Option(None, help="Defaults to RETRIEVAL.HOST"),
+          port: int = typer.Option(None, help="Defaults to RETRIEVAL.PORT")):
+    """Serves searches over the vector store and BM25 index configured in config.yml"""
+    server = create_server(host, port)
+    typer.echo(f"retrieval on http://{server.server_address[0]}:{server.server_address[1]}/search")
+    server.serve_forever()
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
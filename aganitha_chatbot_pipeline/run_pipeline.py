@@ -1,4 +1,3 @@
-from aganitha_chatbot_pipeline.pipeline import Pipeline
 import typer
 
 app = typer.Typer()
@@ -7,6 +6,8 @@ app = typer.Typer()
 def run_pipeline(web_input_file: str = typer.Argument(None), video_directory: str = typer.Argument(None),
                  knowledge_directory: str = typer.Argument(None), folder_id: str = typer.Argument(None)):
     """ Pipeline is called which pulls the data from all the resources we specify"""
+    # Imported here so that --help does not load LangChain
+    from aganitha_chatbot_pipeline.pipeline import Pipeline
     pipeline = Pipeline(web_input_file, video_directory, knowledge_directory, folder_id)
     pipeline()
 
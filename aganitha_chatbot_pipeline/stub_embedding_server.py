@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import typer
+
+logger = logging.getLogger(__name__)
+app = typer.Typer()
+
+
+def stub_vector(text: str, dimensions: int) -> List[float]:
+    """Deterministic unit vector seeded by the text, so identical texts embed identically"""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+class StubEmbeddingServer(ThreadingHTTPServer):
+    """Answers POST /v1/embeddings the way the OpenAI API does, with deterministic vectors, an
+       optional per-request latency and a requests-per-minute limit that returns 429s, so the
+       embedding engine can be exercised without calling the provider"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8089, dimensions: int = 1536,
+                 latency: float = 0.0, requests_per_minute: int = 0):
+        super().__init__((host, port), _Handler)
+        self.dimensions = dimensions
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        # Usage served so far, what the provider would bill
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+        self._recent: deque = deque()
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def admit(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if not self.requests_per_minute:
+                return True
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_minute:
+                return False
+            self._recent.append(now)
+            return True
+
+    def bill(self, texts: int, tokens: int) -> None:
+        with self._lock:
+            self.texts += texts
+            self.tokens += tokens
+
+    def start(self) -> "StubEmbeddingServer":
+        threading.Thread(target=self.serve_forever, name="stub-embedding-server", daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StubEmbeddingServer
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            return self._reply(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.server.admit():
+            return self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [
+            {"object": "embedding", "index": index, "embedding": stub_vector(str(text), self.server.dimensions)}
+            for index, text in enumerate(inputs)
+        ]
+        tokens = sum(len(str(text)) // 4 for text in inputs)
+        self.server.bill(len(inputs), tokens)
+        self._reply(200, {"object": "list", "data": data, "model": body.get("model", "stub"),
+                          "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _reply(self, status: int, payload: dict) -> None:
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+@app.command()
+def serve(host: str = "127.0.0.1", port: int = 8089, dimensions: int = 1536, latency: float = 0.0,
+          requests_per_minute: int = 0):
+    """Serves stub embeddings, point EMBEDDING_ENGINE.API_BASE at http://<host>:<port>/v1"""
+    server = StubEmbeddingServer(host, port, dimensions, latency, requests_per_minute)
+    typer.echo(f"stub embeddings on {server.api_base}")
+    server.serve_forever()
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+from aganitha_chatbot_pipeline import metrics
+from aganitha_chatbot_pipeline.manifest import file_hash
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Whisper model of the current worker process, loaded once by the pool initializer
+_model = None
+
+
+def _init_worker(model_size: str, threads: int) -> None:
+    import torch
+    import whisper
+
+    global _model
+    torch.set_num_threads(threads)
+    _model = whisper.load_model(model_size)
+
+
+def _load_segment(path: str, start: float, duration: float):
+    """Decodes one slice of the file to 16 kHz mono float32, the way whisper.load_audio does"""
+    import ffmpeg
+    import numpy as np
+
+    out, _ = (
+        ffmpeg.input(path, ss=start, t=duration, threads=0)
+        .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=SAMPLE_RATE)
+        .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def _transcribe_segment(path: str, start: float, duration: float) -> str:
+    transcription = _model.transcribe(_load_segment(path, start, duration))
+    return " ".join(segment["text"].strip() for segment in transcription["segments"])
+
+
+class TranscriptionService:
+    """Transcribes audio files on a pool of Whisper workers. The pool is started on first use
+       and kept until `close`, so every worker loads the model once however many calls it serves.
+       Long recordings are cut into `segment_seconds` slices transcribed in parallel and stitched
+       back per file, and each transcript is cached by the hash of the audio file as soon as its
+       last slice is done"""
+
+    def __init__(self, model_size: str = "small", workers: int = 1, segment_seconds: int = 600,
+                 cache_dir: Optional[str] = None):
+        self.model_size = model_size
+        self.workers = max(1, workers)
+        self.segment_seconds = segment_seconds
+        self.cache_dir = cache_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def transcribe(self, audio_files: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Returns the transcript of every file, keyed by its path, and the files that could not
+           be transcribed. A failed slice fails its file only, the others are transcribed and cached"""
+        transcripts: Dict[str, str] = {}
+        hashes: Dict[str, str] = {}
+        for path in audio_files:
+            hashes[path] = file_hash(path)
+            cached = self._cached(hashes[path])
+            if cached is not None:
+                transcripts[path] = cached
+        missing = [path for path in audio_files if path not in transcripts]
+        logger.info(f"{len(transcripts)} transcripts cached, {len(missing)} files to transcribe")
+        if not missing:
+            return transcripts, []
+
+        failed: List[str] = []
+        parts: Dict[str, List[Optional[str]]] = {}
+        futures: Dict[Future, Tuple[str, int]] = {}
+        pool = self._executor()
+        for path in missing:
+            try:
+                starts = self._segment_starts(path)
+                parts[path] = [None] * len(starts)
+                for index, start in enumerate(starts):
+                    futures[pool.submit(_transcribe_segment, path, start, self.segment_seconds)] = (path, index)
+            except Exception as e:
+                logger.error(f"skipping {path}, it could not be transcribed: {e!r}")
+                failed.append(path)
+                parts.pop(path, None)
+                if isinstance(e, BrokenProcessPool):
+                    self._reset(pool)
+
+        for future in metrics.iterate("transcribe", as_completed(futures)):
+            path, index = futures[future]
+            if path not in parts:
+                # An earlier slice of the file failed
+                continue
+            try:
+                parts[path][index] = future.result()
+            except Exception as e:
+                logger.error(f"skipping {path}, its slice {index} could not be transcribed: {e!r}")
+                failed.append(path)
+                del parts[path]
+                if isinstance(e, BrokenProcessPool):
+                    self._reset(pool)
+                continue
+            if all(text is not None for text in parts[path]):
+                transcripts[path] = " ".join(text for text in parts.pop(path) if text).strip(" ")
+                self._store(hashes[path], transcripts[path])
+        return transcripts, failed
+
+    def close(self) -> None:
+        """Stops the Whisper workers, a later call starts them again"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                # Spawned, forking from the pipeline's loader threads could copy held locks into the workers
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self.model_size, threads), mp_context=get_context("spawn"))
+            return self._pool
+
+    def _reset(self, pool: ProcessPoolExecutor) -> None:
+        """Drops a pool that lost a worker, e.g. to the OOM killer, the next call starts a new one"""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _segment_starts(self, path: str) -> List[float]:
+        import ffmpeg
+
+        duration = float(ffmpeg.probe(path)["format"]["duration"])
+        count = max(1, math.ceil(duration / self.segment_seconds))
+        return [float(index * self.segment_seconds) for index in range(count)]
+
+    def _cache_path(self, audio_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.model_size}-{audio_hash}.json")
+
+    def _cached(self, audio_hash: str) -> Optional[str]:
+        if not self.cache_dir or not os.path.exists(self._cache_path(audio_hash)):
+            return None
+        with open(self._cache_path(audio_hash)) as f:
+            return json.load(f)["text"]
+
+    def _store(self, audio_hash: str, text: str) -> None:
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial = self._cache_path(audio_hash) + ".part"
+        with open(partial, "w") as f:
+            json.dump({"model": self.model_size, "text": text}, f)
+        os.replace(partial, self._cache_path(audio_hash))
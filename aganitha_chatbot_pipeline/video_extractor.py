@@ -1,65 +1,150 @@
-import moviepy.editor as mp
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from langchain.docstore.document import Document
-import whisper
+from aganitha_chatbot_pipeline.transcription import SAMPLE_RATE, TranscriptionService
+import ffmpeg
+import logging
 import os
-import subprocess
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
 
 
 class VideoExtractor:
-    def __init__(self, video_directory: str):
+    def __init__(self, video_directory: str, manifest=None, transcription: TranscriptionService = None,
+                 workers: int = 1):
         self.video_directory = video_directory
-        self.audio_directory = None
+        self.audio_directory = os.path.join(os.path.dirname(self.video_directory), "audio_files")
+        self.manifest = manifest
+        self.transcription = transcription or TranscriptionService()
+        self.workers = max(1, workers)
+        self.converted: set = set()
+        self.skipped: set = set()
+        self.failed: set = set()
 
     def __call__(self):
+        manifest = self.manifest
+        self.plan()
         docs = self.audio_files_generator()
+        if manifest is not None and self.failed:
+            # Their transcripts stay and they are converted again next run
+            manifest.discard(self.failed)
         return docs
 
+    def plan(self) -> "VideoExtractor":
+        """Runs every manifest check up front and detaches the manifest, so that conversion
+           and transcription can run in a worker"""
+        if self.manifest is None:
+            return self
+        for source_id, path in self._inputs().items():
+            if self.manifest.is_unchanged(source_id, "video", self._fingerprint(path)):
+                self.skipped.add(source_id)
+            else:
+                self.converted.add(source_id)
+        self.manifest = None
+        return self
+
     def audio_files_generator(self) -> List[Document]:
-        """ Generates audio files from video files in the directory"""
-        video_parent = os.path.dirname(self.video_directory)
-        if not os.path.exists(os.path.join(video_parent, "audio_files")):
-            # Creating a separate directory for audio files
-            print(os.path.join(video_parent, "audio_files"))
-            os.mkdir(os.path.join(video_parent, "audio_files"))
-        self.audio_directory = os.path.join(video_parent, "audio_files")
-        for file_name in os.listdir(self.video_directory):
-            temp = file_name
-            if temp.split('.')[-1] in ["m4a", "flac", "mp3", "wav", "wma", "aac"]:
-                af = self.audio_directory
-                print(af)
-                cmd = "mv '{}' {}".format(os.path.join(self.video_directory,file_name), af)
-                os.system(cmd)
-                continue
-            video_file: str = os.path.join(self.video_directory, file_name)
-            clip = mp.VideoFileClip(r"{}".format(video_file))
-            audio_file: str = os.path.splitext(video_file)[0]
-            clip.audio.write_audiofile(r"{}.mp3".format(os.path.join(self.audio_directory, audio_file)))
-        return self.transcript_generator()
+        """ Extracts 16 kHz mono WAV audio, the input Whisper expects, from every changed video or
+            audio file. ffmpeg drops the video stream and resamples in one pass and the files are
+            converted in parallel into a work directory private to this run. Files ffmpeg cannot
+            convert or Whisper cannot transcribe are skipped and listed in `failed`"""
+        inputs = self.changed_inputs()
+        os.makedirs(self.audio_directory, exist_ok=True)
+        work_directory = tempfile.mkdtemp(prefix="run-", dir=self.audio_directory)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                converted = dict(zip(inputs, pool.map(self._convert, inputs, inputs.values(),
+                                                      [work_directory] * len(inputs))))
+            audio_files = {source_id: audio_file for source_id, audio_file in converted.items() if audio_file}
+            return self.transcript_generator(inputs, audio_files)
+        finally:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    def changed_inputs(self) -> Dict[str, str]:
+        """Media files by source id, without those `plan` found unchanged"""
+        return {source_id: path for source_id, path in self._inputs().items() if source_id not in self.skipped}
+
+    def load_item(self, source_id: str, path: str) -> List[Document]:
+        """Extracts the audio of one file and transcribes it, raising if either fails"""
+        os.makedirs(self.audio_directory, exist_ok=True)
+        work_directory = tempfile.mkdtemp(prefix="item-", dir=self.audio_directory)
+        try:
+            audio_file = self._extract_audio(path, work_directory)
+            docs = self.transcript_generator({source_id: path}, {source_id: audio_file})
+        finally:
+            shutil.rmtree(work_directory, ignore_errors=True)
+        if source_id in self.failed:
+            raise RuntimeError(f"{path} could not be transcribed")
+        return docs
+
+    def _convert(self, source_id: str, path: str, work_directory: str) -> Optional[str]:
+        try:
+            return self._extract_audio(path, work_directory)
+        except Exception as e:
+            stderr = getattr(e, "stderr", None)
+            detail = stderr.decode("utf-8", "replace").strip().splitlines()[-1:] if stderr else [repr(e)]
+            logger.error(f"skipping {path}, its audio could not be extracted: {' '.join(detail)}")
+            self.failed.add(source_id)
+            return None
 
-    def transcript_generator(self) -> List[Document]:
-        """Using the whisper model, converting the audio to transcript and writing it
-           into a pdf and storing them in the knowledge directory"""
-        vf = self.video_directory + '/*.mp3'
-        af = self.audio_directory
-        cmd = "mv {} {}".format(vf, af)
-        os.system(cmd)
-        model: whisper = whisper.load_model("small")
-        texts: List[str] = []
+    def transcript_generator(self, inputs: Dict[str, str], audio_files: Dict[str, str]) -> List[Document]:
+        """Using the whisper model, converting the audio to transcript. Files Whisper fails on are
+           listed in `failed`"""
+        transcripts, failed = self.transcription.transcribe(list(audio_files.values()))
+        failed = set(failed)
         docs: List[Document] = []
-        for file in os.listdir(self.audio_directory):
-            transcription = model.transcribe(os.path.join(self.audio_directory,file))
-            segments = transcription['segments']
-            for segment in segments:
-                text = segment['text']
-                texts.append("".join(text))
-            transcript: str = " ".join(texts).strip(" ")
-            id_file = file.split('**')[0]
-            doc: Document = Document(page_content=transcript, metadata={"source": os.path.join(self.audio_directory, file),'id':id_file})
+        for source_id, audio_file in audio_files.items():
+            if audio_file in failed:
+                self.failed.add(source_id)
+                continue
+            doc: Document = Document(page_content=transcripts[audio_file],
+                                     metadata={"source": inputs[source_id], 'id': source_id})
             docs.append(doc)
         return docs
 
+    def _inputs(self) -> Dict[str, str]:
+        """Media files by source id. Top-level files of the audio directory are where earlier
+           versions moved audio inputs to, the video directory wins when both hold a source"""
+        inputs: Dict[str, str] = {}
+        for directory in (self.audio_directory, self.video_directory):
+            if not os.path.isdir(directory):
+                continue
+            for file_name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, file_name)
+                # Hidden files such as .DS_Store are not recordings
+                if os.path.isfile(path) and not file_name.endswith(".part") and not file_name.startswith("."):
+                    inputs[self._source_id(file_name)] = path
+        return inputs
 
+    @staticmethod
+    def _extract_audio(path: str, work_directory: str) -> str:
+        """Writes the WAV under a temporary name and renames it, so a partial file is never read"""
+        audio_file = os.path.join(work_directory, os.path.basename(path) + ".wav")
+        partial = audio_file + ".part"
+        (
+            ffmpeg.input(path)
+            # bitexact keeps the output identical across runs, which the transcript cache relies on
+            .output(partial, format="wav", vn=None, ac=1, ar=SAMPLE_RATE, acodec="pcm_s16le",
+                    map_metadata=-1, fflags="+bitexact", flags="+bitexact")
+            .overwrite_output()
+            .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
+        )
+        os.replace(partial, audio_file)
+        logger.info(f"audio extracted from {path}")
+        return audio_file
 
+    @staticmethod
+    def _source_id(file_name: str) -> str:
+        """Drive downloads are named `<file id>**<name>`, local files are keyed by their name, so
+           `talk.mp4` and `talk.mkv` are two sources"""
+        if '**' in file_name:
+            return file_name.split('**')[0]
+        return file_name
 
-
+    @staticmethod
+    def _fingerprint(path: str) -> str:
+        """Size and mtime, hashing multi-GB recordings would cost more than it saves"""
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
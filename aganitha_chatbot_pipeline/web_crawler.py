@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from queue import Queue
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import aiohttp
+from bs4 import BeautifulSoup
+from langchain.docstore.document import Document
+
+from aganitha_chatbot_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/111.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+# Statuses that mean a page was removed rather than that fetching it failed
+GONE = (404, 410)
+
+
+class ResponseCache:
+    """Last response body of every URL with the validators needed to revalidate it. Writes are
+       committed every `commit_every` responses and on `close`, a crash loses a few cache
+       entries at most"""
+
+    def __init__(self, path: str, commit_every: int = 100):
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "body TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+        return self._conn.execute(
+            "SELECT etag, last_modified, body FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], body: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (url, etag, last_modified, body, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (url, etag, last_modified, body, time.time()),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+
+class WebCrawler:
+    """Fetches pages over pooled keep-alive connections with a per-host concurrency cap and a
+       minimum delay between requests to the same host. Pages seen before are revalidated with
+       If-None-Match/If-Modified-Since and served from the response cache on a 304. With
+       `max_depth` above 0 same-domain links are followed. Pages come back as the same
+       Documents WebBaseLoader produces. URLs that could not be fetched, for any reason but
+       the page being gone (404, 410), are listed in `failed` once the crawl is over"""
+
+    def __init__(self, concurrency: int = 8, per_host: int = 2, delay: float = 0.0, max_depth: int = 0,
+                 cache_path: Optional[str] = None, timeout: float = 30.0):
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.delay = delay
+        self.max_depth = max_depth
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.cache: Optional[ResponseCache] = None
+        self._next_slot: Dict[str, float] = {}
+        self._host_locks: Dict[str, asyncio.Lock] = {}
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.failed: List[str] = []
+
+    def load(self, urls: Iterable[str]) -> List[Document]:
+        return list(self.lazy_load(urls))
+
+    def lazy_load(self, urls: Iterable[str], buffer: int = 64) -> Iterator[Document]:
+        """Runs the crawl on an event loop thread of its own and hands pages over through a
+           bounded queue, so fetching pauses while the consumer is behind. A consumer that stops
+           early, by an error or by closing the generator, stops the crawl too"""
+        queue: Queue = Queue(maxsize=buffer)
+        stop = threading.Event()
+        done = object()
+        urls = list(dict.fromkeys(urls))
+
+        def run() -> None:
+            try:
+                asyncio.run(self._crawl(urls, queue, stop))
+            except BaseException as e:
+                if not stop.is_set():
+                    queue.put(e)
+            finally:
+                if not stop.is_set():
+                    queue.put(done)
+
+        threading.Thread(target=run, name="web-crawler", daemon=True).start()
+        try:
+            while True:
+                item = queue.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # Frees a put the crawler may be blocked in, it then sees the stop and returns
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def _crawl(self, urls: List[str], queue: Queue, stop: threading.Event) -> None:
+        self.cache = ResponseCache(self.cache_path) if self.cache_path else None
+        self._next_slot.clear()
+        self._host_locks.clear()
+        self._host_slots.clear()
+        self.failed = []
+        # Requests wait for a slot here rather than in the connector, where the wait would
+        # count against their timeout
+        self._slots = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        loop = asyncio.get_running_loop()
+        count = 0
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=DEFAULT_HEADERS) as session:
+                seen = set(urls)
+                frontier = urls
+                for depth in range(self.max_depth + 1):
+                    next_frontier = []
+                    fetches = [asyncio.ensure_future(self._fetch(session, url)) for url in frontier]
+                    for page in asyncio.as_completed(fetches):
+                        url, html = await page
+                        if stop.is_set():
+                            for fetch in fetches:
+                                fetch.cancel()
+                            logger.info(f"crawl stopped by its consumer after {count} pages")
+                            return
+                        if html is None:
+                            continue
+                        soup = BeautifulSoup(html, "html.parser")
+                        doc = Document(page_content=soup.get_text(), metadata={"source": url})
+                        # A blocking put off the loop keeps in-flight responses draining
+                        await loop.run_in_executor(None, queue.put, doc)
+                        count += 1
+                        if depth < self.max_depth:
+                            for link in self._same_domain_links(url, soup):
+                                if link not in seen:
+                                    seen.add(link)
+                                    next_frontier.append(link)
+                    frontier = next_frontier
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+        logger.info(f"{count} pages crawled")
+
+    async def _fetch(self, session: "aiohttp.ClientSession", url: str) -> Tuple[str, Optional[str]]:
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        host = urlparse(url).netloc
+        host_slots = self._host_slots.setdefault(host, asyncio.Semaphore(self.per_host))
+        try:
+            async with host_slots, self._slots:
+                await self._throttle(host)
+                async with session.get(url, headers=headers) as resp:
+                    metrics.count("api_calls", service="web")
+                    if resp.status == 304 and cached is not None:
+                        metrics.count("web_not_modified")
+                        return url, cached[2]
+                    resp.raise_for_status()
+                    body = await resp.text(errors="replace")
+                    if self.cache is not None:
+                        self.cache.put(url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), body)
+                    return url, body
+        except aiohttp.ClientResponseError as e:
+            if e.status in GONE:
+                logger.warning(f"{url} is gone ({e.status})")
+                return url, None
+            logger.error(f"failed to fetch {url}: {e!r}")
+            metrics.count("api_failures", service="web")
+            self.failed.append(url)
+            return url, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"failed to fetch {url}: {e!r}")
+            metrics.count("api_failures", service="web")
+            self.failed.append(url)
+            return url, None
+
+    async def _throttle(self, host: str) -> None:
+        """Spaces out the start of requests to one host by `delay` seconds"""
+        if self.delay <= 0:
+            return
+        lock = self._host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next_slot.get(host, 0.0) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_slot[host] = loop.time() + self.delay
+
+    @staticmethod
+    def _same_domain_links(url: str, soup: BeautifulSoup) -> List[str]:
+        host = urlparse(url).netloc
+        links = []
+        for anchor in soup.find_all("a", href=True):
+            link = urldefrag(urljoin(url, anchor["href"]))[0]
+            parsed = urlparse(link)
+            if parsed.scheme in ("http", "https") and parsed.netloc == host:
+                links.append(link)
+        return links
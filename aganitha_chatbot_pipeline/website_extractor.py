@@ -1,16 +1,40 @@
-from langchain.document_loaders import WebBaseLoader
-from typing import List
+from aganitha_chatbot_pipeline.manifest import content_hash
+from aganitha_chatbot_pipeline.web_crawler import WebCrawler
+from typing import Iterable, Iterator, List
+from urllib.parse import urlparse
 
 
 class WebsiteExtractor:
 
     @staticmethod
-    def website_loader(web_input_file: str) -> List:
+    def website_loader(web_input_file: str, manifest=None, crawler: WebCrawler = None) -> List:
         """Takes in a file with list of links and returns the contents of the
            websites as document objects"""
+        return list(WebsiteExtractor.lazy_website_loader(web_input_file, manifest, crawler))
+
+    @staticmethod
+    def lazy_website_loader(web_input_file: str, manifest=None, crawler: WebCrawler = None) -> Iterator:
+        """Yields the pages as they are fetched. Pages whose content hash matches the
+           manifest are dropped, pages that could not be fetched keep their chunks"""
         with open(web_input_file, "r") as f:
-            urls = [line.strip() for line in f]
+            urls = [line.strip() for line in f if line.strip()]
 
-        loader = WebBaseLoader(urls)
-        docs = loader.load()
-        return docs
+        crawler = crawler or WebCrawler()
+        for doc in crawler.lazy_load(urls):
+            if manifest is None or not manifest.is_unchanged(doc.metadata["source"], "website",
+                                                             content_hash(doc.page_content)):
+                yield doc
+        if manifest is not None and crawler.failed:
+            WebsiteExtractor.keep_unreachable(manifest, crawler.failed, crawler.max_depth > 0)
+
+    @staticmethod
+    def keep_unreachable(manifest, urls: Iterable[str], whole_host: bool = False) -> None:
+        """Leaves pages that could not be fetched out of the manifest run, so a site that is down
+           for a run keeps its chunks. With links followed the pages below them are not known,
+           every page of their hosts is kept"""
+        urls = list(urls)
+        manifest.discard(urls)
+        if whole_host:
+            hosts = {urlparse(url).netloc for url in urls}
+            manifest.discard([source_id for source_id in manifest.removed_sources()
+                              if urlparse(source_id).netloc in hosts])
@@ -0,0 +1,277 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+STATES = ("pending", "leased", "done", "dead")
+
+
+class WorkItem:
+    def __init__(self, id: int, key: str, source_type: str, source_id: Optional[str], payload: Dict[str, Any],
+                 attempts: int):
+        self.id = id
+        self.key = key
+        self.source_type = source_type
+        self.source_id = source_id
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return f"WorkItem({self.key!r}, attempt {self.attempts})"
+
+
+class WorkQueue:
+    """Durable queue of source items in SQLite, shared by a coordinator and any number of
+       worker processes.
+
+       A worker claims an item under a lease of `lease_seconds`, renews it while the item is
+       processed and commits the item's documents together with marking it done, so a result
+       is either complete or absent. An item whose lease runs out, because its worker crashed
+       or was killed, is claimed again. Every claim counts as an attempt; failed items wait
+       `retry_delay` seconds, doubled per attempt, and after `max_attempts` they are dead and
+       recorded in the dead letters until they are requeued.
+
+       Enqueueing is keyed: an item already queued with the same fingerprint keeps its state,
+       so a coordinator restarted after a crash does not redo finished work. The queue uses a
+       rollback journal rather than WAL so that workers on other hosts can share the file over
+       a filesystem with working locks"""
+
+    def __init__(self, path: str, lease_seconds: float = 600.0, max_attempts: int = 3, retry_delay: float = 30.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # Transactions are explicit, claims take the write lock before reading
+        self._conn = sqlite3.connect(path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, "
+            "source_type TEXT NOT NULL, source_id TEXT, payload TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL DEFAULT 0, "
+            "lease_owner TEXT, lease_until REAL, done_seq INTEGER, error TEXT, updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS items_state ON items (state, available_at);"
+            "CREATE INDEX IF NOT EXISTS items_done ON items (done_seq) WHERE done_seq IS NOT NULL;"
+            "CREATE TABLE IF NOT EXISTS results (item_id INTEGER NOT NULL, seq INTEGER NOT NULL, "
+            "text TEXT NOT NULL, metadata TEXT NOT NULL, PRIMARY KEY (item_id, seq));"
+            "CREATE TABLE IF NOT EXISTS dead_letters (id INTEGER PRIMARY KEY, key TEXT NOT NULL, "
+            "source_type TEXT NOT NULL, payload TEXT NOT NULL, attempts INTEGER NOT NULL, error TEXT, "
+            "worker TEXT, failed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+
+    def enqueue(self, items: Iterable[Tuple[str, str, Optional[str], Dict[str, Any], str]]) -> int:
+        """Adds (key, source_type, source_id, payload, fingerprint) items. A queued item with
+           another fingerprint is reset to pending, one with the same fingerprint is left as it
+           is. The number of items added or reset"""
+        now = time.time()
+        changed = 0
+        with self._transaction() as conn:
+            for key, source_type, source_id, payload, fingerprint in items:
+                row = conn.execute("SELECT id, fingerprint FROM items WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] == fingerprint:
+                    continue
+                if row is not None:
+                    conn.execute("DELETE FROM results WHERE item_id = ?", (row[0],))
+                conn.execute(
+                    "INSERT INTO items (key, source_type, source_id, payload, fingerprint, state, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'pending', ?) ON CONFLICT (key) DO UPDATE SET "
+                    "source_type = excluded.source_type, source_id = excluded.source_id, payload = excluded.payload, "
+                    "fingerprint = excluded.fingerprint, state = 'pending', attempts = 0, available_at = 0, "
+                    "lease_owner = NULL, lease_until = NULL, done_seq = NULL, error = NULL, "
+                    "updated_at = excluded.updated_at",
+                    (key, source_type, source_id, json.dumps(payload), fingerprint, now))
+                changed += 1
+        return changed
+
+    def claim(self, worker: str, source_types: Optional[List[str]] = None) -> Optional[WorkItem]:
+        """Leases the oldest available item to the worker, None when there is nothing to do"""
+        now = time.time()
+        condition, params = "", []
+        if source_types:
+            condition = f" AND source_type IN ({','.join('?' * len(source_types))})"
+            params = list(source_types)
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id, key, source_type, source_id, payload, attempts, error FROM items "
+                    "WHERE ((state = 'pending' AND available_at <= ?) OR (state = 'leased' AND lease_until < ?))"
+                    f"{condition} ORDER BY id LIMIT 1", [now, now] + params).fetchone()
+                if row is None:
+                    return None
+                id, key, source_type, source_id, payload, attempts, error = row
+                if attempts >= self.max_attempts:
+                    # Every attempt so far lost its worker, the last one included
+                    self._bury(conn, id, error or "lease expired, the worker stopped", None, now)
+                    continue
+                conn.execute("UPDATE items SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                             "lease_until = ?, updated_at = ? WHERE id = ?",
+                             (worker, now + self.lease_seconds, now, id))
+                return WorkItem(id, key, source_type, source_id, json.loads(payload), attempts + 1)
+
+    def renew(self, item: WorkItem, worker: str) -> bool:
+        """Extends the worker's lease, False if the item was given to another worker"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE items SET lease_until = ?, updated_at = ? "
+                                  "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                                  (now + self.lease_seconds, now, item.id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, item: WorkItem, worker: str, docs: Iterable[Document]) -> bool:
+        """Stores the item's documents and marks it done in one transaction. False, with nothing
+           stored, if the worker no longer holds the lease"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state, lease_owner FROM items WHERE id = ?", (item.id,)).fetchone()
+            if row is None or row[0] != "leased" or row[1] != worker:
+                logger.warning(f"{item.key} was leased to another worker, its result is dropped")
+                return False
+            conn.execute("DELETE FROM results WHERE item_id = ?", (item.id,))
+            conn.executemany("INSERT INTO results (item_id, seq, text, metadata) VALUES (?, ?, ?, ?)",
+                             ((item.id, seq, doc.page_content, json.dumps(doc.metadata)) for seq, doc in enumerate(docs)))
+            seq = int(self._setting(conn, "done_seq") or 0) + 1
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('done_seq', ?)", (str(seq),))
+            conn.execute("UPDATE items SET state = 'done', lease_owner = NULL, lease_until = NULL, done_seq = ?, "
+                         "error = NULL, updated_at = ? WHERE id = ?", (seq, now, item.id))
+            return True
+
+    def fail(self, item: WorkItem, worker: str, error: str) -> None:
+        """Releases the item for a later attempt, or buries it once it used every attempt"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state, lease_owner, attempts FROM items WHERE id = ?", (item.id,)).fetchone()
+            if row is None or row[0] != "leased" or row[1] != worker:
+                return
+            if row[2] >= self.max_attempts:
+                self._bury(conn, item.id, error, worker, now)
+                return
+            delay = self.retry_delay * 2 ** (row[2] - 1)
+            conn.execute("UPDATE items SET state = 'pending', available_at = ?, lease_owner = NULL, "
+                         "lease_until = NULL, error = ?, updated_at = ? WHERE id = ?",
+                         (now + delay, error, now, item.id))
+        logger.warning(f"{item.key} failed on attempt {row[2]}, retrying in {delay:.0f}s: {error}")
+
+    def finished(self, after: int = 0) -> List[Tuple[int, WorkItem]]:
+        """Items done since the `after` completion sequence number, in completion order"""
+        rows = self._read("SELECT done_seq, id, key, source_type, source_id, payload, attempts FROM items "
+                          "WHERE state = 'done' AND done_seq > ? ORDER BY done_seq", (after,))
+        return [(seq, WorkItem(id, key, source_type, source_id, json.loads(payload), attempts))
+                for seq, id, key, source_type, source_id, payload, attempts in rows]
+
+    def results(self, item: WorkItem) -> Iterator[Document]:
+        for text, metadata in self._read("SELECT text, metadata FROM results WHERE item_id = ? ORDER BY seq",
+                                         (item.id,)):
+            yield Document(page_content=text, metadata=json.loads(metadata))
+
+    def dead(self) -> List[WorkItem]:
+        rows = self._read("SELECT id, key, source_type, source_id, payload, attempts FROM items WHERE state = 'dead'")
+        return [WorkItem(id, key, source_type, source_id, json.loads(payload), attempts)
+                for id, key, source_type, source_id, payload, attempts in rows]
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._read("SELECT key, source_type, attempts, error, worker, failed_at FROM dead_letters "
+                          "ORDER BY id DESC LIMIT ?", (limit,))
+        return [{"key": key, "source_type": source_type, "attempts": attempts, "error": error, "worker": worker,
+                 "failed_at": failed_at} for key, source_type, attempts, error, worker, failed_at in rows]
+
+    def counts(self, source_types: Optional[List[str]] = None) -> Dict[str, int]:
+        condition, params = "", []
+        if source_types:
+            condition = f" WHERE source_type IN ({','.join('?' * len(source_types))})"
+            params = list(source_types)
+        counts = {state: 0 for state in STATES}
+        counts.update(dict(self._read(f"SELECT state, COUNT(*) FROM items{condition} GROUP BY state", params)))
+        return counts
+
+    def prune(self, keys: Iterable[str], source_types: Iterable[str]) -> int:
+        """Forgets items of these types that are not among `keys`, left by an earlier run over
+           sources that no longer exist"""
+        keep = set(keys)
+        source_types = list(source_types)
+        if not source_types:
+            return 0
+        with self._transaction() as conn:
+            stale = [id for id, key in conn.execute(
+                f"SELECT id, key FROM items WHERE source_type IN ({','.join('?' * len(source_types))})",
+                source_types) if key not in keep]
+            conn.executemany("DELETE FROM results WHERE item_id = ?", [(id,) for id in stale])
+            conn.executemany("DELETE FROM items WHERE id = ?", [(id,) for id in stale])
+        return len(stale)
+
+    def requeue(self, keys: Optional[List[str]] = None) -> int:
+        """Gives dead items, or those among `keys`, a fresh set of attempts"""
+        now = time.time()
+        condition, params = "state = 'dead'", []
+        if keys:
+            condition += f" AND key IN ({','.join('?' * len(keys))})"
+            params = list(keys)
+        with self._transaction() as conn:
+            cursor = conn.execute(f"UPDATE items SET state = 'pending', attempts = 0, available_at = 0, error = NULL, "
+                                  f"updated_at = ? WHERE {condition}", [now] + params)
+            return cursor.rowcount
+
+    def drain(self) -> int:
+        """Forgets finished items and their results once they are ingested, dead items stay"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM results WHERE item_id IN (SELECT id FROM items WHERE state = 'done')")
+            return conn.execute("DELETE FROM items WHERE state = 'done'").rowcount
+
+    def get(self, key: str) -> Optional[str]:
+        rows = self._read("SELECT value FROM settings WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _bury(self, conn: sqlite3.Connection, id: int, error: str, worker: Optional[str], now: float) -> None:
+        conn.execute("INSERT INTO dead_letters (key, source_type, payload, attempts, error, worker, failed_at) "
+                     "SELECT key, source_type, payload, attempts, ?, ?, ? FROM items WHERE id = ?",
+                     (error, worker, now, id))
+        conn.execute("UPDATE items SET state = 'dead', lease_owner = NULL, lease_until = NULL, error = ?, "
+                     "updated_at = ? WHERE id = ?", (error, now, id))
+        logger.error(f"work item {id} failed for good: {error}")
+
+    @staticmethod
+    def _setting(conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _read(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._conn, self._lock)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT under the connection lock, rolled back on an exception"""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, kind, error, traceback) -> None:
+        try:
+            self.conn.execute("ROLLBACK" if kind is not None else "COMMIT")
+        finally:
+            self.lock.release()
@@ -6,6 +6,26 @@ class YamlParser:
     def __init__(self):
         self.vectordb: str = ""
         self.embed_model: str = ""
+        self.manifest_path: str = ""
+        self.embedding_cache: dict = {}
+        self.embedding_engine: dict = {}
+        self.local_embedding: dict = {}
+        self.concurrency: dict = {}
+        self.gdrive: dict = {}
+        self.whisper: dict = {}
+        self.web: dict = {}
+        self.streaming: dict = {}
+        self.faiss: dict = {}
+        self.milvus: dict = {}
+        self.chunking: dict = {}
+        self.dedup: dict = {}
+        self.parsing: dict = {}
+        self.pdf: dict = {}
+        self.bm25: dict = {}
+        self.retrieval: dict = {}
+        self.metrics: dict = {}
+        self.work_queue: dict = {}
+        self.chunk_store: dict = {}
         self.yaml_file: str = "config.yml"
 
     def __call__(self, *args, **kwargs)-> None:
@@ -13,3 +33,23 @@ class YamlParser:
             yaml_data: list[str] = yaml.safe_load(fp)
         self.vectordb = yaml_data["VECTORDB"]
         self.embed_model = yaml_data["EMBEDDING"]
+        self.manifest_path = yaml_data.get("MANIFEST", "")
+        self.embedding_cache = yaml_data.get("EMBEDDING_CACHE", {})
+        self.embedding_engine = yaml_data.get("EMBEDDING_ENGINE", {})
+        self.local_embedding = yaml_data.get("LOCAL_EMBEDDING", {})
+        self.concurrency = yaml_data.get("CONCURRENCY", {})
+        self.gdrive = yaml_data.get("GDRIVE", {})
+        self.whisper = yaml_data.get("WHISPER", {})
+        self.web = yaml_data.get("WEB", {})
+        self.streaming = yaml_data.get("STREAMING", {})
+        self.faiss = yaml_data.get("FAISS", {})
+        self.milvus = yaml_data.get("MILVUS", {})
+        self.chunking = yaml_data.get("CHUNKING", {})
+        self.dedup = yaml_data.get("DEDUP", {})
+        self.parsing = yaml_data.get("PARSING", {})
+        self.pdf = yaml_data.get("PDF", {})
+        self.bm25 = yaml_data.get("BM25", {})
+        self.retrieval = yaml_data.get("RETRIEVAL", {})
+        self.metrics = yaml_data.get("METRICS", {})
+        self.work_queue = yaml_data.get("WORK_QUEUE", {})
+        self.chunk_store = yaml_data.get("CHUNK_STORE", {})
@@ -0,0 +1 @@
+"""Benchmarks of the ingestion pipeline against local stand-ins of its services."""
@@ -0,0 +1,197 @@
+"""Synthetic corpora for the benchmarks, generated deterministically from a seed."""
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import wave
+from typing import Dict, List
+
+SCALES = {
+    "small": {"text": 20, "pdfs": 5, "pdf_pages": 8, "docs": 10, "sheets": 3, "sheet_tabs": 4, "sheet_rows": 50,
+              "pages": 20, "audio": 0, "audio_seconds": 5, "words": 800, "duplicates": 0.1},
+    "medium": {"text": 200, "pdfs": 40, "pdf_pages": 20, "docs": 100, "sheets": 20, "sheet_tabs": 8,
+               "sheet_rows": 200, "pages": 200, "audio": 0, "audio_seconds": 10, "words": 1500,
+               "duplicates": 0.1},
+    "large": {"text": 2000, "pdfs": 200, "pdf_pages": 40, "docs": 1000, "sheets": 100, "sheet_tabs": 12,
+              "sheet_rows": 500, "pages": 1000, "audio": 0, "audio_seconds": 30, "words": 2000,
+              "duplicates": 0.1},
+}
+
+DOC = "application/vnd.google-apps.document"
+SHEET = "application/vnd.google-apps.spreadsheet"
+FOLDER = "application/vnd.google-apps.folder"
+ROOT_FOLDER = "benchmark-root"
+
+
+class TextGenerator:
+    """Sentences over a Zipf-distributed vocabulary of pseudo-words, closer to natural text
+       than uniform noise for chunking, deduplication and compression"""
+
+    def __init__(self, seed: int = 0, vocabulary: int = 5000):
+        self.rng = random.Random(seed)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        self.words = ["".join(self.rng.choice(letters) for _ in range(self.rng.randint(2, 10)))
+                      for _ in range(vocabulary)]
+        self.weights = [1 / rank for rank in range(1, vocabulary + 1)]
+
+    def sentence(self) -> str:
+        words = self.rng.choices(self.words, self.weights, k=self.rng.randint(6, 24))
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self) -> str:
+        return " ".join(self.sentence() for _ in range(self.rng.randint(3, 8)))
+
+    def text(self, words: int) -> str:
+        paragraphs, count = [], 0
+        while count < words:
+            paragraph = self.paragraph()
+            paragraphs.append(paragraph)
+            count += paragraph.count(" ") + 1
+        return "\n\n".join(paragraphs)
+
+    def near_duplicate(self, text: str, edits: int = 3) -> str:
+        """The text with a few words replaced, as a re-exported or lightly edited copy would be"""
+        words = text.split(" ")
+        for _ in range(edits):
+            words[self.rng.randrange(len(words))] = self.rng.choice(self.words)
+        return " ".join(words)
+
+
+def write_pdf(path: str, pages: List[str], line_width: int = 90) -> None:
+    """Writes a minimal PDF with a Helvetica text layer, one string per page"""
+
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n"):
+            while len(paragraph) > line_width:
+                cut = paragraph.rfind(" ", 0, line_width)
+                cut = cut if cut > 0 else line_width
+                lines.append(paragraph[:cut])
+                paragraph = paragraph[cut:].lstrip()
+            lines.append(paragraph)
+        stream = "BT /F1 9 Tf 11 TL 36 806 Td " + " ".join(f"({escape(line)}) Tj T*" for line in lines[:70]) + " ET"
+        content = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{kid} 0 R" for kid in kids).encode(), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_wav(path: str, seconds: float, seed: int, sample_rate: int = 16000) -> None:
+    """Mono 16-bit tones, enough for ffmpeg and Whisper to process without real speech"""
+    rng = random.Random(seed)
+    frequencies = [rng.uniform(120, 800) for _ in range(4)]
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        frames = bytearray()
+        for i in range(int(seconds * sample_rate)):
+            frequency = frequencies[(i // sample_rate) % len(frequencies)]
+            frames += struct.pack("<h", int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate)))
+        f.writeframes(bytes(frames))
+
+
+def generate(directory: str, scale: Dict[str, float], seed: int = 0) -> Dict[str, str]:
+    """Writes a corpus under `directory` and returns the inputs of each source:
+
+       knowledge/  text files and PDFs for the knowledge directory
+       drive/      items.json describing a Drive folder tree (Google docs, sheets, PDFs, text)
+                   served by FakeGoogleServer, with the file bodies next to it
+       web/        HTML pages served by FakeWebServer
+       audio/      WAV files for the video extractor
+
+       `duplicates` of the text files repeat an earlier one with a few words changed"""
+    text = TextGenerator(seed)
+    words = int(scale["words"])
+    inputs = {}
+    knowledge = os.path.join(directory, "knowledge")
+    os.makedirs(knowledge, exist_ok=True)
+    bodies: List[str] = []
+    for i in range(int(scale["text"])):
+        if bodies and text.rng.random() < scale["duplicates"]:
+            body = text.near_duplicate(text.rng.choice(bodies))
+        else:
+            body = text.text(words)
+            bodies.append(body)
+        with open(os.path.join(knowledge, f"note-{i:05d}.txt"), "w") as f:
+            f.write(body)
+    for i in range(int(scale["pdfs"])):
+        write_pdf(os.path.join(knowledge, f"report-{i:05d}.pdf"),
+                  [text.text(400) for _ in range(int(scale["pdf_pages"]))])
+    inputs["knowledge_directory"] = knowledge
+
+    drive = os.path.join(directory, "drive")
+    os.makedirs(drive, exist_ok=True)
+    subfolder = "benchmark-sub"
+    items = [{"id": subfolder, "name": "nested", "mimeType": FOLDER, "parent": ROOT_FOLDER}]
+
+    def add(item_id: str, name: str, mime_type: str, body: bytes, parent: str) -> None:
+        with open(os.path.join(drive, item_id), "wb") as f:
+            f.write(body)
+        item = {"id": item_id, "name": name, "mimeType": mime_type, "parent": parent,
+                "modifiedTime": "2023-01-01T00:00:00.000Z"}
+        if not mime_type.startswith("application/vnd.google-apps"):
+            item["md5Checksum"] = hashlib.md5(body).hexdigest()
+        items.append(item)
+
+    for i in range(int(scale["docs"])):
+        add(f"doc-{i:05d}", f"doc {i}", DOC, text.text(words).encode(), ROOT_FOLDER if i % 2 else subfolder)
+    for i in range(int(scale["sheets"])):
+        header = ["name", "category", "amount", "notes"]
+        tabs = {f"Tab {tab}": [header] + [[text.rng.choice(text.words), text.rng.choice(text.words),
+                                           str(text.rng.randint(1, 10000)), text.sentence()]
+                                          for _ in range(int(scale["sheet_rows"]))]
+                for tab in range(int(scale["sheet_tabs"]))}
+        add(f"sheet-{i:05d}", f"sheet {i}", SHEET, json.dumps(tabs).encode(), ROOT_FOLDER)
+    for i in range(max(1, int(scale["pdfs"]) // 2)):
+        path = os.path.join(drive, "tmp.pdf")
+        write_pdf(path, [text.text(400) for _ in range(int(scale["pdf_pages"]))])
+        with open(path, "rb") as f:
+            add(f"pdf-{i:05d}", f"drive report {i}.pdf", "application/pdf", f.read(), subfolder)
+        os.remove(path)
+    for i in range(int(scale["text"]) // 2):
+        add(f"txt-{i:05d}", f"drive note {i}.txt", "text/plain", text.text(words).encode(), ROOT_FOLDER)
+    with open(os.path.join(drive, "items.json"), "w") as f:
+        json.dump(items, f)
+    inputs["drive"] = drive
+
+    web = os.path.join(directory, "web")
+    os.makedirs(web, exist_ok=True)
+    pages = int(scale["pages"])
+    for i in range(pages):
+        links = "".join(f'<a href="/page-{text.rng.randrange(pages):05d}.html">related</a> ' for _ in range(3))
+        paragraphs = "".join(f"<p>{text.paragraph()}</p>" for _ in range(max(1, words // 100)))
+        with open(os.path.join(web, f"page-{i:05d}.html"), "w") as f:
+            f.write(f"<html><head><title>Page {i}</title></head><body><nav>{links}</nav>{paragraphs}</body></html>")
+    inputs["web"] = web
+
+    if int(scale["audio"]):
+        audio = os.path.join(directory, "audio")
+        os.makedirs(audio, exist_ok=True)
+        for i in range(int(scale["audio"])):
+            write_wav(os.path.join(audio, f"talk-{i:05d}.wav"), scale["audio_seconds"], seed + i)
+        inputs["audio"] = audio
+    return inputs
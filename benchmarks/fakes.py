@@ -0,0 +1,221 @@
+"""Local stand-ins for Google Drive/Sheets and websites. Both are real HTTP servers, so the
+loaders run their own client code, connection handling and retries against them. Embeddings
+use the package's StubEmbeddingServer and Milvus runs as Milvus Lite."""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+_PARENT = re.compile(r"'([^']+)' in parents")
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, status: int, body: bytes, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def reply_json(self, payload: Any, status: int = 200) -> None:
+        self.reply(status, json.dumps(payload).encode("utf-8"))
+
+    def reply_bytes(self, data: bytes, content_type: str) -> None:
+        """Serves the bytes, honouring a Range header the way Drive media downloads do"""
+        match = _RANGE.match(self.headers.get("Range", ""))
+        if not match:
+            return self.reply(200, data, content_type)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            return self.reply(416, b"", content_type, {"Content-Range": f"bytes */{len(data)}"})
+        self.reply(206, data[start:end + 1], content_type, {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+class FakeGoogleServer(_Server):
+    """Serves the Drive v3 and Sheets v4 calls GDriveLoader makes from a generated corpus:
+       folder listings with paging, ranged media downloads, text exports of Google docs and
+       batchGet over sheet tabs. `calls` counts requests by route, each one an API call that
+       would count against the quota"""
+
+    def __init__(self, directory: str, page_size: int = 100, latency: float = 0.0):
+        super().__init__(_GoogleHandler, latency)
+        self.directory = directory
+        self.page_size = page_size
+        with open(os.path.join(directory, "items.json")) as f:
+            self.items: Dict[str, Dict[str, Any]] = {item["id"]: item for item in json.load(f)}
+        self.children: Dict[str, List[Dict[str, Any]]] = {}
+        for item in self.items.values():
+            self.children.setdefault(item["parent"], []).append(item)
+
+    def body(self, item_id: str) -> bytes:
+        with open(os.path.join(self.directory, item_id), "rb") as f:
+            return f.read()
+
+
+class _GoogleHandler(_Handler):
+    server: FakeGoogleServer
+
+    def do_GET(self) -> None:
+        if self.server.latency:
+            threading.Event().wait(self.server.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        if parts[:3] == ["drive", "v3", "files"]:
+            return self._drive(parts[3:], query)
+        if parts[:2] == ["v4", "spreadsheets"] and len(parts) >= 3:
+            return self._sheets(parts[2:], query)
+        self.server.count("unknown")
+        self.reply_json({"error": {"code": 404, "message": self.path}}, 404)
+
+    def _drive(self, parts: List[str], query: Dict[str, List[str]]) -> None:
+        if not parts:
+            self.server.count("drive.files.list")
+            parent = _PARENT.search(query.get("q", [""])[0])
+            children = self.server.children.get(parent.group(1) if parent else "", [])
+            offset = int(query.get("pageToken", ["0"])[0] or 0)
+            size = min(int(query.get("pageSize", ["100"])[0]), self.server.page_size)
+            page = {"files": [{key: value for key, value in item.items() if key != "parent"}
+                              for item in children[offset:offset + size]]}
+            if offset + size < len(children):
+                page["nextPageToken"] = str(offset + size)
+            return self.reply_json(page)
+        item = self.server.items.get(parts[0])
+        if item is None:
+            self.server.count("drive.files.get")
+            return self.reply_json({"error": {"code": 404, "message": "File not found"}}, 404)
+        if parts[1:] == ["export"]:
+            self.server.count("drive.files.export")
+            return self.reply_bytes(self.server.body(item["id"]), "text/plain")
+        if query.get("alt") == ["media"]:
+            self.server.count("drive.files.get_media")
+            return self.reply_bytes(self.server.body(item["id"]), item["mimeType"])
+        self.server.count("drive.files.get")
+        self.reply_json({"name": item["name"], "permissions": []})
+
+    def _sheets(self, parts: List[str], query: Dict[str, List[str]]) -> None:
+        item = self.server.items.get(parts[0])
+        if item is None:
+            return self.reply_json({"error": {"code": 404, "message": "Spreadsheet not found"}}, 404)
+        tabs: Dict[str, List[List[str]]] = json.loads(self.server.body(item["id"]))
+        if parts[1:] == ["values:batchGet"]:
+            self.server.count("sheets.values.batchGet")
+            ranges = [name[1:-1].replace("''", "'") if name.startswith("'") else name
+                      for name in query.get("ranges", [])]
+            return self.reply_json({"valueRanges": [{"values": tabs[name]} if tabs.get(name) else {}
+                                                    for name in ranges]})
+        if len(parts) == 3 and parts[1] == "values":
+            self.server.count("sheets.values.get")
+            name = parts[2].strip("'").replace("''", "'")
+            return self.reply_json({"values": tabs.get(name, [])})
+        self.server.count("sheets.spreadsheets.get")
+        self.reply_json({"sheets": [{"properties": {"sheetId": number, "title": name}}
+                                    for number, name in enumerate(tabs)]})
+
+
+class FakeGoogleClients:
+    """Stands in for google_clients.GoogleClients: clients are built from the bundled discovery
+       documents as usual but pointed at a FakeGoogleServer, over plain per-thread connections"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self._local = threading.local()
+
+    def credentials(self) -> None:
+        return None
+
+    def http(self) -> Any:
+        import httplib2
+
+        if getattr(self._local, "http", None) is None:
+            self._local.http = httplib2.Http()
+            self._local.services = {}
+        return self._local.http
+
+    def service(self, name: str = "drive", version: str = "v3") -> Any:
+        from googleapiclient.discovery import build_from_document
+
+        from aganitha_chatbot_pipeline.google_clients import discovery_document
+
+        http = self.http()
+        if (name, version) not in self._local.services:
+            document = discovery_document(name, version)
+            self._local.services[(name, version)] = build_from_document(
+                document, http=http, client_options={"api_endpoint": f"{self.url}/{document['servicePath']}"})
+        return self._local.services[(name, version)]
+
+
+class FakeWebServer(_Server):
+    """Serves the generated HTML pages with strong ETags and answers If-None-Match with 304,
+       the way a well-behaved site lets the crawler revalidate"""
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        super().__init__(_WebHandler, latency)
+        self.directory = directory
+        self.pages: Dict[str, Tuple[bytes, str]] = {}
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            self.pages["/" + name] = (body, '"%s"' % hashlib.md5(body).hexdigest())
+
+    def urls(self) -> List[str]:
+        return [self.url + path for path in self.pages]
+
+
+class _WebHandler(_Handler):
+    server: FakeWebServer
+
+    def do_GET(self) -> None:
+        if self.server.latency:
+            threading.Event().wait(self.server.latency)
+        page = self.server.pages.get(urlsplit(self.path).path)
+        if page is None:
+            self.server.count("404")
+            return self.reply(404, b"not found", "text/plain")
+        body, etag = page
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count("304")
+            return self.reply(304, b"", "text/html", {"ETag": etag})
+        self.server.count("200")
+        self.reply(200, body, "text/html; charset=utf-8", {"ETag": etag})
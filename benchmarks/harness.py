@@ -0,0 +1,263 @@
+"""Runs the Pipeline against the fakes and measures every stage."""
+import json
+import logging
+import os
+import resource
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import yaml
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Reported stages, upsert is the indexing time left after embedding
+STAGES = ("extract_wait", "chunk", "dedup", "embed", "upsert", "cleanup", "save")
+# Metrics where a larger value is an improvement, every other metric should go down
+HIGHER_IS_BETTER = {"docs_per_sec", "chunks_per_sec"}
+# Sizes of the workload, shown but neither better nor worse
+WORKLOAD = {"docs", "chunks_produced", "chunks_indexed", "chunks_embedded"}
+# Timings below this many seconds are noise, they are not compared
+MIN_SECONDS = 0.05
+
+
+class StageTimer:
+    """Accumulates wall time per stage across wrapped calls"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def wrap(self, owner: Any, name: str, stage: str) -> None:
+        original = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.counts[stage] += 1
+
+        setattr(owner, name, timed)
+
+    def iterate(self, items: Iterator, stage: str) -> Iterator:
+        """Yields the items, timing how long the consumer waits for each"""
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+            self.counts[stage] += 1
+            yield item
+
+
+class _TimedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, timer: StageTimer):
+        self.embeddings = embeddings
+        self.timer = timer
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        try:
+            return self.embeddings.embed_documents(texts)
+        finally:
+            self.timer.seconds["embed"] += time.perf_counter() - start
+            self.timer.counts["embed"] += len(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def write_config(workdir: str, api_base: str, vectordb: str, overrides: Optional[Dict[str, Any]] = None) -> str:
+    """The repository's config.yml with every store under `workdir/state`, embeddings from the
+       stub server and Milvus as a Milvus Lite file"""
+    with open(os.path.join(REPO, "config.yml")) as f:
+        config = yaml.safe_load(f)
+    state = os.path.join(workdir, "state")
+    os.makedirs(state, exist_ok=True)
+    config.update({"EMBEDDING": "OPENAI", "VECTORDB": vectordb, "MANIFEST": os.path.join(state, "manifest.sqlite")})
+    config["EMBEDDING_CACHE"]["PATH"] = os.path.join(state, "embedding_cache.sqlite")
+    config["EMBEDDING_ENGINE"].update({"API_BASE": api_base,
+                                       "CHECKPOINT": os.path.join(state, "embedding_checkpoint.sqlite")})
+    config["PDF"]["CACHE_PATH"] = os.path.join(state, "pdf_pages.sqlite")
+    config["BM25"]["PATH"] = os.path.join(state, "bm25.sqlite")
+    config["METRICS"]["REPORT"] = os.path.join(state, "run_report.json")
+    config["WORK_QUEUE"]["PATH"] = os.path.join(state, "work_queue.sqlite")
+    config["GDRIVE"]["DOWNLOAD_DIR"] = os.path.join(state, "gdrive_downloads")
+    config["WHISPER"]["CACHE_DIR"] = os.path.join(state, "transcripts")
+    config["WEB"].update({"CACHE_PATH": os.path.join(state, "web_cache.sqlite"), "DELAY": 0.0})
+    config["FAISS"]["DIRECTORY"] = os.path.join(state, "faiss_index")
+    config["MILVUS"] = {key: value for key, value in config["MILVUS"].items()
+                        if key not in ("USER", "PASSWORD", "SECURE", "TOKEN")}
+    # Milvus Lite only builds FLAT and IVF_FLAT indexes
+    config["MILVUS"].update({"URI": os.path.join(state, "milvus.db"), "INDEX_TYPE": "IVF_FLAT", "COMPACT": False})
+    for section, values in (overrides or {}).items():
+        if isinstance(values, dict):
+            config.setdefault(section, {}).update(values)
+        else:
+            config[section] = values
+    path = os.path.join(workdir, "config.yml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return path
+
+
+def run_pass(workdir: str, inputs: Dict[str, Optional[str]], google_url: Optional[str]) -> Dict[str, Any]:
+    """One pipeline run, meant for a fresh process so that peak RSS belongs to this pass"""
+    from aganitha_chatbot_pipeline import google_clients
+    from aganitha_chatbot_pipeline.chunker import Chunker
+    from aganitha_chatbot_pipeline.dedup import Deduplicator
+    from aganitha_chatbot_pipeline.pipeline import Pipeline
+    from benchmarks.fakes import FakeGoogleClients
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    # The benchmark's Milvus Lite file, not a cluster configured for real runs
+    for name in ("MILVUS_URI", "MILVUS_USER", "MILVUS_PASSWORD", "MILVUS_TOKEN"):
+        os.environ.pop(name, None)
+    os.chdir(workdir)
+    timer = StageTimer()
+    chunks = defaultdict(int)
+
+    def count_chunks(split):
+        def counted(self, text):
+            spans = split(self, text)
+            chunks["produced"] += len(spans)
+            return spans
+        return counted
+
+    Chunker.split = count_chunks(Chunker.split)
+    timer.wrap(Chunker, "split", "chunk")
+    timer.wrap(Deduplicator, "find", "dedup")
+    timer.wrap(Pipeline, "_select_index", "index")
+    timer.wrap(Pipeline, "_stale_chunks", "stale")
+    timer.wrap(Pipeline, "_delete_chunks", "delete")
+    timer.wrap(Pipeline, "_record_provenance", "provenance")
+    timer.wrap(Pipeline, "_save_index", "save")
+    extract = Pipeline._extract
+    Pipeline._extract = lambda self: timer.iterate(extract(self), "extract_wait")
+    select_embeddings = Pipeline._select_embeddings
+
+    def timed_embeddings(self, embed_model):
+        select_embeddings(self, embed_model)
+        self.embeddings = _TimedEmbeddings(self.embeddings, timer)
+
+    Pipeline._select_embeddings = timed_embeddings
+
+    fake = FakeGoogleClients(google_url) if google_url else None
+    with mock.patch.object(google_clients, "clients", lambda *args, **kwargs: fake):
+        pipeline = Pipeline(inputs.get("web"), inputs.get("audio"), inputs.get("knowledge_directory"),
+                            inputs.get("folder_id"))
+        cpu = time.process_time()
+        start = time.perf_counter()
+        pipeline()
+        total = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+
+    seconds = dict(timer.seconds)
+    index = seconds.pop("index", 0.0)
+    embed = seconds.get("embed", 0.0)
+    seconds["upsert"] = max(0.0, index - embed)
+    seconds["cleanup"] = seconds.pop("stale", 0.0) + seconds.pop("delete", 0.0) + seconds.pop("provenance", 0.0)
+    docs = timer.counts["extract_wait"]
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "total_seconds": total,
+        "cpu_seconds": cpu + children.ru_utime + children.ru_stime,
+        **{f"{stage}_seconds": seconds.get(stage, 0.0) for stage in STAGES},
+        "docs": docs,
+        "chunks_produced": chunks["produced"],
+        "chunks_indexed": pipeline.chunk_count,
+        "chunks_embedded": timer.counts["embed"],
+        "docs_per_sec": docs / total if total else 0.0,
+        "chunks_per_sec": chunks["produced"] / total if total else 0.0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_peak_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+def run_passes(workdir: str, inputs: Dict[str, Optional[str]], servers: Dict[str, Any], passes: int) -> Dict[str, Any]:
+    """Runs the pipeline `passes` times over the same state. The first pass ingests everything,
+       later ones measure incremental runs over an unchanged corpus. Request counters of the
+       fakes are attributed to the pass that made them"""
+    results = {}
+    google = servers.get("google")
+    for number in range(passes):
+        before = _costs(servers)
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_pass, workdir, inputs, google.url if google else None).result()
+        after = _costs(servers)
+        result.update({name: after[name] - before[name] for name in after})
+        name = "cold" if number == 0 else f"warm{number}" if passes > 2 else "warm"
+        results[name] = result
+        logger.info(f"{name} pass: {result['total_seconds']:.2f}s, {result['docs']} docs, "
+                    f"{result['chunks_produced']} chunks")
+    return results
+
+
+def _costs(servers: Dict[str, Any]) -> Dict[str, int]:
+    embeddings = servers["embeddings"]
+    costs = {"embedding_requests": embeddings.requests, "embedding_texts": embeddings.texts,
+             "embedding_tokens": embeddings.tokens}
+    if servers.get("google"):
+        costs["drive_api_calls"] = sum(servers["google"].calls.values())
+    if servers.get("web"):
+        calls = servers["web"].calls
+        costs["web_requests"] = sum(calls.values())
+        costs["web_downloads"] = calls["200"]
+    return costs
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Tuple[List[List[str]], bool]:
+    """Rows of (pass, metric, baseline, current, change, verdict) and whether anything regressed
+       by more than `tolerance`, a fraction of the baseline value"""
+    rows, regressed = [], False
+    for setting in ("sizes", "sources", "vectordb"):
+        if baseline.get(setting) != results.get(setting):
+            logger.warning(f"the baseline was run with {setting} {baseline.get(setting)}, not {results.get(setting)}")
+    for name, metrics in results["passes"].items():
+        before = baseline.get("passes", {}).get(name, {})
+        for metric, value in metrics.items():
+            if metric not in before or not isinstance(value, (int, float)):
+                continue
+            old = before[metric]
+            change = (value - old) / old if old else (0.0 if value == old else float("inf"))
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            noise = metric in WORKLOAD or metric.endswith("_seconds") and max(value, old) < MIN_SECONDS
+            verdict = ""
+            if not noise and worse > tolerance:
+                verdict, regressed = "REGRESSION", True
+            elif not noise and worse < -tolerance:
+                verdict = "improved"
+            rows.append([name, metric, _format(old), _format(value), f"{change:+.1%}", verdict])
+    return rows, regressed
+
+
+def _format(value: float) -> str:
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def save(results: Dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def reset(workdir: str) -> None:
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
@@ -0,0 +1,104 @@
+"""End-to-end pipeline benchmark.
+
+    python -m benchmarks.run --scale small --output results.json
+    python -m benchmarks.run --scale small --baseline results.json
+
+Generates a synthetic corpus, serves it from local fakes of Google Drive and the web with the
+stub embedding server and Milvus Lite (or FAISS), runs the pipeline once from empty state and
+then again over the unchanged corpus, and reports per-stage time, throughput, peak RSS and the
+API calls each pass made. With --baseline the run exits with status 1 if any metric is worse
+than the baseline by more than --tolerance. Milvus Lite comes with the milvus-lite extra,
+`poetry install -E milvus-lite`."""
+import importlib.util
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import typer
+
+from aganitha_chatbot_pipeline.stub_embedding_server import StubEmbeddingServer
+from benchmarks import corpus, harness
+from benchmarks.fakes import FakeGoogleServer, FakeWebServer
+
+logger = logging.getLogger(__name__)
+app = typer.Typer()
+
+
+@app.command()
+def run(scale: str = typer.Option("small", help="small, medium or large"),
+        text: Optional[int] = None, pdfs: Optional[int] = None, docs: Optional[int] = None,
+        sheets: Optional[int] = None, pages: Optional[int] = None,
+        audio: Optional[int] = typer.Option(None, help="Audio files, transcribed only when Whisper and ffmpeg exist"),
+        sources: str = typer.Option("knowledge,drive,web,audio", help="Comma separated sources to ingest"),
+        vectordb: str = typer.Option("MILVUS", help="MILVUS (Milvus Lite) or FAISS"),
+        passes: int = typer.Option(2, help="The first pass is cold, later ones are incremental"),
+        dimensions: int = 1536, embedding_latency: float = 0.0, service_latency: float = 0.0,
+        seed: int = 0, workdir: Optional[str] = None, keep: bool = False,
+        output: Optional[str] = None, baseline: Optional[str] = None, tolerance: float = 0.1):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if scale not in corpus.SCALES:
+        raise typer.BadParameter(f"scale must be one of {list(corpus.SCALES)}")
+    sizes = dict(corpus.SCALES[scale])
+    for name, value in (("text", text), ("pdfs", pdfs), ("docs", docs), ("sheets", sheets), ("pages", pages),
+                        ("audio", audio)):
+        if value is not None:
+            sizes[name] = value
+    wanted = set(sources.split(","))
+    if "audio" in wanted and sizes["audio"] and not (importlib.util.find_spec("whisper") and shutil.which("ffmpeg")):
+        logger.warning("Whisper or ffmpeg is missing, audio is left out")
+        wanted.discard("audio")
+
+    workdir = workdir or tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    harness.reset(workdir)
+    logger.info(f"generating the {scale} corpus in {workdir}")
+    generated = corpus.generate(os.path.join(workdir, "corpus"), sizes, seed)
+
+    servers = {"embeddings": StubEmbeddingServer(port=0, dimensions=dimensions, latency=embedding_latency).start()}
+    inputs = {}
+    if "knowledge" in wanted:
+        inputs["knowledge_directory"] = generated["knowledge_directory"]
+    if "drive" in wanted:
+        servers["google"] = FakeGoogleServer(generated["drive"], latency=service_latency).start()
+        inputs["folder_id"] = corpus.ROOT_FOLDER
+    if "web" in wanted:
+        servers["web"] = FakeWebServer(generated["web"], latency=service_latency).start()
+        inputs["web"] = os.path.join(workdir, "urls.txt")
+        with open(inputs["web"], "w") as f:
+            f.write("\n".join(servers["web"].urls()))
+    if "audio" in wanted and "audio" in generated:
+        inputs["audio"] = generated["audio"]
+
+    harness.write_config(workdir, servers["embeddings"].api_base, vectordb)
+    try:
+        results = {"scale": scale, "sizes": sizes, "sources": sorted(inputs), "vectordb": vectordb,
+                   "passes": harness.run_passes(workdir, inputs, servers, passes)}
+    finally:
+        for server in servers.values():
+            server.shutdown()
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, metrics in results["passes"].items():
+        typer.echo(f"\n{name} pass")
+        for metric, value in metrics.items():
+            typer.echo(f"  {metric:24} {value:.3f}" if isinstance(value, float) else f"  {metric:24} {value}")
+    if output:
+        harness.save(results, output)
+        typer.echo(f"\nresults written to {output}")
+    if baseline:
+        rows, regressed = harness.compare(results, harness.load(baseline), tolerance)
+        typer.echo(f"\ncompared with {baseline} (tolerance {tolerance:.0%})")
+        for row in rows:
+            typer.echo("  {:6} {:24} {:>12} {:>12} {:>9} {}".format(*row))
+        if regressed:
+            raise typer.Exit(1)
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
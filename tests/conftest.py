@@ -0,0 +1,51 @@
+from concurrent.futures import Future
+
+import pytest
+
+from aganitha_chatbot_pipeline import transcription
+
+
+class InlineExecutor:
+    """Stands in for the Whisper process pool, runs the initializer once and every task inline"""
+
+    def __init__(self, max_workers, initializer, initargs, mp_context):
+        initializer(*initargs)
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False) -> None:
+        pass
+
+
+class FakeWhisper:
+    """Transcribes a slice to "<file name>@<start>", fails on slices of files named bad*"""
+
+    def transcribe(self, audio):
+        path, start = audio
+        name = path.rsplit("/", 1)[-1]
+        if name.startswith("bad") and start > 0:
+            raise MemoryError("out of memory")
+        return {"segments": [{"text": f" {name}@{start:.0f} "}]}
+
+
+@pytest.fixture
+def whisper(monkeypatch) -> list:
+    """Replaces the Whisper workers with an inline fake, two 600 s slices per file. The list
+       records every model load"""
+    loads = []
+
+    def load(model_size, threads):
+        loads.append(model_size)
+        transcription._model = FakeWhisper()
+
+    monkeypatch.setattr(transcription, "ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr(transcription, "_init_worker", load)
+    monkeypatch.setattr(transcription, "_load_segment", lambda path, start, duration: (path, start))
+    monkeypatch.setattr(transcription.TranscriptionService, "_segment_starts", lambda self, path: [0.0, 600.0])
+    return loads
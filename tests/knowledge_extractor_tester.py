@@ -1,5 +0,0 @@
-from agan_chatbot.knowlede_directory_extractor import KnowledgeDirectoryExtractor
-
-
-knowledge_docs = KnowledgeDirectoryExtractor.directory_loader("/Users/tamil/knowledge")
-print(knowledge_docs)
\ No newline at end of file
@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from aganitha_chatbot_pipeline.bm25_index import BM25Index  # noqa: E402
+
+
+def build(path: str) -> BM25Index:
+    index = BM25Index(path)
+    index.add(["a", "b", "c"], ["the cat sat on the mat", "dogs chase cats", "a mat of woven grass"],
+              [{"source": "one"}, {"source": "two"}, {"source": "one"}])
+    return index
+
+
+def test_search_ranks_by_bm25(tmp_path):
+    index = build(str(tmp_path / "bm25.sqlite"))
+    results = index.search("woven mat", k=2)
+    assert [doc.page_content for doc, _ in results] == ["a mat of woven grass", "the cat sat on the mat"]
+    assert [doc.page_content for doc, _ in index.search("mat", filters={"source": "two"})] == []
+    index.delete(["c"])
+    assert len(index) == 2
+
+
+def test_a_read_only_index_searches_without_writing(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    writer = build(path)
+    reader = BM25Index(path, read_only=True)
+    assert [doc.page_content for doc, _ in reader.search("dogs")] == ["dogs chase cats"]
+    with pytest.raises(sqlite3.OperationalError):
+        reader.add(["d"], ["more text"], [{}])
+    # Ingest goes on while the reader is open
+    writer.add(["d"], ["dogs again"], [{"source": "three"}])
+    assert len(reader.search("dogs", k=5)) == 2
+
+
+def test_a_read_only_index_is_never_created(tmp_path):
+    with pytest.raises(sqlite3.OperationalError):
+        BM25Index(str(tmp_path / "missing.sqlite"), read_only=True).search("anything")
+    assert not (tmp_path / "missing.sqlite").exists()
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("pyarrow")
+
+from langchain.docstore.document import Document  # noqa: E402
+
+from aganitha_chatbot_pipeline.chunk_store import ChunkStore  # noqa: E402
+
+
+def chunk(source: str, chunk_id: str, text: str = "", **metadata) -> Document:
+    return Document(page_content=text or f"text of {chunk_id}",
+                    metadata=dict(metadata, source=source, chunk_id=chunk_id, start_index=0, end_index=1))
+
+
+def stored(store: ChunkStore) -> dict:
+    """{chunk_id: (text, metadata, vector)} of every committed chunk"""
+    chunks = {}
+    for docs, vectors in store.iter_chunks(batch_size=2):
+        for position, doc in enumerate(docs):
+            vector = None if vectors is None or vectors[position] is None else [float(v) for v in vectors[position]]
+            chunks[doc.metadata["chunk_id"]] = (doc.page_content, doc.metadata, vector)
+    return chunks
+
+
+@pytest.fixture(params=["arrow", "parquet"])
+def store(tmp_path, request) -> ChunkStore:
+    return ChunkStore(str(tmp_path / "chunks"), request.param)
+
+
+def test_chunks_round_trip_with_vectors(store):
+    store.add([chunk("a.pdf", "a1", page=1), chunk("a.pdf", "a2"), chunk("b.pdf", "b1")],
+              [[0.5, 1.0], [1.5, 2.0], [2.5, 3.0]])
+    assert stored(store) == {}
+    store.commit()
+    chunks = stored(store)
+    assert set(chunks) == {"a1", "a2", "b1"}
+    text, metadata, vector = chunks["a1"]
+    assert text == "text of a1"
+    assert metadata == {"source": "a.pdf", "page": 1, "chunk_id": "a1", "start_index": 0, "end_index": 1}
+    assert vector == [0.5, 1.0]
+    assert store.stats()["sources"] == 2 and store.stats()["chunks"] == 3
+
+
+def test_chunks_without_vectors(store):
+    store.add([chunk("a.pdf", "a1")])
+    store.commit()
+    for docs, vectors in store.iter_chunks():
+        assert vectors is None
+
+
+def test_a_reprocessed_source_is_replaced(store):
+    store.add([chunk("a.pdf", "a1"), chunk("a.pdf", "a2"), chunk("b.pdf", "b1")])
+    store.commit()
+    store.add([chunk("a.pdf", "a3")])
+    store.commit({"a.pdf": {"a2", "a3"}})
+    assert set(stored(store)) == {"a2", "a3", "b1"}
+
+
+def test_removed_sources_lose_their_partition(store):
+    store.add([chunk("a.pdf", "a1"), chunk("b.pdf", "b1")])
+    store.commit()
+    store.commit({}, removed=["a.pdf"])
+    assert set(stored(store)) == {"b1"}
+
+
+def test_retained_chunks_outlive_their_source(store):
+    store.add([chunk("a.pdf", "shared"), chunk("a.pdf", "a1")])
+    store.commit()
+    store.commit({}, removed=["a.pdf"], retained={"shared"})
+    assert set(stored(store)) == {"shared"}
+
+
+def test_metadata_updates_apply_on_commit(store):
+    store.add([chunk("a.pdf", "a1"), chunk("b.pdf", "b1")])
+    store.commit()
+    store.update_metadata({"b1": {"sources": ["a.pdf", "b.pdf"]}})
+    store.commit({})
+    assert stored(store)["b1"][1]["sources"] == ["a.pdf", "b.pdf"]
+    assert "sources" not in stored(store)["a1"][1]
+
+
+def test_uncommitted_runs_are_dropped(tmp_path):
+    path = str(tmp_path / "chunks")
+    store = ChunkStore(path)
+    store.add([chunk("a.pdf", "a1")])
+    reopened = ChunkStore(path)
+    assert reopened.id == store.id
+    assert stored(reopened) == {}
+    assert not any(name.startswith("pending-") for _, _, names in os.walk(path) for name in names)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        ChunkStore("unused", "csv")
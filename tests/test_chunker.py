@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from aganitha_chatbot_pipeline.chunker import Chunker  # noqa: E402
+
+
+def words(text: str) -> int:
+    return len(text.split())
+
+
+def chunker(chunk_tokens: int, overlap_tokens: int = 0) -> Chunker:
+    return Chunker(chunk_tokens, overlap_tokens, count_tokens=words)
+
+
+def test_short_text_is_one_chunk():
+    text = "  One short paragraph.\n"
+    assert chunker(10).split(text) == [(2, 22)]
+
+
+def test_empty_text_has_no_chunks():
+    assert chunker(10).split("") == []
+    assert chunker(10).split(" \n\n ") == []
+
+
+def test_paragraphs_are_kept_whole():
+    paragraphs = ["one two three four", "five six seven eight", "nine ten eleven twelve"]
+    text = "\n\n".join(paragraphs)
+    chunks = [text[start:end] for start, end in chunker(8).split(text)]
+    assert chunks == ["\n\n".join(paragraphs[:2]), paragraphs[2]]
+
+
+def test_chunks_respect_the_limit_and_cover_the_text():
+    text = " ".join(f"word{number}." for number in range(500))
+    spans = chunker(32, 8).split(text)
+    assert all(words(text[start:end]) <= 32 for start, end in spans)
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    # Consecutive chunks overlap or touch, no text is skipped
+    assert all(next_start <= end + 1 for (_, end), (next_start, _) in zip(spans, spans[1:]))
+
+
+def test_chunks_overlap():
+    text = " ".join(f"s{number}." for number in range(40))
+    spans = chunker(10, 3).split(text)
+    first, second = (text[start:end].split() for start, end in spans[:2])
+    assert first[-3:] == second[:3]
+
+
+def test_text_without_boundaries_is_cut():
+    text = "x" * 1000
+    spans = Chunker(16, 0, count_tokens=lambda piece: len(piece) // 10).split(text)
+    assert len(spans) > 1
+    assert "".join(text[start:end] for start, end in spans) == text
+
+
+def test_overlap_must_be_smaller_than_the_chunk():
+    with pytest.raises(ValueError):
+        chunker(10, 10)
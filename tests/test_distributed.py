@@ -0,0 +1,51 @@
+import json
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+distributed = pytest.importorskip("aganitha_chatbot_pipeline.distributed")
+
+from aganitha_chatbot_pipeline.transcription import TranscriptionService  # noqa: E402
+from aganitha_chatbot_pipeline.video_extractor import VideoExtractor  # noqa: E402
+from aganitha_chatbot_pipeline.work_queue import WorkQueue  # noqa: E402
+
+
+def fake_pipeline() -> SimpleNamespace:
+    return SimpleNamespace(work_queue={"POLL_SECONDS": 0}, metrics={}, transcription_service=TranscriptionService)
+
+
+def extract_audio(path: str, work_directory: str) -> str:
+    audio_file = f"{work_directory}/{path.rsplit('/', 1)[-1]}.wav"
+    shutil.copyfile(path, audio_file)
+    return audio_file
+
+
+def test_a_worker_loads_whisper_once_for_every_video(tmp_path, whisper, monkeypatch):
+    monkeypatch.setattr(VideoExtractor, "_extract_audio", staticmethod(extract_audio))
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    for name in ("one.mp4", "two.mp4"):
+        (videos / name).write_bytes(name.encode("utf-8"))
+        queue.enqueue([(f"video:{name}", "video", name, {"path": str(videos / name), "directory": str(videos)}, "1")])
+    worker = distributed.Worker(fake_pipeline(), queue, "test")
+    assert worker.run(exit_when_idle=True) == 2
+    assert whisper == ["small"]
+    transcripts = [doc.page_content for _, item in queue.finished() for doc in queue.results(item)]
+    assert transcripts == ["one.mp4.wav@0 one.mp4.wav@600", "two.mp4.wav@0 two.mp4.wav@600"]
+
+
+def test_workers_only_claim_items_of_directories_they_share(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    worker = distributed.Worker(fake_pipeline(), queue, "test")
+    assert worker.claimable() is None
+    distributed.share_directories(queue, {str(tmp_path / "videos"): ["video", "gdrive"],
+                                           str(tmp_path / "knowledge"): ["knowledge_directory"]})
+    assert worker.claimable() is None
+    # A worker on another node, where the video directory is a local directory of the same name
+    shared = json.loads(queue.get("shared_directories"))
+    (tmp_path / "videos" / distributed.SHARED_MARKER).write_text("another coordinator")
+    other = distributed.Worker(fake_pipeline(), queue, "other")
+    assert other.claimable() == ["website", "knowledge_directory"]
+    assert shared[str(tmp_path / "videos")][1] == ["gdrive", "video"]
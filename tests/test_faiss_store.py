@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain")
+
+import numpy as np  # noqa: E402
+
+from aganitha_chatbot_pipeline.faiss_store import FaissStore  # noqa: E402
+
+
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        raise AssertionError("vectors are given")
+
+
+def vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((count, 8), dtype=np.float32)
+
+
+def metadatas(count: int, start: int = 0):
+    return [{"chunk_id": f"c{number}", "source": f"s{number % 3}"} for number in range(start, start + count)]
+
+
+def test_removed_hnsw_vectors_are_skipped(tmp_path):
+    store = FaissStore(str(tmp_path), NoEmbeddings(), "HNSW", compact_ratio=1.0)
+    data = vectors(50)
+    store.add_texts([f"text {number}" for number in range(50)], metadatas(50), data)
+    store.delete([f"c{number}" for number in range(10)])
+    results = store.similarity_search_by_vector_with_score(list(data[0]), k=5)
+    assert len(results) == 5
+    assert all(doc.metadata["chunk_id"] not in {f"c{number}" for number in range(10)} for doc, _ in results)
+    filtered = store.similarity_search_by_vector_with_score(list(data[20]), k=3, filters={"source": "s2"})
+    assert filtered[0][0].metadata["chunk_id"] == "c20"
+
+
+def test_searches_run_alongside_writes(tmp_path):
+    store = FaissStore(str(tmp_path), NoEmbeddings(), "HNSW")
+    data = vectors(200)
+    store.add_texts([f"text {number}" for number in range(200)], metadatas(200), data)
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                store.similarity_search_by_vector_with_score(list(data[7]), k=4)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for round in range(50):
+        store.delete([f"c{100 + round}"])
+        store.add_texts([f"again {round}"], metadatas(1, 100 + round), vectors(1, round + 1))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,105 @@
+from aganitha_chatbot_pipeline.manifest import Manifest, content_hash, file_hash, source_key
+
+
+def open_manifest(tmp_path) -> Manifest:
+    return Manifest(str(tmp_path / "manifest.sqlite"))
+
+
+def ingest(manifest: Manifest, sources: dict) -> None:
+    """One run over {source_id: (fingerprint, chunk_ids)} of type "knowledge" """
+    manifest.begin(["knowledge"])
+    for source_id, (fingerprint, chunk_ids) in sources.items():
+        if not manifest.is_unchanged(source_id, "knowledge", fingerprint):
+            manifest.set_chunk_ids(source_id, chunk_ids)
+    manifest.commit()
+
+
+def test_source_key_prefers_the_id():
+    assert source_key({"id": "drive-id", "source": "a.pdf"}) == "drive-id"
+    assert source_key({"source": "a.pdf"}) == "a.pdf"
+    assert content_hash("text") == content_hash(b"text")
+
+
+def test_file_hash_matches_the_content_hash(tmp_path):
+    path = tmp_path / "large.bin"
+    data = bytes(range(256)) * 10000
+    path.write_bytes(data)
+    assert file_hash(str(path)) == content_hash(data)
+
+
+def test_unchanged_sources_are_skipped(tmp_path):
+    manifest = open_manifest(tmp_path)
+    ingest(manifest, {"a": ("1", ["c1", "c2"])})
+    manifest.begin(["knowledge"])
+    assert manifest.is_unchanged("a", "knowledge", "1")
+    assert not manifest.is_unchanged("a", "knowledge", "2")
+    assert manifest.changed_sources() == ["a"]
+    assert manifest.chunk_ids("a") == {"c1", "c2"}
+
+
+def test_nothing_is_recorded_before_commit(tmp_path):
+    manifest = open_manifest(tmp_path)
+    manifest.begin(["knowledge"])
+    assert not manifest.is_unchanged("a", "knowledge", "1")
+    manifest.set_chunk_ids("a", ["c1"])
+    manifest.close()
+    manifest = open_manifest(tmp_path)
+    manifest.begin(["knowledge"])
+    assert not manifest.is_unchanged("a", "knowledge", "1")
+    assert manifest.chunk_ids("a") == set()
+
+
+def test_removed_sources_are_forgotten_on_commit(tmp_path):
+    manifest = open_manifest(tmp_path)
+    ingest(manifest, {"a": ("1", ["c1"]), "b": ("1", ["c2"])})
+    manifest.begin(["knowledge"])
+    manifest.is_unchanged("a", "knowledge", "1")
+    assert manifest.removed_sources() == ["b"]
+    manifest.forget(["b"])
+    # Staged only, a failure before the commit leaves the source in place
+    assert manifest.chunk_ids("b") == {"c2"}
+    assert manifest.referenced({"c1", "c2"}) == {"c1"}
+    manifest.commit()
+    assert manifest.chunk_ids("b") == set()
+
+
+def test_inactive_source_types_are_not_removed(tmp_path):
+    manifest = open_manifest(tmp_path)
+    ingest(manifest, {"a": ("1", ["c1"])})
+    manifest.begin(["video"])
+    assert manifest.removed_sources() == []
+
+
+def test_discarded_sources_keep_their_chunks(tmp_path):
+    manifest = open_manifest(tmp_path)
+    ingest(manifest, {"a": ("1", ["c1"])})
+    manifest.begin(["knowledge"])
+    assert not manifest.is_unchanged("a", "knowledge", "2")
+    manifest.set_chunk_ids("a", [])
+    manifest.discard(["a", "b"])
+    assert manifest.changed_sources() == []
+    assert manifest.removed_sources() == []
+    manifest.commit()
+    assert manifest.chunk_ids("a") == {"c1"}
+    manifest.begin(["knowledge"])
+    assert manifest.is_unchanged("a", "knowledge", "1")
+
+
+def test_shared_chunks_stay_referenced(tmp_path):
+    manifest = open_manifest(tmp_path)
+    ingest(manifest, {"a": ("1", ["shared", "c1"]), "b": ("1", ["shared"])})
+    manifest.begin(["knowledge"])
+    manifest.is_unchanged("a", "knowledge", "2")
+    manifest.set_chunk_ids("a", ["c3"])
+    assert manifest.referenced({"shared", "c1"}) == {"shared"}
+
+
+def test_binding_another_store_forgets_every_source(tmp_path):
+    manifest = open_manifest(tmp_path)
+    manifest.bind("FAISS:index")
+    ingest(manifest, {"a": ("1", ["c1"])})
+    manifest.bind("FAISS:index")
+    assert manifest.chunk_ids("a") == {"c1"}
+    manifest.bind("MILVUS:collection")
+    assert manifest.chunk_ids("a") == set()
+    assert manifest.get("vector_store") == "MILVUS:collection"
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from aganitha_chatbot_pipeline.milvus_store import ENVIRONMENT, connection_args  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_milvus_environment(monkeypatch):
+    for name in ENVIRONMENT.values():
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_a_file_uri_needs_no_credentials():
+    assert connection_args({"URI": "milvus.db", "USER": "", "PASSWORD": ""}) == {"alias": "default", "uri": "milvus.db"}
+
+
+def test_the_environment_takes_precedence(monkeypatch):
+    monkeypatch.setenv("MILVUS_URI", "https://cluster:19541")
+    monkeypatch.setenv("MILVUS_USER", "admin")
+    monkeypatch.setenv("MILVUS_PASSWORD", "secret")
+    args = connection_args({"URI": "milvus.db", "USER": "", "PASSWORD": "", "SECURE": True})
+    assert args == {"alias": "default", "uri": "https://cluster:19541", "user": "admin", "password": "secret",
+                    "secure": True}
+
+
+def test_a_uri_is_required():
+    with pytest.raises(ValueError):
+        connection_args({"URI": ""})
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.docstore.document import Document  # noqa: E402
+
+from aganitha_chatbot_pipeline.retrieval import normalize_query, reciprocal_rank_fusion  # noqa: E402
+
+
+def chunk(chunk_id: str) -> Document:
+    return Document(page_content=f"text of {chunk_id}", metadata={"chunk_id": chunk_id})
+
+
+def ranking(*chunk_ids: str):
+    return [(chunk(chunk_id), 0.0) for chunk_id in chunk_ids]
+
+
+def test_chunks_in_both_rankings_come_first():
+    fused = reciprocal_rank_fusion([ranking("a", "b", "c"), ranking("c", "d")], k=4)
+    assert [doc.metadata["chunk_id"] for doc, _ in fused] == ["c", "a", "b", "d"]
+    assert fused[0][1] == 1 / 63 + 1 / 61
+
+
+def test_fusion_keeps_the_top_k():
+    fused = reciprocal_rank_fusion([ranking("a", "b", "c")], k=2, rrf_k=0)
+    assert [(doc.metadata["chunk_id"], score) for doc, score in fused] == [("a", 1.0), ("b", 0.5)]
+
+
+def test_chunks_without_an_id_are_matched_on_text():
+    vector = [(Document(page_content="same"), 0.1)]
+    keyword = [(Document(page_content="same"), 7.0), (Document(page_content="other"), 3.0)]
+    fused = reciprocal_rank_fusion([vector, keyword], k=5)
+    assert [doc.page_content for doc, _ in fused] == ["same", "other"]
+
+
+def test_empty_rankings():
+    assert reciprocal_rank_fusion([[], []], k=3) == []
+
+
+def test_queries_are_normalized():
+    assert normalize_query("  what   is\n RRF ") == "what is RRF"
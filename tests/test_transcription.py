@@ -0,0 +1,34 @@
+from aganitha_chatbot_pipeline.transcription import TranscriptionService, file_hash
+
+
+def audio(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_bytes(name.encode("utf-8"))
+    return str(path)
+
+
+def test_slices_are_stitched_in_order(tmp_path, whisper):
+    path = audio(tmp_path, "talk.wav")
+    transcripts, failed = TranscriptionService().transcribe([path])
+    assert transcripts == {path: "talk.wav@0 talk.wav@600"}
+    assert failed == []
+
+
+def test_a_failed_file_leaves_the_others_transcribed(tmp_path, whisper):
+    good, bad = audio(tmp_path, "good.wav"), audio(tmp_path, "bad.wav")
+    service = TranscriptionService(cache_dir=str(tmp_path / "cache"))
+    transcripts, failed = service.transcribe([bad, good])
+    assert list(transcripts) == [good]
+    assert failed == [bad]
+    # The finished file was cached, it is not transcribed again
+    assert service._cached(file_hash(good)) == transcripts[good]
+
+
+def test_the_model_is_loaded_once_across_calls(tmp_path, whisper):
+    service = TranscriptionService(workers=1)
+    service.transcribe([audio(tmp_path, "one.wav")])
+    service.transcribe([audio(tmp_path, "two.wav")])
+    assert whisper == ["small"]
+    service.close()
+    service.transcribe([audio(tmp_path, "three.wav")])
+    assert whisper == ["small", "small"]
@@ -0,0 +1,76 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("bs4")
+pytest.importorskip("langchain")
+
+from aganitha_chatbot_pipeline.web_crawler import ResponseCache, WebCrawler  # noqa: E402
+
+
+class Pages(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/gone"):
+            self.send_error(404)
+            return
+        body = f"<html><body><p>page {self.path}</p></body></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("ETag", f'"{self.path}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Pages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def crawler_threads() -> int:
+    return sum(thread.name == "web-crawler" for thread in threading.enumerate())
+
+
+def test_pages_are_fetched_and_cached(site, tmp_path):
+    cache_path = str(tmp_path / "responses.sqlite")
+    crawler = WebCrawler(cache_path=cache_path)
+    docs = crawler.load([f"{site}/a", f"{site}/b", f"{site}/gone"])
+    assert sorted(doc.metadata["source"] for doc in docs) == [f"{site}/a", f"{site}/b"]
+    assert crawler.failed == []
+    cache = ResponseCache(cache_path)
+    assert cache.get(f"{site}/a")[0] == '"/a"'
+    cache.close()
+
+
+def test_a_consumer_that_stops_stops_the_crawl(site):
+    before = crawler_threads()
+    pages = WebCrawler(concurrency=2).lazy_load([f"{site}/{number}" for number in range(200)], buffer=1)
+    next(pages)
+    pages.close()
+    deadline = time.monotonic() + 10
+    while crawler_threads() > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert crawler_threads() == before
+
+
+def test_cache_writes_are_committed_in_batches(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(path, commit_every=2)
+    cache.put("http://example.com/1", None, None, "one")
+    reader = ResponseCache(path)
+    assert reader.get("http://example.com/1") is None
+    cache.put("http://example.com/2", None, None, "two")
+    assert reader.get("http://example.com/1")[2] == "one"
+    cache.put("http://example.com/3", None, None, "three")
+    cache.close()
+    assert reader.get("http://example.com/3")[2] == "three"
+    reader.close()
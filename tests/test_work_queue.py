@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.docstore.document import Document  # noqa: E402
+
+from aganitha_chatbot_pipeline.work_queue import WorkQueue  # noqa: E402
+
+
+def open_queue(tmp_path, **kwargs) -> WorkQueue:
+    return WorkQueue(str(tmp_path / "queue.sqlite"), **kwargs)
+
+
+def item(key: str, fingerprint: str = "1", source_type: str = "knowledge"):
+    return key, source_type, key, {"path": key}, fingerprint
+
+
+def test_items_are_claimed_once_in_order(tmp_path):
+    queue = open_queue(tmp_path)
+    assert queue.enqueue([item("a"), item("b")]) == 2
+    first = queue.claim("w1")
+    second = queue.claim("w2")
+    assert (first.key, second.key) == ("a", "b")
+    assert first.payload == {"path": "a"} and first.attempts == 1
+    assert queue.claim("w3") is None
+    assert queue.counts() == {"pending": 0, "leased": 2, "done": 0, "dead": 0}
+
+
+def test_claims_filter_on_source_type(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue([item("a"), item("v", source_type="video")])
+    assert queue.claim("w", ["video"]).key == "v"
+    assert queue.claim("w", ["video"]) is None
+
+
+def test_results_are_stored_with_completion(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue([item("a")])
+    claimed = queue.claim("w")
+    docs = [Document(page_content="one", metadata={"source": "a"}),
+            Document(page_content="two", metadata={"source": "a"})]
+    assert queue.complete(claimed, "w", docs)
+    [(seq, done)] = queue.finished()
+    assert done.key == "a"
+    assert [doc.page_content for doc in queue.results(done)] == ["one", "two"]
+    assert queue.finished(after=seq) == []
+    assert queue.drain() == 1
+    assert queue.counts()["done"] == 0
+
+
+def test_only_the_lease_holder_completes(tmp_path):
+    queue = open_queue(tmp_path, lease_seconds=0.0)
+    queue.enqueue([item("a")])
+    stale = queue.claim("w1")
+    time.sleep(0.01)
+    # The lease ran out, another worker takes the item over
+    taken = queue.claim("w2")
+    assert taken.key == "a" and taken.attempts == 2
+    assert not queue.renew(stale, "w1")
+    assert not queue.complete(stale, "w1", [Document(page_content="late")])
+    assert queue.complete(taken, "w2", [])
+
+
+def test_failed_items_are_retried_then_buried(tmp_path):
+    queue = open_queue(tmp_path, max_attempts=2, retry_delay=0.0)
+    queue.enqueue([item("a")])
+    queue.fail(queue.claim("w"), "w", "first")
+    claimed = queue.claim("w")
+    assert claimed.attempts == 2
+    queue.fail(claimed, "w", "second")
+    assert queue.claim("w") is None
+    assert [dead.key for dead in queue.dead()] == ["a"]
+    assert queue.dead_letters()[0]["error"] == "second"
+    assert queue.requeue() == 1
+    assert queue.claim("w").attempts == 1
+
+
+def test_enqueue_keeps_items_with_the_same_fingerprint(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue([item("a"), item("b")])
+    queue.complete(queue.claim("w"), "w", [Document(page_content="a")])
+    assert queue.enqueue([item("a"), item("b")]) == 0
+    assert queue.counts()["done"] == 1
+    assert queue.enqueue([item("a", "2")]) == 1
+    assert queue.counts()["done"] == 0
+
+
+def test_prune_drops_items_of_vanished_sources(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue([item("a"), item("b"), item("v", source_type="video")])
+    assert queue.prune(["a"], ["knowledge"]) == 1
+    assert queue.counts() == {"pending": 2, "leased": 0, "done": 0, "dead": 0}
@@ -1,4 +0,0 @@
-from agan_chatbot.website_extractor import WebsiteExtractor
-
-web_docs = WebsiteExtractor.website_loader("/Users/tamil/urls.txt")
-print(web_docs)
\ No newline at end of file